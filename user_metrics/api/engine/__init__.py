@@ -18,9 +18,13 @@
         http://metrics-api.wikimedia.org/cohorts/1&2~3~4/bytes_added
 
     The portion of the path ``1&2~3~4``, resolves to the boolean expression
-    "1 AND 2 OR 3 OR 4".  The cohorts that correspond to the numeric ID values
-    in ``usertags_meta`` are resolved to sets of user ID longs which are then
-    operated on with union and intersect operations to yield a custom user
+    "1 AND 2 OR 3 OR 4".  A cohort ID may be negated by prefixing it with
+    ``^``, so ``1&^2`` selects the users of cohort 1 that are not in cohort
+    2.  Each term between ORs must include at least one cohort that is not
+    negated.  The cohorts that correspond to the numeric ID values in
+    ``usertags_meta`` are resolved to sorted arrays of user IDs, kept by the
+    cohort cache (see ``cohort_cache``), which are then operated on with
+    union, intersect and difference operations to yield a custom user
     list.  The power of this functionality lies in that it allows subsets of
     users to be selected based on prior conditions that includes them in a
     given cohort.
@@ -35,7 +39,9 @@ __date__ = "january 11 2012"
 __license__ = "GPL (version 2 or later)"
 
 from re import search
-from user_metrics.api import MetricsAPIError, query_mod
+from numpy import intersect1d, setdiff1d, union1d
+from user_metrics.api import MetricsAPIError
+from user_metrics.api.engine.cohort_cache import get_cohort_cache
 
 #
 # Define remaining constants
@@ -59,11 +65,11 @@ DEFAULT_QUERY_VAL = 'present'
 # ======================
 
 # This regex must be matched to parse cohorts
-COHORT_REGEX = r'^([0-9]+[&~])*[0-9]+$'
+COHORT_REGEX = r'^(\^?[0-9]+[&~])*\^?[0-9]+$'
 
 COHORT_OP_AND = '&'
 COHORT_OP_OR = '~'
-# COHORT_OP_NOT = '^'
+COHORT_OP_NOT = '^'
 
 
 def parse_cohorts(expression):
@@ -84,38 +90,41 @@ def parse_cohorts(expression):
         raise MetricsAPIError()
 
     # parse expression
-    return parse(expression)
+    return [str(user_id) for user_id in parse(expression).tolist()]
 
 
 def parse(expression):
     """ Top level parsing. Splits expression by OR then sub-expressions by
-        AND. returns a generator of ids included in the evaluated expression
+        AND. Returns the sorted array of ids included in the evaluated
+        expression.
     """
-    user_ids_seen = set()
+    user_ids = None
     for sub_exp_1 in expression.split(COHORT_OP_OR):
-        for user_id in intersect_ids(sub_exp_1.split(COHORT_OP_AND)):
-            if not user_ids_seen.__contains__(user_id):
-                user_ids_seen.add(user_id)
-                yield user_id
+        term_ids = intersect_ids(sub_exp_1.split(COHORT_OP_AND))
+        user_ids = term_ids if user_ids is None else \
+            union1d(user_ids, term_ids)
+    return user_ids
 
 
 def intersect_ids(cohort_id_list):
-
-    user_ids = dict()
-    # only a single cohort id in the expression - return all users of this
-    # cohort
-    if len(cohort_id_list) == 1:
-        for id in query_mod.get_cohort_users(cohort_id_list[0]):
-            yield id
-    else:
-        for cid in cohort_id_list:
-            for id in query_mod.get_cohort_users(cid):
-                if id in user_ids:
-                    user_ids[id] += 1
-                else:
-                    user_ids[id] = 1
-                    # Executes only in the case that there was more than one
-                    # cohort id in the expression
-        for key in user_ids:
-            if user_ids[key] > 1:
-                yield key
+    """
+        Returns the sorted array of ids in all cohorts of ``cohort_id_list``
+        that are not negated and in none of those that are.
+    """
+    include = [cid for cid in cohort_id_list
+               if not cid.startswith(COHORT_OP_NOT)]
+    exclude = [cid[len(COHORT_OP_NOT):] for cid in cohort_id_list
+               if cid.startswith(COHORT_OP_NOT)]
+    if not include:
+        raise MetricsAPIError(__name__ + ' :: A cohort term must include a '
+                                         'cohort that is not negated.')
+
+    cache = get_cohort_cache()
+    # Start from the smallest cohort to keep intermediate arrays small
+    cohorts = sorted([cache.get(cid) for cid in include], key=len)
+    user_ids = cohorts[0]
+    for cohort in cohorts[1:]:
+        user_ids = intersect1d(user_ids, cohort, assume_unique=True)
+    for cid in exclude:
+        user_ids = setdiff1d(user_ids, cache.get(cid), assume_unique=True)
+    return user_ids
@@ -0,0 +1,159 @@
+"""
+    Materialised cohorts.
+
+    The users of each cohort (a ``usertags`` tag) are stored as a sorted
+    array of unsigned 32 bit user IDs in a NumPy file under
+    ``settings.__cohort_cache_dir__``.  Files are named after the tag ID and
+    the cohort's ``utm_touched`` time so that a cohort modified since it was
+    stored is read again from the database. ::
+
+        >>> from user_metrics.api.engine.cohort_cache import get_cohort_cache
+        >>> get_cohort_cache().get(tag_id)
+        array([  13234584,   15013214, ...], dtype=uint32)
+
+    Checking ``utm_touched`` costs a query, so a stored cohort is trusted
+    for ``__cohort_cache_check_interval__`` seconds after it was last
+    checked.  The modification time of the file records the last check.
+    Cohort expressions are evaluated over these arrays with NumPy set
+    operations, see ``user_metrics.api.engine.parse``.
+"""
+
+__author__ = {
+    "ryan faulkner": "rfaulkner@wikimedia.org"
+}
+__date__ = "2013-04-12"
+__license__ = "GPL (version 2 or later)"
+
+from glob import glob
+from os import fdopen, makedirs, remove, rename, utime
+from os.path import basename, exists, getmtime, join
+from tempfile import mkstemp
+from time import time
+
+from numpy import array, load, save, uint32, unique
+
+from user_metrics.config import logging, settings
+from user_metrics.api import query_mod
+
+
+# Location of materialised cohorts and the interval between checks of
+# their modification time
+COHORT_CACHE_DIR = getattr(settings, '__cohort_cache_dir__',
+                           settings.__data_file_dir__ + 'cohorts/')
+COHORT_CACHE_CHECK_INTERVAL = getattr(settings,
+                                      '__cohort_cache_check_interval__', 60)
+
+# Format of ``utm_touched`` in file names
+TOUCHED_FORMAT = '%Y%m%d%H%M%S'
+
+
+class CohortCacheError(Exception):
+    """ Basic exception class for the cohort cache """
+    def __init__(self, message="Could not materialise cohort."):
+        Exception.__init__(self, message)
+
+
+class CohortCache(object):
+    """
+        Store of materialised cohorts in the directory ``path``.  Cohorts
+        are trusted for ``check_interval`` seconds between checks of
+        ``utm_touched``, 0 checks on every read.
+    """
+
+    def __init__(self, path=COHORT_CACHE_DIR,
+                 check_interval=COHORT_CACHE_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+
+    def _files(self, tag_id):
+        """ Files stored for ``tag_id``, most recent first """
+        return sorted(glob(join(self.path, '{0}-*.npy'.format(int(tag_id)))),
+                      reverse=True)
+
+    def _file(self, tag_id, touched):
+        return join(self.path, '{0}-{1}.npy'.format(
+            int(tag_id), touched.strftime(TOUCHED_FORMAT)))
+
+    def get(self, tag_id):
+        """ Returns the sorted array of user IDs of cohort ``tag_id`` """
+        files = self._files(tag_id)
+        if files and time() - getmtime(files[0]) < self.check_interval:
+            try:
+                return load(files[0])
+            except (IOError, ValueError) as e:
+                logging.error(__name__ + ' :: Could not read {0}: {1}'.format(
+                    files[0], str(e)))
+
+        touched = query_mod.get_cohort_touched(tag_id)
+        if not touched:
+            # Unknown modification time, the cohort cannot be kept
+            return self._read(tag_id)
+
+        path = self._file(tag_id, touched)
+        if path in files:
+            try:
+                users = load(path)
+                utime(path, None)
+                return users
+            except (IOError, OSError, ValueError) as e:
+                logging.error(__name__ + ' :: Could not read {0}: {1}'.format(
+                    path, str(e)))
+
+        users = self._read(tag_id)
+        try:
+            self._store(path, users)
+        except CohortCacheError as e:
+            logging.error(e.message)
+        for stale in files:
+            if stale != path:
+                try:
+                    remove(stale)
+                except OSError:
+                    pass
+        return users
+
+    def _read(self, tag_id):
+        """ Reads the users of cohort ``tag_id`` from the database """
+        start = time()
+        try:
+            users = unique(array([int(user) for user in
+                                  query_mod.get_cohort_users(tag_id)],
+                                 dtype=uint32))
+        except (ValueError, OverflowError) as e:
+            raise CohortCacheError(__name__ + ' :: Bad user ID in cohort '
+                                              '{0}: {1}'.format(tag_id,
+                                                                str(e)))
+        logging.debug(__name__ + ' :: Read {0} users of cohort {1} in '
+                                 '{2:.3f}s.'.format(len(users), tag_id,
+                                                    time() - start))
+        return users
+
+    def _store(self, path, users):
+        """ Writes ``users`` to ``path`` via a temporary file """
+        if not exists(self.path):
+            try:
+                makedirs(self.path)
+            except OSError:
+                # Created concurrently
+                pass
+        try:
+            fd, tmp_path = mkstemp(dir=self.path, suffix='.tmp')
+            with fdopen(fd, 'wb') as cohort_file:
+                save(cohort_file, users)
+            rename(tmp_path, path)
+        except (IOError, OSError) as e:
+            raise CohortCacheError(__name__ + ' :: Could not store {0}: '
+                                              '{1}'.format(basename(path),
+                                                           str(e)))
+
+
+# Cohort cache shared within this process
+_cohort_cache = None
+
+
+def get_cohort_cache():
+    """ Returns the cohort cache configured in settings """
+    global _cohort_cache
+    if _cohort_cache is None:
+        _cohort_cache = CohortCache()
+    return _cohort_cache
@@ -17,27 +17,22 @@
 
     The other portion of data storage and retrieval is concerned with providing
     functionality that enables responses to be cached.  Request responses are
-    currently cached in the ``api_data`` OrderedDict_ defined in the run
-    module.  This object stores responses in a nested fashion using URL request
-    variables and their corresponding values.  For example, the url
+    identified by the URL request variables and their corresponding values.
+    For example, the url
     ``http://metrics-api.wikimedia.org/cohorts/e3_ob2b/revert_rate?t=10000``
     maps to::
 
-        api_data['cohort_expr <==> e3_ob2b']['metric <==> revert_rate']
-        ['start <==> xx']['start <==> yy']['t <==> 10000']
+        ['cohort_expr <==> e3_ob2b', 'metric <==> revert_rate',
+         'start <==> xx', 'start <==> yy', 't <==> 10000']
 
     The list of key values for a given request is referred to as it's "key
     signature".  The order of parameters is perserved.
 
-    The ``get_data`` method requires a reference to ``api_data``. Given this
-    reference and a RequestMeta object the method attempts to find an entry
-    for the request if one exists.  The ``set_data`` method does much the
-    same operation but performs storage into the hash reference passed.
-    The method ``get_url_from_keys`` builds URLs from nested hash references
-    using the key list and ``build_key_tree`` recursively builds a tree
-    representation of all of the key paths in the hash reference.
-
-    .. _OrderedDict: http://docs.python.org/2/library/collections.html
+    Responses are stored in the ``ResponseCache`` of the ``response_cache``
+    module keyed on the hash of the key signature.  Given a RequestMeta object
+    the ``get_data`` method attempts to find an entry for the request if one
+    exists.  The ``set_data`` method stores a response along with the full key
+    signature from which ``get_url_from_keys`` builds the request URL.
 
 """
 
@@ -50,18 +45,19 @@ __license__ = "GPL (version 2 or later)"
 
 from datetime import datetime
 from re import search
-from collections import OrderedDict
 from hashlib import sha1
-import cPickle
 
-import user_metrics.etl.data_loader as dl
 from user_metrics.config import logging
 from user_metrics.api.engine import COHORT_REGEX, parse_cohorts, \
     DATETIME_STR_FORMAT
 from user_metrics.api.engine.request_meta import REQUEST_META_QUERY_STR,\
     REQUEST_META_BASE
 from user_metrics.api import MetricsAPIError, query_mod
-from user_metrics.config import settings
+from user_metrics.api.engine.response_cache import get_cache, \
+    ResponseCacheError
+from user_metrics.api.engine.result_transport import decode_result
+from user_metrics.api.engine.cohort_cache import get_cohort_cache, \
+    CohortCacheError
 
 
 # This is used to separate key meta and key strings for hash table data
@@ -79,8 +75,8 @@ def get_users(cohort_expr):
         logging.info(__name__ + ' :: Processing cohort by tag name.')
         try:
             id = query_mod.get_cohort_id(cohort_expr)
-            users = [u for u in query_mod.get_cohort_users(id)]
-        except (IndexError, TypeError,
+            users = [str(u) for u in get_cohort_cache().get(id).tolist()]
+        except (IndexError, TypeError, CohortCacheError,
                 query_mod.UMQueryCallError) as e:
             logging.error(__name__ + ' :: Could not retrieve users '
                                      'for cohort {0}: {1}'.
@@ -94,17 +90,11 @@ def get_cohort_refresh_datetime(utm_id):
         Get the latest refresh datetime of a cohort.  Returns current time
         formatted as a string if the field is not found.
     """
-
-    # @TODO MOVE DB REFS INTO QUERY MODULE
-    conn = dl.Connector(instance=settings.__cohort_data_instance__)
-    query = """ SELECT utm_touched FROM usertags_meta WHERE utm_id = %s """
-    conn._cur_.execute(query, int(utm_id))
-
     utm_touched = None
     try:
-        utm_touched = conn._cur_.fetchone()[0]
-    except ValueError:
-        pass
+        utm_touched = query_mod.get_cohort_touched(utm_id)
+    except query_mod.UMQueryCallError as e:
+        logging.error(e.message)
 
     # Ensure the field was retrieved
     if not utm_touched:
@@ -112,88 +102,61 @@ def get_cohort_refresh_datetime(utm_id):
                                  str(utm_id))
         utm_touched = datetime.now()
 
-    del conn
     return utm_touched.strftime(DATETIME_STR_FORMAT)
 
 
 def get_data(request_meta, hash_result=True):
     """
-        Extract data from the global hash given a request object.  If an item
-        is successfully recovered data is returned
+        Extract data from the response cache given a request object.  If an
+        item is successfully recovered data is returned
     """
 
-    hash_table_ref = read_pickle_data()
-
-    # Traverse the hash key structure to find data
-    # @TODO rather than iterate through REQUEST_META_BASE &
-    #   REQUEST_META_QUERY_STR look only at existing attributes
-
     logging.debug(__name__ + " - Attempting to pull data for request " \
                              "COHORT {0}, METRIC {1}".
                   format(request_meta.cohort_expr, request_meta.metric))
 
     key_sig = build_key_signature(request_meta, hash_result=hash_result)
-    item = find_item(hash_table_ref, key_sig)
+    try:
+        item = get_cache().get(cache_key(key_sig))
+    except ResponseCacheError as e:
+        logging.error(e.message)
+        return None
 
     if item:
-        # item[0] will be a stringified structure that
-        # is initialized, see set_data.
-        return eval(item[0])
-    else:
-        return None
+        # item will be a JSON payload, see set_data.
+        try:
+            return decode_result(item)
+        except ValueError:
+            logging.error(__name__ + ' :: Could not decode cached data '
+                                     'for {0}.'.format(str(key_sig)))
+    return None
 
 
 def set_data(data, request_meta, hash_result=True):
     """
-        Given request meta-data and a dataset create a key path in the global
-        hash to store the data
+        Given request meta-data and a JSON encoded dataset (see
+        ``result_transport``) store the data in the response cache under the
+        key signature of the request
     """
-    hash_table_ref = read_pickle_data()
-
     key_sig = build_key_signature(request_meta, hash_result=hash_result)
-    logging.debug(__name__ + " :: Adding data to hash @ key signature = {0}".
+    logging.debug(__name__ + " :: Adding data to cache @ key signature = {0}".
                   format(str(key_sig)))
-    if hash_result:
-        key_sig_full = build_key_signature(request_meta, hash_result=False)
-        hash_table_ref[key_sig] = (data, key_sig_full)
-    else:
-        last_item = key_sig[-1]
-        for item in key_sig:
-            if item == last_item:
-                hash_table_ref[last_item] = data
-            else:
-                hash_table_ref[item] = OrderedDict()
-            hash_table_ref = hash_table_ref[item]
-    write_pickle_data(hash_table_ref)
 
+    key_sig_full = build_key_signature(request_meta, hash_result=False)
+    try:
+        get_cache().set(cache_key(key_sig), data, key_sig_full)
+    except ResponseCacheError as e:
+        logging.error(e.message)
 
-def find_item(hash_table_ref, key_sig):
-    """
-        For each key in the key signature add a nested key to the hash.
 
-        Parameters
-        ~~~~~~~~~~
-    """
-    if not hasattr(key_sig, '__iter___'):
-        key_sig = [key_sig]
-
-    last_item = key_sig[len(key_sig) - 1]
-    for key in key_sig:
-        if key != last_item:
-            if hasattr(hash_table_ref, 'keys') and key in hash_table_ref:
-                hash_table_ref = hash_table_ref[key]
-            else:
-                # Item not found
-                return None
-        else:
-            if hasattr(hash_table_ref, 'keys') and \
-                key in hash_table_ref:
-                    return hash_table_ref[key]
-            # Item not found
-            return None
+def cache_key(key_sig):
+    """ Cache keys are hashed key signatures """
+    if hasattr(key_sig, '__iter__'):
+        return sha1(str(key_sig).encode('utf-8')).hexdigest()
+    return key_sig
 
 
-def build_key_signature(request_meta, hash_result=False):
+def build_key_signature(request_meta, hash_result=False, exclude=()):
     """
         Given a RequestMeta object contruct a hashkey.
 
@@ -202,6 +165,9 @@ def build_key_signature(request_meta, hash_result=False):
 
             request_meta : RequestMeta
                 Stores request data.
+
+            exclude : list
+                Optional query string keys left out of the signature.
     """
     key_sig = list()
 
@@ -217,6 +183,8 @@ def build_key_signature(request_meta, hash_result=False):
             return ''
     # These keys may optionally exist
     for key_name in REQUEST_META_QUERY_STR:
+        if key_name in exclude:
+            continue
         if hasattr(request_meta, key_name):
             key = getattr(request_meta, key_name)
             if key:
@@ -245,21 +213,3 @@ def get_url_from_keys(keys, path_root):
     else:
         url = path_root
     return url
-
-
-def read_pickle_data():
-    try:
-        with open(settings.__data_file_dir__ +
-                  'api_data.pkl', 'rb') as pkl_file:
-            return cPickle.load(pkl_file)
-    except IOError:
-        with open(settings.__data_file_dir__ +
-                  'api_data.pkl', 'wb') as pkl_file:
-            data = OrderedDict()
-            cPickle.dump(data, pkl_file)
-            return data
-
-def write_pickle_data(obj):
-    with open(settings.__data_file_dir__ +
-              'api_data.pkl', 'wb') as pkl_file:
-        cPickle.dump(obj, pkl_file)
\ No newline at end of file
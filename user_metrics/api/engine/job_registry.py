@@ -0,0 +1,225 @@
+"""
+    Shared status of API jobs.
+
+    Every request queued by the views is recorded in an SQLite registry
+    keyed on its hashed key signature.  The job controller, job processes
+    and response handler update the entry as the request moves through
+    the following states: ::
+
+        * 'pending' - The request is queued
+        * 'running' - A job process is working on the request, the progress
+            field names the current stage
+        * 'success' - The response is stored in the response cache
+        * 'failure' - The request failed, the message field says why
+
+    Since the registry is a database file any process can read it directly,
+    so the views list and look up jobs without a round trip to another
+    process. ::
+
+        >>> from user_metrics.api.engine.job_registry import get_registry
+        >>> get_registry().add(key, url)
+        >>> get_registry().is_running(key)
+        True
+        >>> get_registry().list_jobs()
+
+    Entries left unfinished by a previous run of the job controller are
+    failed when it starts, see ``fail_unfinished``.
+
+    Finished entries are kept for ``__job_registry_retention__`` seconds and
+    at most ``__job_registry_max_finished__`` of them are retained, the
+    oldest being dropped first.  Setting either to 0 disables the
+    corresponding check.
+"""
+
+__author__ = {
+    "ryan faulkner": "rfaulkner@wikimedia.org"
+}
+__date__ = "2013-04-10"
+__license__ = "GPL (version 2 or later)"
+
+import sqlite3
+import threading
+from collections import OrderedDict
+from os import getpid
+from time import time
+
+from user_metrics.config import logging, settings
+from user_metrics.utils import enum
+
+
+# Location of the registry database and its retention policy
+REGISTRY_FILE = getattr(settings, '__job_registry_file__',
+                        settings.__data_file_dir__ + 'api_jobs.db')
+REGISTRY_RETENTION = getattr(settings, '__job_registry_retention__', 86400)
+REGISTRY_MAX_FINISHED = getattr(settings, '__job_registry_max_finished__',
+                                1000)
+
+# Seconds to wait on a locked database before failing
+REGISTRY_LOCK_TIMEOUT = 30.0
+
+job_status = enum(pending='pending', running='running', success='success',
+                  failure='failure')
+
+JOB_FIELDS = ['key', 'url', 'status', 'progress', 'message', 'submitted',
+              'started', 'finished']
+
+
+class JobRegistryError(Exception):
+    """ Basic exception class for the job registry """
+    def __init__(self, message="Job registry operation failed."):
+        Exception.__init__(self, message)
+
+
+class JobRegistry(object):
+    """
+        Job status store backed by the SQLite database at ``path``.
+        Connections are opened per thread as SQLite connections may not be
+        shared between threads or forked processes.
+    """
+
+    CREATE_TABLE = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            key TEXT PRIMARY KEY,
+            url TEXT,
+            status TEXT NOT NULL,
+            progress TEXT,
+            message TEXT,
+            submitted REAL NOT NULL,
+            started REAL,
+            finished REAL
+        )
+    """
+    CREATE_INDEX = """
+        CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished)
+    """
+
+    def __init__(self, path=REGISTRY_FILE, retention=REGISTRY_RETENTION,
+                 max_finished=REGISTRY_MAX_FINISHED):
+        self.path = path
+        self.retention = retention
+        self.max_finished = max_finished
+        self._local = threading.local()
+
+    def _conn(self):
+        """ Returns the connection of the calling thread """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != getpid():
+            try:
+                conn = sqlite3.connect(self.path,
+                                       timeout=REGISTRY_LOCK_TIMEOUT,
+                                       isolation_level=None)
+                conn.text_factory = str
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute(self.CREATE_TABLE)
+                conn.execute(self.CREATE_INDEX)
+            except sqlite3.Error as e:
+                raise JobRegistryError(__name__ + ' :: Could not open '
+                                                  '{0}: {1}'.format(
+                                                      self.path, str(e)))
+            self._local.conn = conn
+            self._local.pid = getpid()
+        return conn
+
+    def _execute(self, sql, params=()):
+        try:
+            return self._conn().execute(sql, params)
+        except sqlite3.Error as e:
+            logging.error(__name__ + ' :: Registry update failed: ' + str(e))
+            return None
+
+    def add(self, key, url):
+        """
+            Records a newly queued request.  A finished entry for ``key`` is
+            reset, one still pending or running is left as is.
+        """
+        now = time()
+        self._execute('INSERT OR IGNORE INTO jobs '
+                      '(key, url, status, submitted) VALUES (?, ?, ?, ?)',
+                      (key, url, job_status.pending, now))
+        self._execute('UPDATE jobs SET url = ?, status = ?, progress = NULL, '
+                      'message = NULL, submitted = ?, started = NULL, '
+                      'finished = NULL WHERE key = ? AND finished IS NOT NULL',
+                      (url, job_status.pending, now, key))
+
+    def start(self, key):
+        """ Marks the job for ``key`` as running """
+        self._execute('UPDATE jobs SET status = ?, started = ? '
+                      'WHERE key = ?', (job_status.running, time(), key))
+
+    def set_progress(self, key, progress):
+        """ Records the stage reached by the job for ``key`` """
+        self._execute('UPDATE jobs SET progress = ? WHERE key = ?',
+                      (progress, key))
+
+    def fail(self, key, message):
+        """
+            Marks the job for ``key`` as failed.  The entry is finished once
+            the response handler has stored the failed response.
+        """
+        self._execute('UPDATE jobs SET status = ?, message = ? '
+                      'WHERE key = ?', (job_status.failure, message, key))
+
+    def finish(self, key):
+        """
+            Marks the job for ``key`` as finished, successfully unless it
+            failed, and prunes old finished entries.
+        """
+        now = time()
+        self._execute('UPDATE jobs SET finished = ?, status = CASE status '
+                      'WHEN ? THEN status ELSE ? END WHERE key = ?',
+                      (now, job_status.failure, job_status.success, key))
+        self._prune(now)
+
+    def fail_unfinished(self, message):
+        """
+            Fails and finishes every unfinished entry, e.g. those of jobs lost
+            when the job controller stopped.
+        """
+        now = time()
+        self._execute('UPDATE jobs SET status = ?, message = ?, finished = ? '
+                      'WHERE finished IS NULL',
+                      (job_status.failure, message, now))
+        self._prune(now)
+
+    def _prune(self, now):
+        """ Drops finished entries past retention then the oldest ones """
+        if self.retention:
+            self._execute('DELETE FROM jobs WHERE finished < ?',
+                          (now - self.retention,))
+        if self.max_finished:
+            self._execute('DELETE FROM jobs WHERE key IN ('
+                          'SELECT key FROM jobs WHERE finished IS NOT NULL '
+                          'ORDER BY finished DESC LIMIT -1 OFFSET ?)',
+                          (self.max_finished,))
+
+    def get(self, key):
+        """ Returns the entry for ``key`` as an OrderedDict or None """
+        cursor = self._execute('SELECT {0} FROM jobs WHERE key = ?'.format(
+            ', '.join(JOB_FIELDS)), (key,))
+        row = cursor.fetchone() if cursor else None
+        return OrderedDict(zip(JOB_FIELDS, row)) if row else None
+
+    def is_running(self, key):
+        """ Is the request for ``key`` queued or being processed? """
+        job = self.get(key)
+        return bool(job) and job['finished'] is None
+
+    def list_jobs(self):
+        """ Returns all entries, most recently submitted first """
+        cursor = self._execute('SELECT {0} FROM jobs ORDER BY submitted '
+                               'DESC'.format(', '.join(JOB_FIELDS)))
+        if not cursor:
+            return []
+        return [OrderedDict(zip(JOB_FIELDS, row)) for row in cursor]
+
+
+# Registry instance shared within this process
+_registry = None
+
+
+def get_registry():
+    """ Returns the job registry configured in settings """
+    global _registry
+    if _registry is None:
+        _registry = JobRegistry()
+    return _registry
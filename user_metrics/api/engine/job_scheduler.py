@@ -0,0 +1,278 @@
+"""
+    Scheduling of API jobs.
+
+    Requests waiting to be processed are held by a ``JobScheduler`` which
+    decides which of them takes the next free worker slot.  The number of
+    slots is set by ``settings.__job_slots__``.  Among pending requests the
+    scheduler picks, in order of precedence:
+
+        #. the request whose owner (the requesting user) has the fewest
+           running jobs
+        #. the request whose cohort has the fewest running jobs
+        #. the request with the best priority - single user and aggregate
+           requests come before time series, raw dumps come last
+        #. the earliest request
+
+    So one analyst issuing a large raw request for a big cohort does not
+    hold back everyone else while it runs.
+
+    Requests are coalesced on their key signature (``build_key_signature``).
+    A request identical to one that is pending or running attaches to that
+    job rather than being queued again, and is answered by the same result.
+    An aggregate request whose raw counterpart (same cohort, metric and
+    parameters without the aggregator) is pending or running is held as a
+    dependent of the raw job.  Once the raw job finishes the dependent is
+    released with a copy of the raw results and aggregates those rather than
+    recomputing the metric.  A finished job keeps its key until the response
+    handler reports its response stored in the cache, identical requests
+    arriving in between attach to the finished job. ::
+
+        >>> scheduler = JobScheduler(slots=4)
+        >>> scheduler.submit(request_meta, 'analyst')
+        >>> job = scheduler.next_job()
+        >>> scheduler.start(job, proc)
+        ...
+        >>> scheduler.finish(job.id)
+        >>> scheduler.forget(job.key)
+
+    Queue depth, running jobs and wait times are published in the shared
+    array ``scheduler_counters`` which may be read from any process forked
+    after this module is imported via ``get_scheduler_stats``.
+"""
+
+__author__ = {
+    "ryan faulkner": "rfaulkner@wikimedia.org"
+}
+__date__ = "2013-04-08"
+__license__ = "GPL (version 2 or later)"
+
+from collections import OrderedDict
+from multiprocessing import Array
+from time import time
+
+from user_metrics.config import logging, settings
+from user_metrics.api.engine.data import build_key_signature
+from user_metrics.api.engine.request_meta import get_request_type, \
+    request_types
+
+
+# Number of jobs that may run concurrently
+JOB_SLOTS = getattr(settings, '__job_slots__', 2)
+
+# Keys under which the owner and the registry key of a request travel with
+# the unpacked request
+REQUEST_OWNER_KEY = 'request_owner'
+REQUEST_KEY_SIG_KEY = 'request_key_sig'
+
+# Priority of requests by type, lower values are scheduled first
+REQUEST_TYPE_PRIORITY = {
+    request_types.aggregator: 1,
+    request_types.time_series: 2,
+    request_types.raw: 3,
+}
+SINGLE_USER_PRIORITY = 0
+
+# Request parameters that do not affect the raw per-user results
+RAW_KEY_EXCLUDE = ['aggregator', 'time_series']
+
+# Seconds a finished job waits on its response being stored before its key
+# is dropped regardless
+STORE_TIMEOUT = 60
+
+# Counters shared with the API views
+COUNTER_FIELDS = ['queue_depth', 'running', 'submitted', 'completed',
+                  'coalesced', 'reused', 'total_wait', 'max_wait']
+scheduler_counters = Array('d', len(COUNTER_FIELDS))
+
+
+def get_scheduler_stats():
+    """
+        Returns the scheduler counters.  Average wait time in seconds is
+        derived from the started jobs.
+    """
+    with scheduler_counters.get_lock():
+        stats = OrderedDict(zip(COUNTER_FIELDS, scheduler_counters[:]))
+    started = stats['completed'] + stats['running']
+    stats['avg_wait'] = stats['total_wait'] / started if started else 0.0
+    return stats
+
+
+def job_priority(request_meta):
+    """ Determines the priority of a request, lower runs sooner """
+    if request_meta.is_user:
+        return SINGLE_USER_PRIORITY
+    return REQUEST_TYPE_PRIORITY[get_request_type(request_meta)]
+
+
+class JobEntry(object):
+    """ Pending or running job """
+
+    def __init__(self, id, request, owner, priority):
+        self.id = id
+        self.request = request
+        self.owner = owner
+        self.priority = priority
+        self.submitted = time()
+        self.started = None
+        self.finished = None
+        self.process = None
+
+        self.key = build_key_signature(request, hash_result=True)
+        self.raw_key = build_key_signature(request, hash_result=True,
+                                           exclude=RAW_KEY_EXCLUDE)
+
+        # Number of identical requests attached to this job
+        self.attached = 0
+        # Aggregate jobs waiting on the raw results of this job
+        self.dependents = list()
+        # Raw results handed down from another job
+        self.raw_handle = None
+
+
+class JobScheduler(object):
+    """
+        Holds pending jobs and assigns them to ``slots`` worker slots.
+    """
+
+    def __init__(self, slots=JOB_SLOTS):
+        self.slots = max(1, int(slots))
+        self.pending = list()
+        self.running = OrderedDict()
+
+        # Pending, held and running jobs by key signature
+        self.jobs = dict()
+
+        self._next_id = 0
+        self._owner_load = dict()
+        self._cohort_load = dict()
+
+    def submit(self, request_meta, owner=None):
+        """
+            Adds a request to the pending jobs and returns its entry.  If an
+            identical request is already pending, running or waiting on its
+            response to be stored the entry of that job is returned instead.
+        """
+        entry = JobEntry(self._next_id, request_meta, owner,
+                         job_priority(request_meta))
+
+        job = self.jobs.get(entry.key)
+        if job and job.finished and job.finished + STORE_TIMEOUT < time():
+            # The response handler never reported back
+            del self.jobs[entry.key]
+            job = None
+
+        if job:
+            job.attached += 1
+            self._count('coalesced', 1)
+            logging.debug(__name__ + ' :: Request attached to job ID {0}. '
+                                     '\n\tCOHORT = {1} - METRIC = {2}'.
+                          format(job.id, request_meta.cohort_expr,
+                                 request_meta.metric))
+            return job
+
+        self._next_id += 1
+        if entry.key:
+            self.jobs[entry.key] = entry
+
+        raw_job = None
+        if get_request_type(request_meta) == request_types.aggregator:
+            raw_job = self.jobs.get(entry.raw_key)
+
+        if raw_job and not raw_job.finished:
+            raw_job.dependents.append(entry)
+            logging.debug(__name__ + ' :: Job ID {0} waits on raw results '
+                                     'of job ID {1}.'.format(entry.id,
+                                                             raw_job.id))
+        else:
+            self.pending.append(entry)
+        self._count('submitted', 1)
+        self._publish()
+        return entry
+
+    def release(self, entry, raw_handle=None):
+        """
+            Moves a job held on a raw job to the pending jobs.  The job
+            aggregates the results located by ``raw_handle`` if given.
+        """
+        entry.raw_handle = raw_handle
+        if raw_handle:
+            self._count('reused', 1)
+        self.pending.append(entry)
+        self._publish()
+
+    def next_job(self):
+        """
+            Returns the pending job that should take the next slot or None if
+            no slot is free or no job is pending.
+        """
+        if len(self.running) >= self.slots or not self.pending:
+            return None
+        return min(self.pending, key=lambda entry: (
+            self._owner_load.get(entry.owner, 0),
+            self._cohort_load.get(entry.request.cohort_expr, 0),
+            entry.priority,
+            entry.id))
+
+    def start(self, entry, process):
+        """ Marks the pending job ``entry`` as running in ``process`` """
+        self.pending.remove(entry)
+        entry.started = time()
+        entry.process = process
+        self.running[entry.id] = entry
+        self._load(entry, 1)
+
+        wait = entry.started - entry.submitted
+        self._count('total_wait', wait)
+        with scheduler_counters.get_lock():
+            index = COUNTER_FIELDS.index('max_wait')
+            scheduler_counters[index] = max(scheduler_counters[index], wait)
+        self._publish()
+
+    def finish(self, job_id):
+        """
+            Releases the slot of a running job and returns its entry.  The
+            key of the job is kept until ``forget`` is called.
+        """
+        entry = self.running.pop(job_id, None)
+        if entry:
+            entry.finished = time()
+            self._load(entry, -1)
+            self._count('completed', 1)
+            self._publish()
+        return entry
+
+    def forget(self, key):
+        """
+            Drops the key of a finished job once its response is stored,
+            later identical requests are served from the response cache.
+        """
+        entry = self.jobs.get(key)
+        if entry and entry.finished:
+            del self.jobs[key]
+
+    def failed_jobs(self):
+        """
+            Returns running jobs whose process exited abnormally.  These
+            never report completion.
+        """
+        return [entry for entry in self.running.itervalues()
+                if entry.process and entry.process.exitcode]
+
+    def _load(self, entry, delta):
+        for load, key in [(self._owner_load, entry.owner),
+                          (self._cohort_load, entry.request.cohort_expr)]:
+            load[key] = load.get(key, 0) + delta
+            if not load[key]:
+                del load[key]
+
+    def _count(self, field, delta):
+        with scheduler_counters.get_lock():
+            scheduler_counters[COUNTER_FIELDS.index(field)] += delta
+
+    def _publish(self):
+        with scheduler_counters.get_lock():
+            scheduler_counters[COUNTER_FIELDS.index('queue_depth')] = \
+                len(self.pending) + sum(len(entry.dependents) for entry in
+                                        self.pending + self.running.values())
+            scheduler_counters[COUNTER_FIELDS.index('running')] = \
+                len(self.running)
@@ -19,7 +19,8 @@
     request it enters the 'pending' state. If the job returns without
     exception it enters the 'success' state, otherwise it enters the 'failure'
     state.  The job remains in either of these states until it is cleared
-    from the process queue.
+    from the process queue.  Job states are recorded in the job registry
+    (see ``job_registry``) which the views read directly.
 
     Response Data
     ^^^^^^^^^^^^^
@@ -46,8 +47,10 @@
         metric_param := -, optional metric parameters
         data := list(tuple), set of data points
 
-    Request data is mapped to a query via metric objects and hashed in the
-    dictionary `api_data`.
+    Request data is mapped to a query via metric objects and stored in the
+    response cache.  Results travel from the job process to the response
+    handler as JSON spool files, only a ``ResultHandle`` passes through the
+    queues (see ``result_transport``).
 
     Request Flow Management
     ^^^^^^^^^^^^^^^^^^^^^^^
@@ -83,8 +86,14 @@ __license__ = "GPL (version 2 or later)"
 
 from user_metrics.config import logging, settings
 from user_metrics.api import MetricsAPIError, error_codes, query_mod
-from user_metrics.api.engine.data import get_users
+from user_metrics.api.engine.data import get_users, build_key_signature
+from user_metrics.api.engine.job_registry import get_registry
+from user_metrics.api.engine.job_scheduler import JobScheduler, \
+    REQUEST_OWNER_KEY, REQUEST_KEY_SIG_KEY, get_scheduler_stats
 from user_metrics.api.engine.request_meta import rebuild_unpacked_request
+from user_metrics.api.engine.result_transport import write_result, \
+    copy_result, read_result, decode_result, ResultTransportError
+from user_metrics.api.engine.response_meta import failed_response
 from user_metrics.metrics.users import MediaWikiUser
 from user_metrics.metrics.user_metric import UserMetricError
 from user_metrics.utils import unpack_fields
@@ -92,9 +101,7 @@ from user_metrics.utils import unpack_fields
 from multiprocessing import Process, Queue
 from collections import namedtuple
 from os import getpid
-from sys import getsizeof
 from Queue import Empty
-from time import sleep
 
 
 # API JOB HANDLER
@@ -107,16 +114,17 @@ api_response_queue = Queue()
 
 # MODULE CONSTANTS
 #
-# 1. Determines maximum block size of queue item
-# 2. Number of maximum concurrently running jobs
-# 3. Time to block on waiting for a new request to appear in the queue
-MAX_BLOCK_SIZE = 5000
-MAX_CONCURRENT_JOBS = 1
-QUEUE_WAIT = 5
+# 1. Seconds to block on the request queue before checking for jobs whose
+#    process died without reporting back
+REAP_INTERVAL = 5
 
 
-# Defines the job item type used to temporarily store job progress
-job_item_type = namedtuple('JobItem', 'id process request queue')
+# Completion message put on the request queue by job processes
+JobDone = namedtuple('JobDone', 'id handle')
+
+# Message put on the request queue by the response handler once the
+# response for a key is stored
+ResponseStored = namedtuple('ResponseStored', 'key')
 
 
 def job_control(request_queue, response_queue):
@@ -127,23 +135,28 @@ def job_control(request_queue, response_queue):
         ~~~~~~~~~~
 
         request_queue : multiprocessing.Queue
-           Queues incoming API requests.
-
-    """
+           Queues incoming API requests.  Job processes also report their
+           completion here with a ``JobDone`` message, and the response
+           handler reports stored responses with a ``ResponseStored``
+           message, so the controller reacts to all of them without polling.
 
-    # Store executed and pending jobs respectively
-    job_queue = list()
-    wait_queue = list()
+        response_queue : multiprocessing.Queue
+           Receives the request and the result handle of completed jobs.
 
-    # Global job ID number
-    job_id = 0
+        Pending requests are scheduled onto ``settings.__job_slots__``
+        concurrent job processes by a ``JobScheduler``.
+    """
 
-    # Tallies the number of concurrently running jobs
-    concurrent_jobs = 0
+    scheduler = JobScheduler()
 
     log_name = '{0} :: {1}'.format(__name__, job_control.__name__)
 
-    logging.debug('{0} - STARTING...'.format(log_name))
+    logging.debug('{0} - STARTING... ({1} slots)'.format(log_name,
+                                                        scheduler.slots))
+
+    # Jobs of a previous run are not coming back
+    get_registry().fail_unfinished(__name__ + ' :: Request lost when the '
+                                              'job controller stopped.')
 
     while 1:
 
@@ -151,95 +164,115 @@ def job_control(request_queue, response_queue):
         # ------------------------
 
         try:
-            # Pull an item off of the queue
-
-            req_item = request_queue.get(timeout=QUEUE_WAIT)
-
-            logging.debug(log_name + ' :: PULLING item from request queue -> ' \
-                                     '\n\tCOHORT = {0} - METRIC = {1}'
-                .format(req_item['cohort_expr'], req_item['metric']))
-
-        except Exception as e:
-            req_item = None
-            #logging.debug('{0} :: {1}  - Listening ...'
-            #.format(__name__, job_control.__name__))
-
+            item = request_queue.get(timeout=REAP_INTERVAL)
+        except Empty:
+            item = None
 
         # Process complete jobs
         # ---------------------
 
-        for job_item in job_queue:
-
-            # Look for completed jobs
-            if not job_item.queue.empty():
-
-                # Put request creds on res queue -- this goes to
-                # response_handler asynchronously
-                response_queue.put(unpack_fields(job_item.request),
-                                   block=True)
+        if isinstance(item, JobDone):
+            _complete_job(scheduler, item.id, item.handle, response_queue,
+                          log_name, failed=False)
 
-                # Pull data off of the queue and add it to response queue
-                while not job_item.queue.empty():
-                    data = job_item.queue.get(True)
-                    if data:
-                        response_queue.put(data, block=True)
-
-                del job_queue[job_queue.index(job_item)]
-
-                concurrent_jobs -= 1
-
-                logging.debug(log_name + ' :: RUN -> RESPONSE - Job ID {0}' \
-                                         '\n\tConcurrent jobs = {1}'
-                    .format(str(job_item.id), concurrent_jobs))
+        # Identical requests are no longer attached once the response is
+        # stored
+        elif isinstance(item, ResponseStored):
+            scheduler.forget(item.key)
 
+        elif item:
+            # Build the request item
+            owner = item.pop(REQUEST_OWNER_KEY, None)
+            key_sig = item.pop(REQUEST_KEY_SIG_KEY, None)
+            try:
+                rm = rebuild_unpacked_request(item)
+            except MetricsAPIError as e:
+                logging.error(log_name + ' - ' + e.message)
+                if key_sig:
+                    get_registry().fail(key_sig, e.message)
+                    get_registry().finish(key_sig)
+                continue
+
+            entry = scheduler.submit(rm, owner)
+            logging.debug(log_name + ' :: REQUEST -> WAIT - Job ID {0}'
+                                     '\n\tCOHORT = {1} - METRIC = {2}'
+                .format(entry.id, rm.cohort_expr, rm.metric))
+
+        # Jobs whose process died never report back - fail them
+        for entry in scheduler.failed_jobs():
+            logging.error(log_name + ' :: Job ID {0} exited with code '
+                                     '{1}.'.format(entry.id,
+                                                   entry.process.exitcode))
+            err_msg = __name__ + ' :: Request failed.'
+            get_registry().fail(entry.key, err_msg)
+            handle = write_result(failed_response(err_msg, entry.request))
+            _complete_job(scheduler, entry.id, handle, response_queue,
+                          log_name, failed=True)
 
         # Process pending jobs
         # --------------------
 
-        for wait_req in wait_queue:
-            if concurrent_jobs <= MAX_CONCURRENT_JOBS:
-                # prepare job from item
-
-                req_q = Queue()
-                proc = Process(target=process_metrics, args=(req_q, wait_req))
-                proc.start()
-
-                job_item = job_item_type(job_id, proc, wait_req, req_q)
-                job_queue.append(job_item)
-
-                del wait_queue[wait_queue.index(wait_req)]
-
-                concurrent_jobs += 1
-                job_id += 1
-
-                logging.debug(log_name + ' :: WAIT -> RUN - Job ID {0}' \
-                                         '\n\tConcurrent jobs = {1}, ' \
-                                         'COHORT = {2} - METRIC = {3}'\
-                    .format(str(job_id), concurrent_jobs,
-                            wait_req.cohort_expr, wait_req.metric))
+        entry = scheduler.next_job()
+        while entry:
+            proc = Process(target=process_metrics,
+                           args=(request_queue, entry.id, entry.request,
+                                 entry.raw_handle))
+            proc.start()
+            scheduler.start(entry, proc)
+            get_registry().start(entry.key)
+
+            logging.debug(log_name + ' :: WAIT -> RUN - Job ID {0}'
+                                     '\n\tRunning jobs = {1}, '
+                                     'COHORT = {2} - METRIC = {3}'
+                .format(entry.id, len(scheduler.running),
+                        entry.request.cohort_expr, entry.request.metric))
+            entry = scheduler.next_job()
 
+    logging.debug('{0} - FINISHING.'.format(log_name))
 
-        # Add newest job to the queue
-        # ---------------------------
 
-        if req_item and concurrent_jobs <= MAX_CONCURRENT_JOBS:
+def _complete_job(scheduler, job_id, handle, response_queue, log_name,
+                  failed):
+    """
+        Passes a finished job on to the response handler and releases the
+        aggregate jobs waiting on its raw results.
+    """
+    entry = scheduler.finish(job_id)
+    if not entry:
+        return
+    entry.process.join()
+
+    for dependent in entry.dependents:
+        raw_handle = None
+        if not failed:
+            try:
+                raw_handle = copy_result(handle)
+            except ResultTransportError as e:
+                logging.error(log_name + ' - ' + e.message)
+        scheduler.release(dependent, raw_handle)
 
-            # Build the request item
-            rm = rebuild_unpacked_request(req_item)
+    # Put request creds on res queue -- this goes to
+    # response_handler asynchronously
+    response_queue.put(unpack_fields(entry.request), block=True)
 
-            logging.debug(log_name + ' : REQUEST -> WAIT ' \
-                                     '\n\tCOHORT = {0} - METRIC = {1}'
-                .format(rm.cohort_expr, rm.metric))
-            wait_queue.append(rm)
+    # Pass the result handle on to the response queue
+    response_queue.put(handle, block=True)
 
+    stats = get_scheduler_stats()
+    logging.debug(log_name + ' :: RUN -> RESPONSE - Job ID {0}'
+                             '\n\tRunning jobs = {1}, Queue depth = {2}, '
+                             'Avg. wait = {3:.1f}s'
+        .format(job_id, int(stats['running']), int(stats['queue_depth']),
+                stats['avg_wait']))
 
-    logging.debug('{0} - FINISHING.'.format(log_name))
 
-
-def process_metrics(p, request_meta):
+def process_metrics(p, job_id, request_meta, raw_handle=None):
     """
-        Worker process for requests, forked from the job controller.  This
-        method handles:
+        Worker process for requests, forked from the job controller.  On
+        completion a ``JobDone`` message carrying the result handle is put on
+        ``p``.  If ``raw_handle`` locates the raw results of an identical
+        raw request these are aggregated rather than recomputed.  This method
+        handles:
 
             * Filtering cohort type: "regular" cohort, single user, user group
             * Secondary validation
@@ -248,6 +281,11 @@ def process_metrics(p, request_meta):
 
     log_name = '{0} :: {1}'.format(__name__, process_metrics.__name__)
 
+    # The key is taken before the cohort processing sets the project
+    key_sig = build_key_signature(request_meta, hash_result=True)
+    registry = get_registry()
+    registry.set_progress(key_sig, 'resolving cohort')
+
     logging.info(log_name + ' - START JOB'
                             '\n\tCOHORT = {0} - METRIC = {1}'
                             ' -  PID = {2})'.
@@ -295,42 +333,71 @@ def process_metrics(p, request_meta):
         valid = True
         err_msg = ''
 
+    raw_results = _read_raw_results(raw_handle) if raw_handle else None
+
     if valid:
         # process request
-        results = process_data_request(request_meta, users)
-        results = str(results)
-        response_size = getsizeof(results, None)
+        registry.set_progress(key_sig, 'processing metric')
 
-        if response_size > MAX_BLOCK_SIZE:
-            index = 0
+        def progress(row, completed, total):
+            registry.set_progress(key_sig, 'computed {0} of {1} '
+                                           'intervals'.format(completed,
+                                                              total))
 
-            # Dump the data in pieces - block until it is picked up
-            while index < response_size:
-                p.put(results[index:index+MAX_BLOCK_SIZE], block=True)
-                index += MAX_BLOCK_SIZE
-        else:
-            p.put(results, block=True)
+        results = process_data_request(request_meta, users,
+                                       raw_results=raw_results,
+                                       progress=progress)
+    else:
+        results = failed_response(err_msg, request_meta)
 
+    # Spool the results - only the handle goes through the queue
+    registry.set_progress(key_sig, 'spooling results')
+    try:
+        handle = write_result(results)
+    except ResultTransportError as e:
+        logging.error(log_name + ' - ' + e.message)
+        valid = False
+        err_msg = e.message
+        handle = write_result(failed_response(e.message, request_meta))
+
+    # Mark the failure before the response handler finishes the job
+    if not valid:
+        registry.fail(key_sig, err_msg)
+    p.put(JobDone(job_id, handle), block=True)
+
+    if valid:
         logging.info(log_name + ' - END JOB'
                                 '\n\tCOHORT = {0} - METRIC = {1}'
-                                ' -  PID = {2})'.
-            format(request_meta.cohort_expr, request_meta.metric, getpid()))
-
+                                ' -  PID = {2}, SIZE = {3} bytes)'.
+            format(request_meta.cohort_expr, request_meta.metric, getpid(),
+                   handle.size))
     else:
-        p.put(err_msg, block=True)
         logging.info(log_name + ' - END JOB - FAILED.'
                                 '\n\tCOHORT = {0} - METRIC = {1}'
                                 ' -  PID = {2})'.
         format(request_meta.cohort_expr, request_meta.metric, getpid()))
 
 
+def _read_raw_results(raw_handle):
+    """
+        Returns the per-user data of the raw results located by
+        ``raw_handle`` or None if they can not be used.
+    """
+    try:
+        raw = decode_result(read_result(raw_handle))
+    except (ResultTransportError, ValueError) as e:
+        logging.error(__name__ + ' :: Could not reuse raw results: ' + str(e))
+        return None
+    if raw.get('type') != request_types.raw or \
+            not isinstance(raw.get('data'), dict):
+        return None
+    return raw['data']
 
 
 # REQUEST FLOW HANDLER
 # ###################
 
 
-from dateutil.parser import parse as date_parse
 from copy import deepcopy
 
 from user_metrics.etl.data_loader import DataLoader
@@ -341,6 +408,7 @@ from user_metrics.api.engine.response_meta import format_response
 from user_metrics.api.engine import DATETIME_STR_FORMAT
 from user_metrics.api.engine.request_meta import get_agg_key, \
     get_aggregator_type, request_types
+from user_metrics.utils.timestamp import parse_timestamp
 
 INTERVALS_PER_THREAD = 10
 MAX_THREADS = 5
@@ -352,7 +420,8 @@ DEFAULT_INERVAL_LENGTH = 24
 # create shorthand method refs
 to_string = DataLoader().cast_elems_to_string
 
-def process_data_request(request_meta, users):
+def process_data_request(request_meta, users, raw_results=None,
+                         progress=None):
     """
         Main entry point of the module, prepares results for a given request.
         Coordinates a request based on the following parameters::
@@ -366,6 +435,13 @@ def process_data_request(request_meta, users):
             Most notably, "aggregator" if the request requires aggregation,
             "time_series" flag indicating a time series request.  The
             remaining kwargs specify metric object parameters.
+
+            raw_results (dict) - per-user results of the identical raw
+            request, aggregate requests use these in place of processing
+            the metric.
+
+            progress (callable) - called with each time series interval as
+            it is computed, see ``build_time_series``.
     """
 
     # Set interval length in hours if not present
@@ -396,7 +472,7 @@ def process_data_request(request_meta, users):
             return results
 
         # Determine intervals and thread allocation
-        total_intervals = (date_parse(end) - date_parse(start)).\
+        total_intervals = (parse_timestamp(end) - parse_timestamp(start)).\
                           total_seconds() / (3600 * request_meta.interval)
         time_threads = max(1, int(total_intervals / INTERVALS_PER_THREAD))
         time_threads = min(MAX_THREADS, time_threads)
@@ -430,13 +506,14 @@ def process_data_request(request_meta, users):
             kt_=time_threads,
             metric_threads=metric_threads,
             log=True,
+            progress=progress,
             **new_kwargs)
 
         results['header'] = ['timestamp'] + \
                             getattr(aggregator_func,
                                     um.METRIC_AGG_METHOD_HEAD)
         for row in out:
-            timestamp = date_parse(row[0][:19]).strftime(
+            timestamp = parse_timestamp(row[0][:19]).strftime(
                 DATETIME_STR_FORMAT)
             results['data'][timestamp] = row[3:]
 
@@ -459,16 +536,21 @@ def process_data_request(request_meta, users):
                                     'end': str(end),
                                     })
 
-        try:
-            metric_obj.process(users,
-                               k_=USER_THREADS,
-                               kr_=REVISION_THREADS,
-                               log_=True,
-                               **args)
-        except UserMetricError as e:
-            logging.error(__name__ + ' :: Metrics call failed: ' + str(e))
-            results['data'] = str(e)
-            return results
+        if raw_results is not None:
+            metric_obj._results = [[user] + list(row) for user, row in
+                                   raw_results.iteritems()]
+        else:
+            try:
+                metric_obj.process(users,
+                                   k_=USER_THREADS,
+                                   kr_=REVISION_THREADS,
+                                   log_=True,
+                                   **args)
+            except UserMetricError as e:
+                logging.error(__name__ + ' :: Metrics call failed: ' +
+                              str(e))
+                results['data'] = str(e)
+                return results
 
         r = um.aggregator(aggregator_func, metric_obj, metric_obj.header())
         results['header'] = to_string(r.header)
@@ -498,148 +580,3 @@ def process_data_request(request_meta, users):
             results['data'][m[0]] = m[1:]
 
     return results
-
-
-# REQUEST NOTIFICATIONS
-# #####################
-
-from collections import OrderedDict
-
-req_notification_queue_in = Queue()
-req_notification_queue_out = Queue()
-
-request_msg_type = namedtuple('RequestMessage', 'type hash url is_alive')
-
-
-def requests_notification_callback(msg_queue_in, msg_queue_out):
-    """
-        Asynchronous callback.  Tracks status of requests and new requests.
-        This callback utilizes ``msg_queue_in`` & ``msg_queue_out`` to
-        manage request status.
-    """
-    log_name = '{0} :: {1}'.format(__name__,
-                                   requests_notification_callback.__name__)
-    logging.debug('{0}  - STARTING...'.format(log_name))
-
-    cache = OrderedDict()
-    while 1:
-
-        try:
-            msg = msg_queue_in.get(True)
-        except IOError as e:
-            logging.error(__name__ + ' :: Could not block '
-                                     'on in queue: "{0}"'.format(e.message))
-            sleep(1)
-            continue
-
-        try:
-            type = msg[0]
-        except (KeyError, ValueError):
-            logging.error(log_name + ' - No valid type ' \
-                                     '{0}'.format(str(msg)))
-            continue
-
-        # Init request
-        if type == 0:
-            try:
-                cache[msg[1]] = [True, msg[2]]
-                logging.debug(log_name + ' - Initialize Request: ' \
-                                         '{0}.'.format(str(msg)))
-            except Exception:
-                logging.error(log_name + ' - Initialize Request' \
-                                         ' failed: {0}'.format(str(msg)))
-
-        # Kill request - leave on cache
-        elif type == 1:
-            try:
-                cache[msg[1]][0] = False
-                logging.debug(log_name + ' - Set request finished: ' \
-                                         '{0}.\n'.format(str(msg)))
-            except Exception:
-                logging.error(log_name + ' - Set request finished failed: ' \
-                                         '{0}\n'.format(str(msg)))
-
-        # Is the key in the cache and running?
-        elif type == 2:
-            try:
-                if msg[1] in cache:
-                    msg_queue_out.put([cache[msg[1]][0]], True)
-                else:
-                    msg_queue_out.put([False], True)
-                logging.debug(log_name + ' - Get request alive: ' \
-                                         '{0}.'.format(str(msg)))
-            except (KeyError, ValueError):
-                logging.error(log_name + ' - Get request alive failed: ' \
-                                         '{0}'.format(str(msg)))
-
-        # Get keys
-        elif type == 3:
-            msg_queue_out.put(cache.keys(), True)
-
-        # Get url
-        elif type == 4:
-            try:
-                if msg[1] in cache:
-                    msg_queue_out.put([cache[msg[1]][1]], True)
-                else:
-                    logging.error(log_name + ' - Get URL failed: {0}'.
-                    format(str(msg)))
-            except (KeyError, ValueError):
-                logging.error(log_name + ' - Get URL failed: {0}'.format(str(msg)))
-        else:
-            logging.error(log_name + ' - Bad message: {0}'.format(str(msg)))
-
-    logging.debug('{0}  - SHUTTING DOWN...'.format(log_name))
-
-
-# Wrapper Methods for working with Request Notifications
-# Use locks to enforce atomicity
-
-BLOCK_TIMEOUT = 1
-
-
-def req_cb_get_url(key, lock):
-    lock.acquire()
-    req_notification_queue_in.put([4, key], block=True)
-    try:
-        val = req_notification_queue_out.get(True, timeout=BLOCK_TIMEOUT)[0]
-    except Empty:
-        logging.error(__name__ + ' :: req_cb_get_url -'
-                                 ' Block time expired.')
-        return ''
-    lock.release()
-    return val
-
-
-def req_cb_get_cache_keys(lock):
-    lock.acquire()
-    req_notification_queue_in.put([3], block=True)
-    try:
-        val =  req_notification_queue_out.get(block=True,
-                                              timeout=BLOCK_TIMEOUT)
-    except Empty:
-        logging.error(__name__ + ' :: req_cb_get_cache_keys -'
-                                 ' Block time expired.')
-        return []
-    lock.release()
-    return val
-
-
-def req_cb_get_is_running(key, lock):
-    lock.acquire()
-    req_notification_queue_in.put([2, key], True)
-    try:
-        val =  req_notification_queue_out.get(block=True,
-                                              timeout=BLOCK_TIMEOUT)[0]
-    except Empty:
-        logging.error(__name__ + ' :: req_cb_get_is_running -'
-                                 ' Block time expired.')
-        return False
-    lock.release()
-    return val
-
-
-def req_cb_add_req(key, url, lock):
-    lock.acquire()
-    req_notification_queue_in.put([0, key, url])
-    lock.release()
\ No newline at end of file
@@ -303,13 +303,15 @@ class ParameterMapping(object):
 from user_metrics.metrics.threshold import Threshold, threshold_editors_agg
 from user_metrics.metrics.blocks import Blocks, block_rate_agg
 from user_metrics.metrics.bytes_added import BytesAdded, ba_median_agg, \
-    ba_min_agg, ba_max_agg, ba_sum_agg, ba_mean_agg, ba_std_agg
+    ba_min_agg, ba_max_agg, ba_sum_agg, ba_mean_agg, ba_std_agg, \
+    ba_p50_agg, ba_p95_agg
 from user_metrics.metrics.survival import Survival, survival_editors_agg
 from user_metrics.metrics.revert_rate import RevertRate, revert_rate_avg
 from user_metrics.metrics.time_to_threshold import TimeToThreshold, \
-    ttt_avg_agg, ttt_stats_agg
+    ttt_avg_agg, ttt_stats_agg, ttt_approx_stats_agg, ttt_p50_agg, \
+    ttt_p95_agg
 from user_metrics.metrics.edit_rate import EditRate, edit_rate_agg, \
-    er_stats_agg
+    er_stats_agg, er_approx_stats_agg, er_p50_agg, er_p95_agg
 from user_metrics.metrics.namespace_of_edits import NamespaceEdits, \
     namespace_edits_sum
 from user_metrics.metrics.live_account import LiveAccount, live_accounts_agg
@@ -349,6 +351,14 @@ aggregator_dict =\
     'dist+edit_rate': er_stats_agg,
     'average+blocks': block_rate_agg,
     'dist+time_to_threshold': ttt_stats_agg,
+    'p50+bytes_added': ba_p50_agg,
+    'p95+bytes_added': ba_p95_agg,
+    'approx_dist+edit_rate': er_approx_stats_agg,
+    'p50+edit_rate': er_p50_agg,
+    'p95+edit_rate': er_p95_agg,
+    'approx_dist+time_to_threshold': ttt_approx_stats_agg,
+    'p50+time_to_threshold': ttt_p50_agg,
+    'p95+time_to_threshold': ttt_p95_agg,
     }
 
 
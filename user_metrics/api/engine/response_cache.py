@@ -0,0 +1,80 @@
+"""
+    Persistent store for API responses.
+
+    Responses are kept in an ``SQLiteStore`` (see
+    ``user_metrics.utils.sqlite_store``), one entry per request keyed on the
+    hashed key signature produced by ``build_key_signature``.  Each entry
+    also holds the full key signature of its request.  The database runs in
+    WAL mode which lets any number of processes (e.g. Flask workers and the
+    response handler) read while one of them writes. ::
+
+        >>> from user_metrics.api.engine.response_cache import get_cache
+        >>> get_cache().set(key, data, key_sig_full)
+        >>> get_cache().get(key)
+
+    Entries older than ``__response_cache_ttl__`` seconds are ignored when
+    read and pruned on write.  Once the number of entries exceeds
+    ``__response_cache_max_entries__`` the least recently read entries are
+    evicted.  Setting either to 0 disables the corresponding check.  The
+    time an entry was read is recorded at most every
+    ``__response_cache_touch_interval__`` seconds.
+"""
+
+__author__ = {
+    "ryan faulkner": "rfaulkner@wikimedia.org"
+}
+__date__ = "2013-04-02"
+__license__ = "GPL (version 2 or later)"
+
+from user_metrics.config import settings
+from user_metrics.utils.sqlite_store import SQLiteStore, SQLiteStoreError
+
+
+# Location of the cache database and its eviction policy
+CACHE_FILE = getattr(settings, '__response_cache_file__',
+                     settings.__data_file_dir__ + 'api_data.db')
+CACHE_TTL = getattr(settings, '__response_cache_ttl__', 0)
+CACHE_MAX_ENTRIES = getattr(settings, '__response_cache_max_entries__', 0)
+CACHE_TOUCH_INTERVAL = getattr(settings, '__response_cache_touch_interval__',
+                               300)
+
+# Raised when the cache database cannot be opened or written
+ResponseCacheError = SQLiteStoreError
+
+
+class ResponseCache(SQLiteStore):
+    """
+        Keyed response store backed by the SQLite database at ``path``.
+        Entries carry the full key signature of their request.
+    """
+
+    def __init__(self, path=CACHE_FILE, ttl=CACHE_TTL,
+                 max_entries=CACHE_MAX_ENTRIES,
+                 touch_interval=CACHE_TOUCH_INTERVAL):
+        SQLiteStore.__init__(self, path, ttl=ttl, max_entries=max_entries,
+                             touch_interval=touch_interval)
+
+    def set(self, key, data, key_sig=None):
+        """
+            Stores ``data`` under ``key`` together with the full key
+            signature of the request.  Replaces any existing entry.
+        """
+        SQLiteStore.set(self, key, data, key_sig)
+
+    def key_signatures(self):
+        """ Generates the ``(key, key signature)`` pairs of live entries """
+        for key, key_sig in self.meta_items():
+            if key_sig:
+                yield key, key_sig
+
+
+# Cache instance shared within this process
+_cache = None
+
+
+def get_cache():
+    """ Returns the response cache configured in settings """
+    global _cache
+    if _cache is None:
+        _cache = ResponseCache()
+    return _cache
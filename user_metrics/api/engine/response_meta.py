@@ -9,13 +9,13 @@ __license__ = "GPL (version 2 or later)"
 
 from datetime import datetime
 from collections import OrderedDict
-from dateutil.parser import parse as date_parse
 from re import search
 
 from user_metrics.api.engine import DATETIME_STR_FORMAT
 from user_metrics.api.engine.request_meta import REQUEST_VALUE_MAPPING, \
     ParameterMapping, get_metric_type, get_request_type
 from user_metrics.utils import reverse_dict
+from user_metrics.utils.timestamp import parse_timestamp
 
 REVERSE_GROUP_MAP = reverse_dict(REQUEST_VALUE_MAPPING['group'])
 
@@ -60,11 +60,29 @@ def format_response(request):
         # @TODO get access to the metric default for this attribute
         response['group'] = 'default'
 
-    response['datetime_start'] = date_parse(metric_obj.datetime_start).\
+    response['datetime_start'] = parse_timestamp(metric_obj.datetime_start).\
         strftime(DATETIME_STR_FORMAT)
-    response['datetime_end'] = date_parse(metric_obj.datetime_end).\
+    response['datetime_end'] = parse_timestamp(metric_obj.datetime_end).\
         strftime(DATETIME_STR_FORMAT)
 
     response['data'] = OrderedDict()
 
-    return response, metric_class, metric_obj
\ No newline at end of file
+    return response, metric_class, metric_obj
+
+
+def failed_response(message, request):
+    """
+        Populates the response reporting a failed request.
+
+        Parameters
+        ~~~~~~~~~~
+
+            message : str
+                Reason for the failure.
+
+            request : RequestMeta
+                RequestMeta object that stores request data.
+    """
+    return OrderedDict([('status', 'Request failed.'),
+                        ('exception', message),
+                        ('request', unicode(request))])
@@ -0,0 +1,156 @@
+"""
+    Transport for request results between job workers and the response
+    handler.
+
+    A worker encodes its results as JSON into a spool file and passes only a
+    small handle over the job queue.  The response handler reads the payload
+    back through the handle and the spool file is removed. ::
+
+        >>> handle = write_result(results)
+        >>> queue.put(handle)
+        ...
+        >>> payload = read_result(queue.get())
+        >>> data = decode_result(payload)
+
+    Spool files are framed with a header line carrying the format tag and the
+    payload length so that truncated payloads are detected rather than
+    decoded.  Handles also record the payload size and encoding time which are
+    logged on both ends.  Spool files are written to
+    ``settings.__result_spool_dir__`` (by default ``spool/`` under the data
+    file directory).
+"""
+
+__author__ = {
+    "ryan faulkner": "rfaulkner@wikimedia.org"
+}
+__date__ = "2013-04-04"
+__license__ = "GPL (version 2 or later)"
+
+import json
+from collections import OrderedDict, namedtuple
+from datetime import date, datetime
+from os import close, fdopen, getpid, makedirs, remove, rename
+from os.path import exists
+from shutil import copyfile
+from tempfile import mkstemp
+from time import time
+
+from user_metrics.config import logging, settings
+from user_metrics.api.engine import DATETIME_STR_FORMAT
+
+
+# Directory holding spooled results
+SPOOL_DIR = getattr(settings, '__result_spool_dir__',
+                    settings.__data_file_dir__ + 'spool/')
+
+# Tag of the frame header line, "<tag> <payload length>"
+FRAME_TAG = 'UMAPI-JSON-1'
+
+# Handle passed through the job queue in place of the results.  The type is
+# bound to its own name at module level so that handles can be pickled.
+ResultHandle = namedtuple('ResultHandle', 'path size encode_time')
+
+
+class ResultTransportError(Exception):
+    """ Basic exception class for result transport """
+    def __init__(self, message="Could not transport result."):
+        Exception.__init__(self, message)
+
+
+def _encode_default(obj):
+    """ JSON encoding of types not handled by ``json`` """
+    if isinstance(obj, (datetime, date)):
+        return obj.strftime(DATETIME_STR_FORMAT)
+    # NumPy scalars
+    if hasattr(obj, 'item'):
+        return obj.item()
+    return str(obj)
+
+
+def encode_result(results):
+    """ Encodes results as a JSON string """
+    return json.dumps(results, default=_encode_default)
+
+
+def decode_result(payload):
+    """ Decodes a JSON payload preserving the order of objects """
+    return json.loads(payload, object_pairs_hook=OrderedDict)
+
+
+def write_result(results):
+    """
+        Encodes ``results`` into a new spool file and returns the
+        ``ResultHandle`` that locates it.
+    """
+    start = time()
+    payload = encode_result(results)
+    encode_time = time() - start
+
+    if not exists(SPOOL_DIR):
+        try:
+            makedirs(SPOOL_DIR)
+        except OSError:
+            # Created concurrently
+            pass
+
+    # Write to a temporary name so readers never see a partial file
+    try:
+        fd, tmp_path = mkstemp(dir=SPOOL_DIR, suffix='.tmp')
+        path = tmp_path[:-len('.tmp')] + '.json'
+        with fdopen(fd, 'wb') as spool_file:
+            spool_file.write('{0} {1}\n'.format(FRAME_TAG, len(payload)))
+            spool_file.write(payload)
+        rename(tmp_path, path)
+    except (IOError, OSError) as e:
+        raise ResultTransportError(__name__ + ' :: Could not spool result: '
+                                   + str(e))
+
+    logging.debug(__name__ + ' :: Spooled {0} bytes in {1:.3f}s to {2}. '
+                             '(PID = {3})'.format(len(payload), encode_time,
+                                                  path, getpid()))
+    return ResultHandle(path, len(payload), encode_time)
+
+
+def copy_result(handle):
+    """
+        Copies the spool file located by ``handle`` so that the result may be
+        read by more than one consumer.  Returns the handle of the copy.
+    """
+    try:
+        fd, tmp_path = mkstemp(dir=SPOOL_DIR, suffix='.tmp')
+        close(fd)
+        path = tmp_path[:-len('.tmp')] + '.json'
+        copyfile(handle.path, tmp_path)
+        rename(tmp_path, path)
+    except (AttributeError, IOError, OSError) as e:
+        raise ResultTransportError(__name__ + ' :: Could not copy result: '
+                                   + str(e))
+    return ResultHandle(path, handle.size, handle.encode_time)
+
+
+def read_result(handle, cleanup=True):
+    """
+        Reads the JSON payload located by ``handle`` and, if ``cleanup`` is
+        set, removes the spool file.  Raises ``ResultTransportError`` if the
+        payload is missing or does not match its frame.
+    """
+    start = time()
+    try:
+        with open(handle.path, 'rb') as spool_file:
+            header = spool_file.readline().split()
+            payload = spool_file.read()
+    except (AttributeError, IOError) as e:
+        raise ResultTransportError(__name__ + ' :: Could not read result: '
+                                   + str(e))
+
+    if len(header) != 2 or header[0] != FRAME_TAG or \
+            not header[1].isdigit() or int(header[1]) != len(payload):
+        raise ResultTransportError(__name__ + ' :: Bad result frame in '
+                                   '{0}.'.format(handle.path))
+
+    if cleanup:
+        remove(handle.path)
+
+    logging.debug(__name__ + ' :: Read {0} bytes in {1:.3f}s from {2}.'.
+                  format(len(payload), time() - start, handle.path))
+    return payload
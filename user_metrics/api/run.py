@@ -46,17 +46,15 @@ __license__ = "GPL (version 2 or later)"
 import multiprocessing as mp
 
 from user_metrics.config import logging, settings
-from user_metrics.api.engine.request_manager import job_control, \
-    requests_notification_callback
+from user_metrics.api.engine.request_manager import job_control
 from user_metrics.api.engine.response_handler import process_responses
 from user_metrics.api.views import app
 from user_metrics.api.engine.request_manager import api_request_queue, \
-    req_notification_queue_out, req_notification_queue_in, api_response_queue
+    api_response_queue
 from user_metrics.utils import terminate_process_with_checks
 
 job_controller_proc = None
 response_controller_proc = None
-rm_callback_proc = None
 
 
 ######
@@ -67,34 +65,29 @@ rm_callback_proc = None
 
 
 def teardown():
-    """ When the instance is deleted store the pickled data and shutdown
-        the job controller """
+    """ When the instance is deleted shutdown the job controller """
 
     # Try to shutdown the job control proc gracefully
     try:
         terminate_process_with_checks(job_controller_proc)
         terminate_process_with_checks(response_controller_proc)
-        terminate_process_with_checks(rm_callback_proc)
 
     except Exception:
         logging.error(__name__ + ' :: Could not shut down callbacks.')
 
 
-def setup_controller(req_queue, res_queue, msg_queue_in, msg_queue_out):
+def setup_controller(req_queue, res_queue):
     """
         Sets up the process that handles API jobs
     """
+    global job_controller_proc, response_controller_proc
+
     job_controller_proc = mp.Process(target=job_control,
                                      args=(req_queue, res_queue))
     response_controller_proc = mp.Process(target=process_responses,
-                                          args=(res_queue,
-                                                msg_queue_in))
-    rm_callback_proc = mp.Process(target=requests_notification_callback,
-                                  args=(msg_queue_in,
-                                        msg_queue_out))
+                                          args=(res_queue, req_queue))
     job_controller_proc.start()
     response_controller_proc.start()
-    rm_callback_proc.start()
 
 ######
 #
@@ -104,8 +97,7 @@ def setup_controller(req_queue, res_queue, msg_queue_in, msg_queue_out):
 
 # initialize API data - get the instance
 
-setup_controller(api_request_queue, api_response_queue,
-                 req_notification_queue_in, req_notification_queue_out)
+setup_controller(api_request_queue, api_response_queue)
 
 app.config['SECRET_KEY'] = settings.__secret_key__
 
@@ -19,26 +19,27 @@ __license__ = "GPL (version 2 or later)"
 from flask import Flask, render_template, Markup, redirect, url_for, \
     request, escape, flash, jsonify, make_response
 from re import sub
-from multiprocessing import Lock
+from datetime import datetime
 
 from user_metrics.etl.data_loader import Connector
 from user_metrics.config import logging, settings
 from user_metrics.utils import unpack_fields
 from user_metrics.api.engine.data import get_cohort_refresh_datetime, \
-    get_data, get_url_from_keys, build_key_signature, read_pickle_data
+    get_data, get_url_from_keys, build_key_signature
+from user_metrics.api.engine.response_cache import get_cache
 from user_metrics.api import MetricsAPIError, error_codes, query_mod
 from user_metrics.api.engine.request_meta import filter_request_input, \
     format_request_params, RequestMetaFactory, \
     get_metric_names
-from user_metrics.api.engine.request_manager import api_request_queue, \
-    req_cb_get_cache_keys, req_cb_get_url, req_cb_get_is_running, \
-    req_cb_add_req
+from user_metrics.api.engine.job_scheduler import REQUEST_OWNER_KEY, \
+    REQUEST_KEY_SIG_KEY, get_scheduler_stats
+from user_metrics.api.engine.job_registry import get_registry, \
+    JOB_FIELDS
+from user_metrics.api.engine.request_manager import api_request_queue
+from user_metrics.api.engine import DATETIME_STR_FORMAT
 from user_metrics.metrics.users import MediaWikiUser
 from user_metrics.api.session import APIUser
 
-# View Lock for atomic operations
-VIEW_LOCK = Lock()
-
 # Instantiate flask app
 app = Flask(__name__)
 
@@ -247,23 +248,30 @@ def output(cohort, metric):
     data = get_data(rm)
     key_sig = build_key_signature(rm, hash_result=True)
 
-    # Is the request already running?
-    is_running = req_cb_get_is_running(key_sig, VIEW_LOCK)
-
     # Determine if request is already hashed
     if data and not refresh:
         return make_response(jsonify(data))
 
-    # Determine if the job is already running
-    elif is_running:
+    # Determine if the job is already running.  A refresh is queued anyway,
+    # the job scheduler attaches it to the job should that still be running.
+    elif not refresh and get_registry().is_running(key_sig):
         return render_template('processing.html',
                                error=error_codes[0],
                                url_str=str(rm))
 
-    # Add the request to the queue
+    # Add the request to the queue.  Should an identical request be queued
+    # concurrently the job scheduler attaches both to the same job.
     else:
-        api_request_queue.put(unpack_fields(rm), block=True)
-        req_cb_add_req(key_sig, url, VIEW_LOCK)
+        # Tag the request with its owner for fair scheduling
+        req_item = unpack_fields(rm)
+        if settings.__flask_login_exists__ and \
+                not current_user.is_anonymous():
+            req_item[REQUEST_OWNER_KEY] = current_user.get_id()
+        else:
+            req_item[REQUEST_OWNER_KEY] = request.remote_addr
+        req_item[REQUEST_KEY_SIG_KEY] = key_sig
+        get_registry().add(key_sig, url)
+        api_request_queue.put(req_item, block=True)
 
     return render_template('processing.html', url_str=str(rm))
 
@@ -274,25 +282,34 @@ def job_queue():
     error = get_errors(request.args)
 
     p_list = list()
-    p_list.append(Markup('<thead><tr><th>is_alive</th><th>url'
+    p_list.append(Markup('<thead><tr><th>' +
+                         '</th><th>'.join(JOB_FIELDS[1:]) +
                          '</th></tr></thead>\n<tbody>\n'))
 
-    keys = req_cb_get_cache_keys(VIEW_LOCK)
-    for key in keys:
-        # Log the status of the job
-        url = req_cb_get_url(key, VIEW_LOCK)
-        is_alive = str(req_cb_get_is_running(key, VIEW_LOCK))
-
-        p_list.append('<tr><td>')
+    for job in get_registry().list_jobs():
+        p_list.append(Markup('<tr><td>'))
         response_url = "".join(['<a href="',
                                 request.url_root,
-                                url + '">', url, '</a>'])
-        p_list.append("</td><td>".join([is_alive,
-                                        escape(Markup(response_url)),
-                                        ]))
+                                job['url'] + '">', job['url'], '</a>'])
+        cells = [escape(Markup(response_url))]
+        for field in JOB_FIELDS[2:]:
+            value = job[field]
+            if value and field in ['submitted', 'started', 'finished']:
+                value = datetime.fromtimestamp(value).strftime(
+                    DATETIME_STR_FORMAT)
+            cells.append(escape(str(value or '')))
+        p_list.append(Markup('</td><td>').join(cells))
         p_list.append(Markup('</td></tr>'))
     p_list.append(Markup('\n</tbody>'))
 
+    # Scheduler counters
+    stats = get_scheduler_stats()
+    p_list.append(Markup('<tfoot><tr><td colspan="{0}">'.format(
+        len(JOB_FIELDS) - 1)))
+    p_list.append(', '.join(['{0} = {1:.1f}'.format(key, val)
+                             for key, val in stats.iteritems()]))
+    p_list.append(Markup('</td></tr></tfoot>'))
+
     if error:
         return render_template('queue.html', procs=p_list, error=error)
     else:
@@ -302,21 +319,9 @@ def job_queue():
 def all_urls():
     """ View for listing all requests.  Retrieves from cache """
 
-    # @TODO - this reads the entire cache into memory, filters will be needed
-    # This extracts ALL data from the cache, the data is assumed to be in the
-    # form of <hash key -> (data, key signature)> pairs.  The key signature is
-    # extracted to reconstruct the url.
-
-    all_data = read_pickle_data()
-    key_sigs = list()
-
-    for key, val in all_data.iteritems():
-        if hasattr(val, '__iter__'):
-            try:
-                key_sigs.append(val[1])
-            except (KeyError, IndexError):
-                logging.error(__name__ + ' :: Could not render key signature '
-                                         'from data, key = {0}'.format(key))
+    # The key signature stored with each cached response is used to
+    # reconstruct the url, the response data itself is not read.
+    key_sigs = [key_sig for key, key_sig in get_cache().key_signatures()]
 
     # Compose urls from key sigs
     url_list = list()
@@ -41,6 +41,41 @@
     In this way aggregators and metrics can be combined freely.  New aggregator
     methods can be written to perform different types of aggregation.
 
+    Mergeable aggregators
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    The aggregators ``boolean_rate``, ``weighted_rate``, ``numpy_op`` and
+    ``list_sum_by_group`` are implemented by ``MergeableAggregator``
+    classes.  These fold rows into a compact partial state which can be
+    combined with the states of other rows::
+
+        >>> agg = BooleanRate(val_idx=1)
+        >>> a = agg.update(agg.init(), [[1, 1], [2, 0]])
+        >>> b = agg.update(agg.init(), [[3, 1]])
+        >>> agg.finalize(agg.merge(a, b))
+        [3, 2, 0.6666666666666666]
+
+    So workers processing a partition of a cohort need only return the
+    state of their partition rather than every per-user row.
+    ``get_mergeable`` returns the mergeable form of a registered aggregator
+    method, or None where there is none.
+
+    Approximate quantiles
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    Quantiles such as medians need every value of the cohort.  Built with
+    ``approx_error`` set, ``numpy_op`` aggregators compute medians and the
+    ops returned by ``quantile`` from a ``QuantileSketch`` instead.  The
+    sketch holds a bounded number of values and can be merged.  Quantiles
+    it returns are within ``approx_error`` of the true rank, e.g. with the
+    default of ``settings.__quantile_sketch_error__ = 0.01`` an estimated
+    median lies between the 49th and 51st percentiles::
+
+        >>> ba_p95_agg = build_numpy_op_agg(
+        ...     build_agg_meta([quantile(95)], field_prefixes),
+        ...     metric_header, 'ba_p95_agg',
+        ...     approx_error=QUANTILE_SKETCH_ERROR)
+
     Aggregator Methods
     ~~~~~~~~~~~~~~~~~~
 """
@@ -52,8 +87,12 @@ __license__ = "GPL (version 2 or later)"
 from types import FloatType
 from collections import namedtuple
 from itertools import izip
-from numpy import array, transpose
-from user_metrics.metrics.user_metric import METRIC_AGG_METHOD_FLAG, \
+from math import sqrt, ceil
+from random import Random
+from numpy import array, asarray, percentile
+from user_metrics.config import settings
+from user_metrics.metrics.user_metric import ResultColumns, \
+    METRIC_AGG_METHOD_FLAG, \
     METRIC_AGG_METHOD_HEAD, \
     METRIC_AGG_METHOD_KWARGS, \
     METRIC_AGG_METHOD_NAME
@@ -61,6 +100,12 @@ from user_metrics.metrics.user_metric import METRIC_AGG_METHOD_FLAG, \
 # Type used to carry aggregator meta data
 AggregatorMeta = namedtuple('AggregatorMeta', 'field_name index op')
 
+# Attribute of decorated aggregator methods referencing the method wrapped
+METRIC_AGG_METHOD_BASE = 'metric_agg_base'
+
+# Rank error of approximate quantiles as a fraction of the number of values
+QUANTILE_SKETCH_ERROR = getattr(settings, '__quantile_sketch_error__', 0.01)
+
 
 def decorator_builder(header):
     """
@@ -80,6 +125,7 @@ def decorator_builder(header):
             else:
                 raise AggregatorError('This aggregator (%s) does not operate '
                                       'on this data type.' % f.__name__)
+        setattr(wrapper, METRIC_AGG_METHOD_BASE, f)
         return wrapper
     return eval_data_model
 
@@ -114,14 +160,7 @@ def list_sum_by_group(l, group_index):
             >>> list_sum_by_group(l,0)
             [[1,4], [2,3]]
     """
-    d = dict()
-    for i in l:
-        summables = i[:group_index] + i[group_index+1:]
-        if i[group_index] in d:
-            d[i[group_index]] = map(sum, izip(summables, d[i[group_index]]))
-        else:
-            d[i[group_index]] = summables
-    return [d[k][:group_index] + [k] + d[k][group_index:] for k in d]
+    return ListSumByGroup(group_index).aggregate(l)
 
 
 def list_average_by_group(l, group_index):
@@ -166,61 +205,14 @@ def boolean_rate(iter, **kwargs):
         Useful aggregator for boolean metrics: threshold, survival,
                 live_accounts
     """
-
-    def cmp_method_default(x):
-        return x > 0
-
-    val_idx = kwargs['val_idx'] if 'val_idx' in kwargs else 1
-    cmp_method = kwargs['cmp_method'] if 'cmp_method' in kwargs \
-        else cmp_method_default
-
-    total = 0
-    pos = 0
-    for r in iter.__iter__():
-        try:
-            if cmp_method(r[val_idx]):
-                pos += 1
-            total += 1
-        except IndexError:
-            continue
-        except TypeError:
-            continue
-    if total:
-        return [total, pos, float(pos) / total]
-    else:
-        return [total, pos, 0.0]
+    return BooleanRate(**kwargs).aggregate_metric(iter)
 
 
 def weighted_rate(iter, **kwargs):
     """
         Computes a weighted rate over the elements of the iterator.
     """
-
-    def weight_method_default(x):
-        return 1
-
-    weight_idx = kwargs['weight_idx'] if 'weight_idx' in kwargs else 1
-    val_idx = kwargs['val_idx'] if 'val_idx' in kwargs else 1
-    weight_method = kwargs['weight_method'] if 'cmp_method' in kwargs else \
-        weight_method_default
-
-    count = 0
-    total_weight = 0.0
-    weighted_sum = 0.0
-    for r in iter.__iter__():
-        try:
-            count += 1
-            weight = weight_method(r[weight_idx])
-            total_weight += r[weight_idx]
-            weighted_sum += weight * r[val_idx]
-        except IndexError:
-            continue
-        except TypeError:
-            continue
-    if count:
-        return [count, total_weight, weighted_sum / count]
-    else:
-        return [count, total_weight, 0.0]
+    return WeightedRate(**kwargs).aggregate_metric(iter)
 
 
 def numpy_op(iter, **kwargs):
@@ -230,37 +222,14 @@ def numpy_op(iter, **kwargs):
             **iter** - assumed to be a UserMetric class with _results defined
             as a list of datapoints
     """
+    return NumpyOp(**kwargs).aggregate_metric(iter)
 
-    # Retrieve indices on data for which to compute medians
-    agg_meta = kwargs['agg_meta']
-    values = list()
-
-    # Convert data points to numpy array
-    if hasattr(iter, '_results'):
-        results = array(iter._results)
-    else:
-        results = list()
-        for i in iter:
-            results.append(i)
-        results = array(iter._results)
-
-    # Transpose the array and convert it's elements to Python FloatType
-    results = transpose(results)
-    results = results.astype(FloatType)
 
-    # Compute the median of each specified data index
-    for agg_meta_obj in agg_meta:
-        if not hasattr(agg_meta_obj, 'op') or \
-                not hasattr(agg_meta_obj, 'index'):
-            raise AggregatorError(__name__ + ':: Use AggregatorMeta object to '
-                                             'pass aggregator meta data.')
-        values.append(agg_meta_obj.op(results[agg_meta_obj.index, :]))
-    return values
-
-
-def build_numpy_op_agg(agg_meta_list, metric_header, method_handle):
+def build_numpy_op_agg(agg_meta_list, metric_header, method_handle,
+                       approx_error=None):
     """
-        Builder method for ``numpy_op`` aggregator.
+        Builder method for ``numpy_op`` aggregator.  Quantiles are
+        estimated to within ``approx_error`` if it is set.
     """
     agg_method = numpy_op
     agg_method = decorator_builder(metric_header)(agg_method)
@@ -271,7 +240,8 @@ def build_numpy_op_agg(agg_meta_list, metric_header, method_handle):
     setattr(agg_method, METRIC_AGG_METHOD_HEAD, agg_meta_header)
     setattr(agg_method, METRIC_AGG_METHOD_KWARGS,
             {
-                'agg_meta': agg_meta_list
+                'agg_meta': agg_meta_list,
+                'approx_error': approx_error,
             }
             )
     return agg_method
@@ -287,6 +257,465 @@ def build_agg_meta(op_list, field_prefix_names):
             for op in op_list]
 
 
+def quantile(p):
+    """
+        Returns a numpy op computing the ``p``-th percentile.  The op is
+        named after the percentile, e.g. ``p95``, for use in
+        ``build_agg_meta``.
+    """
+    def quantile_op(values):
+        return percentile(values, p)
+    quantile_op.__name__ = 'p%g' % p
+    quantile_op.quantile = p / 100.0
+    return quantile_op
+
+
+class MergeableAggregator(object):
+    """
+        Base class of aggregators computed over partial states.  A state is
+        built by ``init``, rows are folded into it by ``update``, two states
+        are combined by ``merge`` and ``finalize`` yields the aggregate.
+        States are made of lists, dicts and numbers so they may be returned
+        from pool workers.
+    """
+
+    def init(self):
+        """ Returns the state of no rows """
+        raise NotImplementedError()
+
+    def update(self, state, batch):
+        """ Folds the rows of ``batch`` into ``state`` and returns it """
+        raise NotImplementedError()
+
+    def merge(self, a, b):
+        """ Returns the state combining states ``a`` and ``b`` """
+        raise NotImplementedError()
+
+    def finalize(self, state):
+        """ Returns the aggregate values of ``state`` """
+        raise NotImplementedError()
+
+    def update_columns(self, state, results):
+        """
+            Folds the rows of ``ResultColumns`` into ``state``.  By default
+            rows are read one by one, subclasses may read the columns.
+        """
+        return self.update(state, iter(results))
+
+    def aggregate(self, rows):
+        """ Aggregates ``rows`` in a single pass """
+        return self.finalize(self.update(self.init(), rows))
+
+    def aggregate_metric(self, metric):
+        """ Aggregates the results of ``metric``, column wise if possible """
+        results = getattr(metric, '_results', None)
+        if isinstance(results, ResultColumns):
+            return self.finalize(self.update_columns(self.init(), results))
+        return self.aggregate(metric.__iter__())
+
+
+def _numeric_column(results, idx):
+    """
+        Returns column ``idx`` of ``results`` if it is numeric, otherwise
+        None.  Raises IndexError for missing columns.
+    """
+    column = results.column(idx)
+    return column if column.dtype.kind in 'iubf' else None
+
+
+class BooleanRate(MergeableAggregator):
+    """
+        Fraction of rows whose value at ``val_idx`` meets ``cmp_method``,
+        see ``boolean_rate``.  The state is ``[total, positive]``.
+    """
+
+    def __init__(self, val_idx=1, cmp_method=None, **kwargs):
+        self.val_idx = val_idx
+        self.cmp_method = cmp_method if cmp_method else lambda x: x > 0
+        self._default_cmp = not cmp_method
+
+    def init(self):
+        return [0, 0]
+
+    def update(self, state, batch):
+        for r in batch:
+            try:
+                if self.cmp_method(r[self.val_idx]):
+                    state[1] += 1
+                state[0] += 1
+            except (IndexError, TypeError):
+                continue
+        return state
+
+    def update_columns(self, state, results):
+        try:
+            column = _numeric_column(results, self.val_idx)
+        except IndexError:
+            return state
+        if column is None or not self._default_cmp:
+            return self.update(state, iter(results))
+        state[0] += len(column)
+        state[1] += int((column > 0).sum())
+        return state
+
+    def merge(self, a, b):
+        return [a[0] + b[0], a[1] + b[1]]
+
+    def finalize(self, state):
+        total, pos = state
+        return [total, pos, float(pos) / total if total else 0.0]
+
+
+class WeightedRate(MergeableAggregator):
+    """
+        Weighted rate of the values at ``val_idx``, see ``weighted_rate``.
+        The state is ``[count, total_weight, weighted_sum]``.
+    """
+
+    def __init__(self, val_idx=1, weight_idx=1, weight_method=None,
+                 **kwargs):
+        self.val_idx = val_idx
+        self.weight_idx = weight_idx
+        self.weight_method = weight_method if weight_method else \
+            lambda x: 1
+        self._default_weight = not weight_method
+
+    def init(self):
+        return [0, 0.0, 0.0]
+
+    def update(self, state, batch):
+        for r in batch:
+            try:
+                state[0] += 1
+                weight = self.weight_method(r[self.weight_idx])
+                state[1] += r[self.weight_idx]
+                state[2] += weight * r[self.val_idx]
+            except (IndexError, TypeError):
+                continue
+        return state
+
+    def update_columns(self, state, results):
+        try:
+            values = _numeric_column(results, self.val_idx)
+            weights = _numeric_column(results, self.weight_idx)
+        except IndexError:
+            return self.update(state, iter(results))
+        if values is None or weights is None or not self._default_weight:
+            return self.update(state, iter(results))
+        state[0] += len(values)
+        state[1] += float(weights.sum())
+        state[2] += float(values.sum())
+        return state
+
+    def merge(self, a, b):
+        return [x + y for x, y in izip(a, b)]
+
+    def finalize(self, state):
+        count, total_weight, weighted_sum = state
+        return [count, total_weight,
+                weighted_sum / count if count else 0.0]
+
+
+class QuantileSketch(object):
+    """
+        Mergeable quantile sketch after Karnin, Lang and Liberty ("Optimal
+        Quantile Approximation in Streams", 2016).
+
+        Values are added to a stack of compactors.  When the sketch is full
+        the lowest compactor over its capacity is sorted and every other
+        value moved up a level, each value at level h standing for 2 ** h
+        values of the input.  Capacities shrink geometrically with the
+        depth of the level so the sketch holds O(1 / error) values whatever
+        the number of values added.  The rank of an estimated quantile is,
+        with high probability, within ``error`` times the number of values
+        of the true rank.
+
+        The state ``[count, min, max, levels]`` is made of lists and
+        numbers.  Minimum and maximum are exact.
+    """
+
+    # Ratio of the capacities of successive levels
+    CAPACITY_RATIO = 2.0 / 3.0
+
+    # Capacity of the top level per unit of inverse error
+    CAPACITY_FACTOR = 3.0
+
+    def __init__(self, error=QUANTILE_SKETCH_ERROR):
+        if not 0 < error < 1:
+            raise AggregatorError(__name__ + ':: Quantile error must lie '
+                                             'between 0 and 1.')
+        self.k = int(ceil(self.CAPACITY_FACTOR / error))
+        # Seeded so that the same values yield the same estimates
+        self._random = Random(0)
+
+    def init(self):
+        return [0, None, None, [[]]]
+
+    def _capacity(self, height, depth):
+        return max(2, int(ceil(self.k *
+                               self.CAPACITY_RATIO ** (depth - height - 1))))
+
+    def _compress(self, state):
+        levels = state[3]
+        h = 0
+        while h < len(levels):
+            if len(levels[h]) >= self._capacity(h, len(levels)):
+                if h + 1 == len(levels):
+                    levels.append(list())
+                level = sorted(levels[h])
+                odd = len(level) % 2
+                # Promoting either half at random keeps the estimates unbiased
+                offset = self._random.getrandbits(1)
+                levels[h + 1].extend(level[odd + offset::2])
+                levels[h] = level[:odd]
+            h += 1
+
+    def _full(self, state):
+        levels = state[3]
+        return sum(len(level) for level in levels) >= \
+            sum(self._capacity(h, len(levels)) for h in xrange(len(levels)))
+
+    def update(self, state, x):
+        """ Adds the value ``x`` to ``state`` and returns it """
+        state[0] += 1
+        state[1] = x if state[1] is None else min(state[1], x)
+        state[2] = x if state[2] is None else max(state[2], x)
+        state[3][0].append(x)
+        if self._full(state):
+            self._compress(state)
+        return state
+
+    def merge(self, a, b):
+        if not a[0] or not b[0]:
+            return [b[0], b[1], b[2], [list(l) for l in b[3]]] if not a[0] \
+                else [a[0], a[1], a[2], [list(l) for l in a[3]]]
+        levels = [list() for _ in xrange(max(len(a[3]), len(b[3])))]
+        for h, level in enumerate(a[3]):
+            levels[h].extend(level)
+        for h, level in enumerate(b[3]):
+            levels[h].extend(level)
+        state = [a[0] + b[0], min(a[1], b[1]), max(a[2], b[2]), levels]
+        while self._full(state):
+            self._compress(state)
+        return state
+
+    def quantile(self, state, q):
+        """ Estimates the ``q`` quantile, ``q`` lying in [0, 1] """
+        if not state[0]:
+            return float('nan')
+        if q <= 0:
+            return state[1]
+        if q >= 1:
+            return state[2]
+
+        weighted = sorted((x, 2 ** h) for h, level in enumerate(state[3])
+                          for x in level)
+        target = q * sum(w for _, w in weighted)
+        rank = 0
+        for x, w in weighted:
+            rank += w
+            if rank >= target:
+                return x
+        return state[2]
+
+
+class NumpyOp(MergeableAggregator):
+    """
+        Applies the op of each ``AggregatorMeta`` in ``agg_meta`` to the
+        values at its index, see ``numpy_op``.
+
+        Sums, extrema, means, variances and standard deviations are kept as
+        ``[count, sum, mean, m2, min, max]`` and merged exactly.  Medians and
+        ``quantile`` ops are estimated by a ``QuantileSketch`` if
+        ``approx_error`` is set.  The values themselves are kept for any
+        other op.
+    """
+
+    MOMENT_OPS = ['sum', 'amin', 'amax', 'min', 'max', 'mean', 'var', 'std']
+
+    def __init__(self, agg_meta=None, approx_error=None, **kwargs):
+        agg_meta = agg_meta if agg_meta else list()
+        for agg_meta_obj in agg_meta:
+            if not hasattr(agg_meta_obj, 'op') or \
+                    not hasattr(agg_meta_obj, 'index'):
+                raise AggregatorError(__name__ + ':: Use AggregatorMeta '
+                                                 'object to pass aggregator '
+                                                 'meta data.')
+        self.agg_meta = agg_meta
+        self.sketch = QuantileSketch(approx_error) if approx_error else None
+
+        # How the state of each op is kept: 'moment', 'sketch' or 'values'
+        self.kinds = list()
+        for o in agg_meta:
+            if o.op.__name__ in self.MOMENT_OPS:
+                self.kinds.append('moment')
+            elif self.sketch and self._quantile(o) is not None:
+                self.kinds.append('sketch')
+            else:
+                self.kinds.append('values')
+
+    @staticmethod
+    def _quantile(agg_meta_obj):
+        if agg_meta_obj.op.__name__ == 'median':
+            return 0.5
+        return getattr(agg_meta_obj.op, 'quantile', None)
+
+    def init(self):
+        return [[0, 0.0, 0.0, 0.0, None, None] if kind == 'moment'
+                else self.sketch.init() if kind == 'sketch'
+                else list() for kind in self.kinds]
+
+    def update(self, state, batch):
+        for r in batch:
+            for o, kind, s in izip(self.agg_meta, self.kinds, state):
+                x = FloatType(r[o.index])
+                if kind == 'sketch':
+                    self.sketch.update(s, x)
+                    continue
+                elif kind == 'values':
+                    s.append(x)
+                    continue
+                # Welford's update of the running mean and squared deviations
+                s[0] += 1
+                s[1] += x
+                delta = x - s[2]
+                s[2] += delta / s[0]
+                s[3] += delta * (x - s[2])
+                s[4] = x if s[4] is None else min(s[4], x)
+                s[5] = x if s[5] is None else max(s[5], x)
+        return state
+
+    def update_columns(self, state, results):
+        updated = list()
+        for o, kind, s in izip(self.agg_meta, self.kinds, state):
+            column = asarray(results.column(o.index), dtype=FloatType)
+            if kind == 'sketch':
+                for x in column.tolist():
+                    self.sketch.update(s, x)
+            elif kind == 'values':
+                s.extend(column.tolist())
+            elif len(column):
+                mean = float(column.mean())
+                s = self._merge_moments(
+                    s, [len(column), float(column.sum()), mean,
+                        float(((column - mean) ** 2).sum()),
+                        float(column.min()), float(column.max())])
+            updated.append(s)
+        return updated
+
+    @staticmethod
+    def _merge_moments(sa, sb):
+        if not sa[0] or not sb[0]:
+            return list(sb) if not sa[0] else list(sa)
+        n = sa[0] + sb[0]
+        delta = sb[2] - sa[2]
+        return [n, sa[1] + sb[1], sa[2] + delta * sb[0] / n,
+                sa[3] + sb[3] + delta * delta * sa[0] * sb[0] / n,
+                min(sa[4], sb[4]), max(sa[5], sb[5])]
+
+    def merge(self, a, b):
+        merged = list()
+        for kind, sa, sb in izip(self.kinds, a, b):
+            if kind == 'sketch':
+                merged.append(self.sketch.merge(sa, sb))
+            elif kind == 'values':
+                merged.append(sa + sb)
+            else:
+                merged.append(self._merge_moments(sa, sb))
+        return merged
+
+    def finalize(self, state):
+        values = list()
+        for o, kind, s in izip(self.agg_meta, self.kinds, state):
+            name = o.op.__name__
+            if kind == 'sketch':
+                values.append(self.sketch.quantile(s, self._quantile(o)))
+            elif kind == 'values' or not s[0]:
+                values.append(o.op(array(s if kind == 'values' else [],
+                                         dtype=FloatType)))
+            elif name == 'sum':
+                values.append(s[1])
+            elif name in ['amin', 'min']:
+                values.append(s[4])
+            elif name in ['amax', 'max']:
+                values.append(s[5])
+            elif name == 'mean':
+                values.append(s[2])
+            elif name == 'var':
+                values.append(s[3] / s[0])
+            else:
+                values.append(sqrt(s[3] / s[0]))
+        return values
+
+
+class ListSumByGroup(MergeableAggregator):
+    """
+        Sums of the values of rows keyed on the value at ``group_index``,
+        see ``list_sum_by_group``.  The state maps keys to the sums.
+    """
+
+    def __init__(self, group_index):
+        self.group_index = group_index
+
+    def init(self):
+        return dict()
+
+    def update(self, state, batch):
+        g = self.group_index
+        for i in batch:
+            summables = i[:g] + i[g+1:]
+            if i[g] in state:
+                state[i[g]] = map(sum, izip(summables, state[i[g]]))
+            else:
+                state[i[g]] = summables
+        return state
+
+    def merge(self, a, b):
+        merged = dict(a)
+        for k in b:
+            merged[k] = map(sum, izip(b[k], merged[k])) if k in merged \
+                else b[k]
+        return merged
+
+    def finalize(self, state):
+        g = self.group_index
+        return [state[k][:g] + [k] + state[k][g:] for k in state]
+
+
+# Mergeable forms of the aggregator methods
+MERGEABLE_AGGREGATORS = {
+    boolean_rate: BooleanRate,
+    weighted_rate: WeightedRate,
+    numpy_op: NumpyOp,
+    list_sum_by_group: ListSumByGroup,
+}
+
+
+def get_mergeable(agg_method, metric=None):
+    """
+        Returns the ``MergeableAggregator`` computing ``agg_method`` or None
+        if it has no mergeable form.  Metric agnostic aggregators take their
+        indices from ``metric``.
+    """
+    base = getattr(agg_method, METRIC_AGG_METHOD_BASE, agg_method)
+    if base not in MERGEABLE_AGGREGATORS:
+        return None
+
+    if getattr(agg_method, METRIC_AGG_METHOD_FLAG, False):
+        return MERGEABLE_AGGREGATORS[base](
+            **getattr(agg_method, METRIC_AGG_METHOD_KWARGS, {}))
+    elif metric is not None and hasattr(metric, '_agg_indices') and \
+            base.__name__ in metric._agg_indices:
+        return MERGEABLE_AGGREGATORS[base](
+            metric._agg_indices[base.__name__])
+    return None
+
+
+def merge_states(agg, states):
+    """ Combines the partial ``states`` of the mergeable aggregator ``agg`` """
+    return reduce(agg.merge, states, agg.init())
+
+
 class AggregatorError(Exception):
     """ Basic exception class for aggregators """
     def __init__(self, message="Aggregation error."):
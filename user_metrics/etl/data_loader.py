@@ -44,6 +44,47 @@ for interaction with specific data sources via inherited classes.
 These classes are used to define the data source for the DataReporting family
 of classes using an Adapter structural design pattern.
 
+Connection Pooling
+~~~~~~~~~~~~~~~~~~
+
+Rather than opening a new *Connector* per query, callers may borrow a
+connection from a *ConnectionPool*.  There is one pool per instance (the
+values of *PROJECT_DB_MAP* or *connections* keys) in each process: ::
+
+    conn = get_connection('s1')
+    conn._cur_.execute(SQL_statement)
+    results = conn._cur_.fetchall()
+    del conn    # returns the connection to the pool
+
+Pools keep between *__db_pool_min__* and *__db_pool_max__* connections,
+ping connections that have been idle longer than
+*__db_pool_health_interval__* seconds before handing them out and close
+connections idle for more than *__db_pool_idle_timeout__* seconds.  Callers
+block for up to *__db_pool_wait_timeout__* seconds when the pool is
+exhausted.  Checkout and wait counters are available via *pool_stats()*.
+Pools inherited through a fork are emptied on first use in the child, the
+connections opened by the parent are left open for the parent to use.
+
+Bulk Loading
+~~~~~~~~~~~~
+
+*BulkLoader* writes rows from any iterable, typically a generator such as
+a streamed log parse, to a table over an open connection.  Rows are pulled
+from the source as they are sent so that a slow database holds back the
+producer rather than filling memory: ::
+
+    conn = get_connection('s1')
+    BulkLoader(conn, 'staging.e3_cta4_events').load(rows)
+
+With the *infile* method (the default) rows are written to a temporary
+TSV as they are pulled, and every *__bulk_load_file_rows__* rows the file is
+sent with ``LOAD DATA LOCAL INFILE``, which requires ``'local_infile': 1``
+among the connection settings of the instance.  Where the server refuses it
+the loader falls back to the *insert* method, multi-row INSERTs of
+*__bulk_load_batch_size__* rows.  Either way the load is a single
+transaction and the rate in rows per second is logged.
+*DataLoader.create_table_from_list()* wraps this for scripts.
+
 """
 
 __author__ = "Ryan Faulkner"
@@ -51,9 +92,14 @@ __date__ = "October 3rd, 2012"
 __license__ = "GPL (version 2 or later)"
 
 
-from time import sleep
+from time import sleep, time
+from os import fdopen, getpid, remove
+from re import compile as re_compile
+from itertools import islice
+from tempfile import mkstemp
 import MySQLdb
 import operator
+import threading
 import user_metrics.config.settings as projSet
 
 from user_metrics.config import logging
@@ -80,6 +126,10 @@ class ConnectorError(Exception):
         Exception.__init__(self, message)
 
 
+# MySQLdb handles inherited through a fork - see Connector.abandon()
+_inherited = list()
+
+
 class Connector(object):
     """ This class implements the connection logic to MySQL """
 
@@ -106,6 +156,7 @@ class Connector(object):
             while retries:
                 try:
                     self._db_ = MySQLdb.connect(**mysql_kwargs)
+                    self.pid = getpid()
                     break
                 except MySQLdb.OperationalError as e:
                     logging.debug(__name__ + ' :: Connection dropped. '
@@ -120,8 +171,41 @@ class Connector(object):
 
             self._cur_ = self._db_.cursor()
 
+    def is_alive(self):
+        """ Health check - returns True if the server responds to a ping """
+        try:
+            self._db_.ping()
+        except (AttributeError, MySQLdb.OperationalError,
+                MySQLdb.InterfaceError):
+            return False
+        return True
+
+    def reset_cursor(self):
+        """ Close the current cursor and open a new one """
+        if hasattr(self, '_cur_'):
+            try:
+                self._cur_.close()
+            except MySQLdb.ProgrammingError:
+                pass
+        self._cur_ = self._db_.cursor()
+
+    def abandon(self):
+        """
+            Drop a connection inherited from a parent process without
+            closing it.  Closing it, or letting MySQLdb deallocate it, sends
+            COM_QUIT on the socket the parent is still using so the handles
+            are kept for the life of the process.
+        """
+        for attr in ('_cur_', '_db_'):
+            if hasattr(self, attr):
+                _inherited.append(getattr(self, attr))
+                delattr(self, attr)
+
     def close_db(self):
         """ Close the conection if it remains open """
+        if getattr(self, 'pid', getpid()) != getpid():
+            self.abandon()
+            return
         if hasattr(self, '_cur_'):
             try:
                 self._cur_.close()
@@ -150,6 +234,430 @@ class Connector(object):
         return [elem[0] for elem in column_data]
 
 
+# Pool tuning - see the module docstring
+POOL_MIN_SIZE = getattr(projSet, '__db_pool_min__', 1)
+POOL_MAX_SIZE = getattr(projSet, '__db_pool_max__', 10)
+POOL_IDLE_TIMEOUT = getattr(projSet, '__db_pool_idle_timeout__', 300)
+POOL_WAIT_TIMEOUT = getattr(projSet, '__db_pool_wait_timeout__', 30)
+POOL_HEALTH_INTERVAL = getattr(projSet, '__db_pool_health_interval__', 30)
+
+
+class PooledConnection(object):
+    """
+        A connection borrowed from a *ConnectionPool*.  Exposes the same
+        *_db_* and *_cur_* members as *Connector*.  The connection is returned
+        to the pool by *release()* or when the object is deleted.
+    """
+
+    def __init__(self, pool, connector):
+        self._pool = pool
+        self._connector = connector
+        self._db_ = connector._db_
+        self._cur_ = connector._cur_
+
+    def __del__(self):
+        self.release()
+
+    def release(self):
+        """ Return the connection to its pool """
+        if self._connector is not None:
+            connector = self._connector
+            self._connector = None
+            self._pool.checkin(connector)
+
+    def discard(self):
+        """ Close the connection rather than return it to its pool, e.g.
+            when a streamed result is abandoned before it is read """
+        if self._connector is not None:
+            connector = self._connector
+            self._connector = None
+            self._pool._discard(connector)
+
+    def get_column_names(self):
+        return self._connector.get_column_names()
+
+
+class ConnectionPool(object):
+    """
+        Bounded pool of *Connector* objects for a single instance.  The pool
+        is thread-safe but must not be shared across processes, use
+        *get_pool()* to obtain the pool owned by the calling process.
+    """
+
+    def __init__(self, instance,
+                 min_size=POOL_MIN_SIZE,
+                 max_size=POOL_MAX_SIZE,
+                 idle_timeout=POOL_IDLE_TIMEOUT,
+                 wait_timeout=POOL_WAIT_TIMEOUT,
+                 health_interval=POOL_HEALTH_INTERVAL):
+
+        self.instance = instance
+
+        self._min_size = min_size
+        self._max_size = max(1, max_size)
+        self._idle_timeout = idle_timeout
+        self._wait_timeout = wait_timeout
+        self._health_interval = health_interval
+        self._reset()
+
+    def _reset(self):
+        """ Empty the pool and zero its counters """
+        self.pid = getpid()
+
+        # Idle connections as [connector, last checkin time] - most
+        # recently used last
+        self._idle = list()
+        self._size = 0
+        self._cond = threading.Condition()
+
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+            'timeouts': 0,
+            'created': 0,
+            'evicted': 0,
+            'health_check_failures': 0,
+        }
+
+    def _after_fork(self):
+        """
+            Reset a pool inherited through a fork.  Idle connections belong
+            to the parent and are abandoned, connections the parent had
+            checked out are no longer counted and the lock, which another
+            thread may have held at the fork, is replaced.
+        """
+        for connector, last_used in self._idle:
+            connector.abandon()
+        self._reset()
+
+    def _evict_idle(self):
+        """ Close connections idle beyond the timeout, keeping min_size.
+            The caller must hold the lock. """
+        now = time()
+        while self._idle and self._size > self._min_size and \
+                now - self._idle[0][1] > self._idle_timeout:
+            connector = self._idle.pop(0)[0]
+            connector.close_db()
+            self._size -= 1
+            self._stats['evicted'] += 1
+
+    def _discard(self, connector):
+        """ Drop a connection from the pool and wake a waiter """
+        if connector and connector.pid != getpid():
+            # Checked out before a fork - not counted by this pool
+            connector.abandon()
+            return
+        if connector:
+            connector.close_db()
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def checkout(self):
+        """
+            Borrow a connection.  Blocks while the pool is at capacity and
+            raises *ConnectorError* if none is freed within the wait timeout.
+
+            Return:
+                - PooledConnection.
+        """
+        start = time()
+        waited = False
+        connector = None
+        last_used = None
+        with self._cond:
+            while 1:
+                self._evict_idle()
+                if self._idle:
+                    connector, last_used = self._idle.pop()
+                    break
+                elif self._size < self._max_size:
+                    self._size += 1
+                    break
+
+                remaining = self._wait_timeout - (time() - start)
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise ConnectorError(__name__ + ' :: Timed out '
+                                         'waiting on connection pool '
+                                         '"{0}".'.format(self.instance))
+                waited = True
+                self._cond.wait(remaining)
+
+            wait_time = time() - start
+            self._stats['checkouts'] += 1
+            if waited:
+                self._stats['waits'] += 1
+                self._stats['wait_time_total'] += wait_time
+                self._stats['wait_time_max'] = \
+                    max(self._stats['wait_time_max'], wait_time)
+
+        # Health check connections that have been idle for a while
+        if connector and time() - last_used > self._health_interval \
+                and not connector.is_alive():
+            logging.debug(__name__ + ' :: Discarding dead connection '
+                                     'to "{0}".'.format(self.instance))
+            with self._cond:
+                self._stats['health_check_failures'] += 1
+            connector.close_db()
+            connector = None
+
+        if connector is None:
+            try:
+                connector = Connector(instance=self.instance)
+            except Exception:
+                self._discard(None)
+                raise
+            with self._cond:
+                self._stats['created'] += 1
+        else:
+            connector.reset_cursor()
+        return PooledConnection(self, connector)
+
+    def checkin(self, connector):
+        """ Return a connection to the pool """
+        if connector.pid != getpid():
+            # Checked out before a fork - the socket belongs to the parent
+            connector.abandon()
+            return
+
+        # End any open transaction so the next borrower sees fresh data
+        try:
+            connector._db_.rollback()
+        except (MySQLdb.OperationalError, MySQLdb.InterfaceError,
+                MySQLdb.ProgrammingError):
+            self._discard(connector)
+            return
+
+        with self._cond:
+            self._idle.append([connector, time()])
+            self._cond.notify()
+
+    def stats(self):
+        """ Returns a dict of pool size and checkout/wait counters """
+        with self._cond:
+            stats = dict(self._stats)
+            stats['size'] = self._size
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._size - len(self._idle)
+        return stats
+
+
+# Pools keyed on instance and the process that owns them
+_pools = dict()
+_pools_lock = threading.Lock()
+_pools_pid = getpid()
+
+
+def get_pool(instance):
+    """ Returns the connection pool for ``instance`` owned by this process """
+    global _pools_pid
+    with _pools_lock:
+        if _pools_pid != getpid():
+            for pool in _pools.itervalues():
+                pool._after_fork()
+            _pools_pid = getpid()
+        pool = _pools.get(instance)
+        if pool is None:
+            if instance not in projSet.connections:
+                raise KeyError(instance)
+            pool = ConnectionPool(instance)
+            _pools[instance] = pool
+    return pool
+
+
+def get_connection(instance):
+    """ Borrow a connection for ``instance`` from its pool """
+    return get_pool(instance).checkout()
+
+
+def pool_stats():
+    """ Returns the stats of all pools in this process keyed on instance """
+    return dict((instance, pool.stats())
+                for instance, pool in _pools.items()
+                if pool.pid == getpid())
+
+
+# Bulk load tuning - see the module docstring
+BULK_LOAD_METHOD = getattr(projSet, '__bulk_load_method__', 'infile')
+BULK_LOAD_BATCH_SIZE = getattr(projSet, '__bulk_load_batch_size__', 1000)
+BULK_LOAD_FILE_ROWS = getattr(projSet, '__bulk_load_file_rows__', 500000)
+BULK_LOAD_INSTANCE = getattr(projSet, '__bulk_load_instance__', None)
+
+# MySQL error raised when LOAD DATA LOCAL is disabled
+ER_NOT_ALLOWED_COMMAND = 1148
+
+
+def tsv_field(value):
+    """ Formats ``value`` as a field of a ``LOAD DATA`` file """
+    if value is None:
+        return '\\N'
+    elif isinstance(value, bool):
+        return str(int(value))
+    elif isinstance(value, unicode):
+        value = value.encode('utf-8')
+    else:
+        value = str(value)
+    return value.replace('\\', '\\\\').replace('\t', '\\t').\
+        replace('\n', '\\n').replace('\r', '\\r').replace('\0', '\\0')
+
+
+TSV_ESCAPE_RE = re_compile(r'\\(.)')
+TSV_UNESCAPED = {'\\': '\\', 't': '\t', 'n': '\n', 'r': '\r', '0': '\0'}
+
+
+def tsv_values(line):
+    """
+        Parses a line of a ``LOAD DATA`` file written with *tsv_field*.
+        Values other than NULL are returned as strings.
+    """
+    return [None if field == '\\N' else
+            TSV_ESCAPE_RE.sub(lambda match: TSV_UNESCAPED[match.group(1)],
+                              field)
+            for field in line.rstrip('\n').split('\t')]
+
+
+class BulkLoader(object):
+    """
+        Loads rows into ``table`` over the connection ``conn`` (a
+        *Connector* or *PooledConnection*).  ``columns`` names the table
+        columns in row order, all columns when empty.  ``method`` is one of
+        *INFILE* and *INSERT*.
+    """
+
+    INFILE = 'infile'
+    INSERT = 'insert'
+
+    def __init__(self, conn, table, columns=None,
+                 method=BULK_LOAD_METHOD,
+                 batch_size=BULK_LOAD_BATCH_SIZE,
+                 file_rows=BULK_LOAD_FILE_ROWS):
+
+        if method not in (self.INFILE, self.INSERT):
+            raise DataLoaderError(__name__ + ' :: Unknown bulk load method '
+                                             '"{0}".'.format(method))
+        self.conn = conn
+        self.table = table
+        self.columns = list(columns) if columns else []
+        self.method = method
+        self.batch_size = max(1, batch_size)
+        self.file_rows = max(1, file_rows)
+
+        self.rows = 0
+        self.elapsed = 0.0
+
+    def rate(self):
+        """ Rows per second of the last load """
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def _column_list(self):
+        if self.columns:
+            return ' ({0})'.format(', '.join(self.columns))
+        return ''
+
+    def load(self, rows):
+        """
+            Loads the iterable ``rows`` in a single transaction which is
+            rolled back if any batch fails.
+
+            Return:
+                - Integer.  Number of rows loaded.
+        """
+        self.rows = 0
+        start = time()
+        rows = iter(rows)
+        try:
+            while 1:
+                if self.method == self.INFILE:
+                    count = self._load_infile(rows)
+                else:
+                    batch = list(islice(rows, self.batch_size))
+                    if batch:
+                        self._insert(batch)
+                    count = len(batch)
+                if not count:
+                    break
+                self.rows += count
+                self.elapsed = time() - start
+                logging.debug(__name__ + ' :: {0} rows sent to {1} '
+                                         '({2:.0f} rows/s).'.format(
+                                             self.rows, self.table,
+                                             self.rate()))
+            self.conn._db_.commit()
+        except (MySQLdb.Error, IOError, OSError) as e:
+            try:
+                self.conn._db_.rollback()
+            except MySQLdb.Error:
+                pass
+            raise DataLoaderError(__name__ + ' :: Bulk load into {0} failed '
+                                             'after {1} rows: {2}'.format(
+                                                 self.table, self.rows,
+                                                 str(e)))
+
+        self.elapsed = time() - start
+        logging.info(__name__ + ' :: Loaded {0} rows into {1} in {2:.1f}s '
+                                '({3:.0f} rows/s).'.format(
+                                    self.rows, self.table, self.elapsed,
+                                    self.rate()))
+        return self.rows
+
+    def _load_infile(self, rows):
+        """
+            Writes up to file_rows rows pulled from the iterator ``rows`` to
+            a file and sends it with LOAD DATA, falling back to INSERTs.
+            Returns the number of rows sent.
+        """
+        fd, path = mkstemp(suffix='.tsv')
+        try:
+            count = 0
+            with fdopen(fd, 'wb') as tsv_file:
+                for row in islice(rows, self.file_rows):
+                    tsv_file.write('\t'.join([tsv_field(value)
+                                              for value in row]) + '\n')
+                    count += 1
+            if not count:
+                return 0
+
+            try:
+                self.conn._cur_.execute(
+                    "LOAD DATA LOCAL INFILE %s INTO TABLE " + self.table +
+                    " CHARACTER SET utf8 FIELDS TERMINATED BY '\\t' "
+                    "LINES TERMINATED BY '\\n'" + self._column_list(),
+                    (path,))
+            except (MySQLdb.OperationalError, MySQLdb.ProgrammingError,
+                    MySQLdb.NotSupportedError) as e:
+                if e.args[0] != ER_NOT_ALLOWED_COMMAND:
+                    raise
+                logging.info(__name__ + ' :: LOAD DATA LOCAL refused, '
+                                        'loading {0} with INSERTs.'.format(
+                                            self.table))
+                self.method = self.INSERT
+
+                # Read the rows back from the file a batch at a time
+                with open(path, 'rb') as tsv_file:
+                    while 1:
+                        batch = [tsv_values(line) for line in
+                                 islice(tsv_file, self.batch_size)]
+                        if not batch:
+                            break
+                        self._insert(batch)
+            return count
+        finally:
+            remove(path)
+
+    def _insert(self, batch):
+        """ Sends ``batch`` as multi-row INSERTs of batch_size rows """
+        width = len(self.columns) if self.columns else len(batch[0])
+        sql = 'INSERT INTO ' + self.table + self._column_list() + \
+              ' VALUES (' + ', '.join(['%s'] * width) + ')'
+        for index in xrange(0, len(batch), self.batch_size):
+            self.conn._cur_.executemany(
+                sql, [tuple(row) for row in
+                      batch[index:index + self.batch_size]])
+
+
 class DataLoader(object):
     """ Singleton class for performing operations on data sets.
         ETL class for xsv and RDBMS data sources. """
@@ -371,6 +879,41 @@ class DataLoader(object):
 
         file_obj.close()
 
+    def create_table_from_list(self, rows, create_sql, table_name,
+                               instance=BULK_LOAD_INSTANCE, columns=None,
+                               method=BULK_LOAD_METHOD):
+        """
+            Bulk loads rows into a table, see *BulkLoader*.
+
+            Parameters:
+                - **rows** - iterable of lists or tuples.  Rows to load, may
+                    be a generator.
+                - **create_sql** - String.  Statement creating the table,
+                    not run when empty.
+                - **table_name** - String.  Table to load.
+                - **instance** - String.  Instance hosting the table.
+                    Defaults to *__bulk_load_instance__*.
+
+            Return:
+                - Integer.  Number of rows loaded.
+        """
+        if not instance:
+            raise DataLoaderError(__name__ + ' :: No instance to load {0} '
+                                             'into.'.format(table_name))
+        conn = get_connection(instance)
+        try:
+            if create_sql:
+                try:
+                    conn._cur_.execute(create_sql)
+                except MySQLdb.Error as e:
+                    raise DataLoaderError(__name__ + ' :: Could not create '
+                                                     '{0}: {1}'.format(
+                                                         table_name, str(e)))
+            return BulkLoader(conn, table_name, columns=columns,
+                              method=method).load(rows)
+        finally:
+            conn.release()
+
 
     def remove_duplicates(self, l):
         """
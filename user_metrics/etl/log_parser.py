@@ -1,5 +1,20 @@
 """
     Handles logic for parsing log requests into a readable format
+
+    ``LineParseMethods.parse`` applies one of the line parser methods to each
+    line of a log and drops lines the method rejects (empty results).  With
+    ``stream=True`` the parsed lines are returned as a generator so that logs
+    of any size can be fed to a loader without being held in memory.  With
+    ``parallel=True`` uncompressed logs are split into byte ranges of
+    ``CHUNK_SIZE`` which are parsed by the process executor of
+    ``multiprocessing_wrapper``, lines being returned in the order of the
+    log.  Gzipped logs cannot be split and are always read sequentially. ::
+
+        >>> rows = LineParseMethods.parse('click-tracking.log',
+        ...     LineParseMethods.e3_cta4_log_parse_client, stream=True,
+        ...     parallel=True)
+        >>> for row in rows:
+        ...
 """
 
 __author__ = "Ryan Faulkner"
@@ -12,11 +27,67 @@ import re
 import logging
 import json
 import gzip
+from collections import deque
+from os.path import getsize
 import user_metrics.config.settings as projSet
+import user_metrics.utils.multiprocessing_wrapper as mpw
 
 # CONFIGURE THE LOGGER
 logging.basicConfig(level=logging.DEBUG, stream=sys.stderr, format='%(asctime)s %(levelname)-8s %(message)s', datefmt='%b-%d %H:%M:%S')
 
+# Byte size of the ranges that logs are split into when parsed in parallel
+CHUNK_SIZE = 64 * 1024 * 1024
+
+# Patterns used by the parser methods, compiled once
+GZIP_REGEX = re.compile(r'\.gz')
+ACUX_SERVER_EVENT_REGEX = re.compile(r'account_create.*userbuckets.*ACUX')
+CTA4_IMPRESSION_REGEX = re.compile(r"ext.articleFeedbackv5@10-option6X-cta_signup_login-impression")
+CTA4_CLICK_REGEX = re.compile(r"ext.articleFeedbackv5@10-option6X-cta_signup_login-button_signup_click")
+USERBUCKETS_REGEX = re.compile(r'userbuckets')
+
+# Client event patterns of ACUX by experiment version
+_acux_client_event_regex = dict()
+
+
+def acux_client_event_regex(version):
+    """ Returns the compiled pattern of ACUX client events for ``version`` """
+    if version not in _acux_client_event_regex:
+        _acux_client_event_regex[version] = re.compile(r'ext.accountCreationUX.*@.*_%s' % version)
+    return _acux_client_event_regex[version]
+
+
+def _parse_lines(file_obj, parse_method, version, end=None):
+    """
+        Generator over the non-empty results of ``parse_method`` for the lines of ``file_obj``.  Lines starting at
+        or after byte offset ``end`` are not read.
+    """
+    while end is None or file_obj.tell() < end:
+        line = file_obj.readline()
+        if not line: break
+        row = parse_method(line, version=version)
+        if row:
+            yield row
+
+
+def _parse_chunk(args):
+    """
+        Process worker for ``LineParseMethods.parse``.  Parses the lines starting within the byte range ``[start,
+        end)`` of the log.  The parser method is passed by name where it is one of ``LineParseMethods``.
+    """
+    path, start, end, header, parse_method, version = args
+    if isinstance(parse_method, basestring):
+        parse_method = getattr(LineParseMethods, parse_method)
+
+    with open(path, 'rb') as file_obj:
+        if start:
+            # Skip the line straddling the start of the range, it belongs to the previous one
+            file_obj.seek(start - 1)
+            file_obj.readline()
+        elif header:
+            file_obj.readline()
+        return list(_parse_lines(file_obj, parse_method, version, end=end))
+
+
 class LineParseMethods():
     """
         Defines methods for processing lines of text primarily from log files.  Each method in this class takes one
@@ -28,27 +99,56 @@ class LineParseMethods():
     """
 
     @classmethod
-    def parse(cls, log_file, parse_method, header=False, version=1):
+    def parse(cls, log_file, parse_method, header=False, version=1, stream=False, parallel=False,
+              chunk_size=CHUNK_SIZE):
         """
             Log processing wapper method.  This takes a log file as input and applies one of the parser methods to
-            the contents, storing the list results in a list.
+            the contents, returning the non-empty results in a list or, if ``stream`` is set, as a generator.  Setting
+            ``parallel`` parses uncompressed logs in ranges of ``chunk_size`` bytes across worker processes.
         """
-        # Open the data file - Process the header
-        if re.search('\.gz', log_file):
-            file_obj = gzip.open(projSet.__data_file_dir__ + log_file, 'rb')
+        path = projSet.__data_file_dir__ + log_file
+        if parallel and not GZIP_REGEX.search(log_file):
+            rows = cls._parse_parallel(path, parse_method, header, version, chunk_size)
         else:
-            file_obj = open(projSet.__data_file_dir__ + log_file, 'r')
-
-        if header: file_obj.readline()
+            rows = cls._parse_sequential(path, parse_method, header, version)
+        return rows if stream else list(rows)
 
-        contents = list()
-        while 1:
-            line = file_obj.readline()
-            if not line: break
-            contents.append(parse_method(line, version=version))
-        return map(lambda x: x, contents)
+    @staticmethod
+    def _parse_sequential(path, parse_method, header, version):
+        # Open the data file - Process the header
+        if GZIP_REGEX.search(path):
+            file_obj = gzip.open(path, 'rb')
+        else:
+            file_obj = open(path, 'r')
 
+        try:
+            if header: file_obj.readline()
+            for row in _parse_lines(file_obj, parse_method, version):
+                yield row
+        finally:
+            file_obj.close()
 
+    @classmethod
+    def _parse_parallel(cls, path, parse_method, header, version, chunk_size):
+        # Methods of this class are sent by name as they cannot be pickled
+        method_name = getattr(parse_method, '__name__', None)
+        if getattr(cls, method_name or '', None) is parse_method:
+            parse_method = method_name
+
+        size = getsize(path)
+        executor = mpw.get_executor(mpw.MODE_PROCESS)
+
+        # Keep at most two ranges per worker in flight so that parsed lines do not pile up ahead of the consumer
+        pending = deque()
+        for start in xrange(0, size, max(1, int(chunk_size))):
+            pending.append(executor.submit(_parse_chunk, (path, start, min(start + chunk_size, size), header,
+                                                          parse_method, version)))
+            if len(pending) >= 2 * executor.size:
+                for row in pending.popleft().get():
+                    yield row
+        while pending:
+            for row in pending.popleft().get():
+                yield row
 
     @staticmethod
     def e3_lm_log_parse(line, version=1):
@@ -120,9 +220,7 @@ class LineParseMethods():
         line_bits = line.strip().split('\t')
         num_fields = len(line_bits)
 
-        regex_str = r'ext.accountCreationUX.*@.*_%s' % version
-
-        if num_fields == 10 and re.search(regex_str, line):
+        if num_fields == 10 and acux_client_event_regex(version).search(line):
             # CLIENT EVENT - impression, assignment, and submit events
             fields = line_bits[0].split()
             project = fields[0]
@@ -147,7 +245,6 @@ class LineParseMethods():
     def e3_acux_log_parse_server_event(line, version=1):
         line_bits = line.split('\t')
         num_fields = len(line_bits)
-        server_event_regex = r'account_create.*userbuckets.*ACUX'
         # handle both events generated from the server and client side via ACUX.  Discriminate the two cases based
         # on the number of fields in the log
 
@@ -156,7 +253,7 @@ class LineParseMethods():
             line_bits = line.split()
 
             try:
-                if re.search(server_event_regex,line):
+                if ACUX_SERVER_EVENT_REGEX.search(line):
                     query_vars = urlparse.parse_qs(line_bits[1])
                     userbuckets = json.loads(query_vars['userbuckets'][0])
 
@@ -184,13 +281,14 @@ class LineParseMethods():
         line_bits = line.split('\t')
         num_fields = len(line_bits)
 
-        regex_1 = r"ext.articleFeedbackv5@10-option6X-cta_signup_login-impression"
-        regex_2 = r"ext.articleFeedbackv5@10-option6X-cta_signup_login-button_signup_click"
+        if num_fields != 10:
+            return []
 
-        if num_fields == 10 and (re.search(regex_1, line) or re.search(regex_2, line)):
+        is_impression = CTA4_IMPRESSION_REGEX.search(line)
+        if is_impression or CTA4_CLICK_REGEX.search(line):
 
             fields = line_bits[0].split()
-            if re.search(regex_1, line):
+            if is_impression:
                 fields.append('impression')
             else:
                 fields.append('click')
@@ -220,7 +318,7 @@ class LineParseMethods():
             try:
                 # Ensure that the user is self made
                 if query_vars['self_made'][0] and query_vars['?event_id'][0] == 'account_create' \
-                and re.search(r'userbuckets',line) and 'campaign' in json.loads(query_vars['userbuckets'][0]):
+                and USERBUCKETS_REGEX.search(line) and 'campaign' in json.loads(query_vars['userbuckets'][0]):
 
                     return [line_bits[0], query_vars['username'][0], query_vars['user_id'][0],
                             query_vars['timestamp'][0], query_vars['?event_id'][0], query_vars['self_made'][0],
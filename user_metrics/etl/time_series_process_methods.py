@@ -1,6 +1,30 @@
 
 """
     This module contains custom methods to extract time series data.
+
+    By default ``build_time_series`` computes each interval by processing
+    the metric over the cohort anew.  For the additive metrics
+    (``EditCount``, ``BytesAdded``, ``NamespaceEdits`` and ``Threshold``)
+    measured over the input period the series is instead built
+    incrementally: the revisions of the cohort over the whole range are read
+    once per chunk of users, binned into intervals with NumPy and tallied
+    per user and interval.  The aggregator is then applied to the per-user
+    rows of each interval.  Pass ``incremental_=False`` to force the
+    per-interval computation.
+
+    Workers report each interval as soon as it is computed and signal when
+    they are done, so the listener collects results as they arrive.  A
+    ``progress`` callable passed to ``build_time_series`` is called with
+    every interval row along with the number of intervals completed and the
+    total.
+
+    Computed intervals are cached keyed on the metric, its parameters, the
+    aggregator, a fingerprint of the cohort and the interval bounds, so that
+    overlapping requests only compute the intervals not yet cached.
+    Intervals ending within ``__interval_cache_mutable_hours__`` of the
+    present may still change and are neither cached nor reused.  The cache
+    is bounded by ``__interval_cache_max_entries__``.  Pass
+    ``interval_cache_=False`` to bypass it.
 """
 
 __author__ = "ryan faulkner"
@@ -8,24 +32,57 @@ __date__ = "12/10/2012"
 __license__ = "GPL (version 2 or later)"
 
 import datetime
-import time
 import os
 from copy import deepcopy
-from dateutil.parser import parse as date_parse
 import operator
 import json
+from hashlib import sha1
+
+from collections import namedtuple, OrderedDict
+from numpy import array, zeros, searchsorted, add, absolute, where
 
 from user_metrics.config import settings
 import user_metrics.metrics.user_metric as um
+import user_metrics.utils.multiprocessing_wrapper as mpw
+from user_metrics.metrics import query_mod, STREAM_BATCH_SIZE
+from user_metrics.metrics.users import USER_METRIC_PERIOD_TYPE
+from user_metrics.metrics.edit_count import EditCount
+from user_metrics.metrics.bytes_added import BytesAdded
+from user_metrics.metrics.namespace_of_edits import NamespaceEdits
+from user_metrics.metrics.threshold import Threshold
+from user_metrics.etl.aggregator import get_mergeable, merge_states
 from user_metrics.utils import format_mediawiki_timestamp
+from user_metrics.utils.timestamp import parse_timestamp
+from user_metrics.utils.sqlite_store import SQLiteStore, SQLiteStoreError
 from multiprocessing import Process, Queue
+from Queue import Empty
 
 from user_metrics.config import logging
 
-# Determines the amount of time to wait before picking completed threads off
-# of the queue
 MAX_THREADS = settings.__time_series_thread_max__
-PROCESS_SLEEP_TIME = 4
+
+# Seconds the listener waits on events before checking for workers that
+# died without reporting
+LISTENER_TIMEOUT = 30
+
+# Types of event messages sent by workers: an interval row, or the worker's
+# PID once it is done
+TS_ROW = 0
+TS_DONE = 1
+
+# Interval cache location, bound and the recent hours that may still change
+INTERVAL_CACHE_FILE = getattr(settings, '__interval_cache_file__',
+                              settings.__data_file_dir__ +
+                              'interval_cache.db')
+INTERVAL_CACHE_MAX_ENTRIES = getattr(settings,
+                                     '__interval_cache_max_entries__',
+                                     100000)
+INTERVAL_CACHE_MUTABLE_HOURS = getattr(settings,
+                                       '__interval_cache_mutable_hours__', 48)
+
+# Metric parameters that do not affect interval results
+INTERVAL_KEY_EXCLUDE = ['datetime_start', 'datetime_end', 'k_', 'kr_',
+                        'log_']
 
 
 def _get_timeseries(date_start, date_end, interval):
@@ -34,12 +91,8 @@ def _get_timeseries(date_start, date_end, interval):
         end date, and interval
     """
 
-    # Ensure the dates are string representations
-    date_start = format_mediawiki_timestamp(date_start)
-    date_end = format_mediawiki_timestamp(date_end)
-
-    c = date_parse(date_start) + datetime.timedelta(hours=-int(interval))
-    e = date_parse(date_end)
+    c = parse_timestamp(date_start) + datetime.timedelta(hours=-int(interval))
+    e = parse_timestamp(date_end)
     while c < e:
         c += datetime.timedelta(hours=int(interval))
         yield c
@@ -72,6 +125,10 @@ def build_time_series(start, end, interval, metric, aggregator, cohort,
             cohort : list(str).
                 list of user IDs
 
+            progress : callable.
+                Optional keyword argument, called as ``progress(row,
+                completed, total)`` as each interval is computed.
+
         e.g.
 
         >>> cohort = ['156171','13234584']
@@ -85,49 +142,77 @@ def build_time_series(start, end, interval, metric, aggregator, cohort,
     """
 
     log = bool(kwargs['log']) if 'log' in kwargs else False
+    incremental = kwargs.pop('incremental_', True)
+    use_cache = kwargs.pop('interval_cache_', True)
+    progress = kwargs.pop('progress', None)
 
     # Get datetime types, and the number of threads
-    start = date_parse(format_mediawiki_timestamp(start))
-    end = date_parse(format_mediawiki_timestamp(end))
+    start = parse_timestamp(start)
+    end = parse_timestamp(end)
     k = kwargs['kt_'] if 'kt_' in kwargs else MAX_THREADS
 
-    # Compute window size and ensure that all the conditions
-    # necessary to generate a proper time series are met
-    num_intervals = int((end - start).total_seconds() / (3600 * interval))
-    intervals_per_thread = num_intervals / k
-
-    # Compose the sets of time series lists
-    f = lambda t, i:  t + datetime.timedelta(
-        hours=int(intervals_per_thread * interval * i))
-    time_series = [_get_timeseries(f(start, i),
-                   f(start, i+1), interval) for i in xrange(k)]
-    if f(start, k) < end:
-        time_series.append(_get_timeseries(f(start, k), end, interval))
-
-    event_queue = Queue()
-    process_queue = list()
-
-    if log:
-        logging.info(__name__ + ' :: Spawning procs\n'
-                                '\t%s - %s, interval = %s\n'
-                                '\tthreads = %s ... ' % (str(start), str(end),
-                                                       interval, k))
-    for i in xrange(len(time_series)):
-        p = Process(target=time_series_worker,
-                    args=(time_series[i], metric, aggregator,
-                          cohort, event_queue, kwargs))
-        p.start()
-        process_queue.append(p)
+    series = list(_get_timeseries(start, end, interval))
+    intervals = zip(series[:-1], series[1:])
+    metric_obj = _build_metric(metric, start, end, kwargs)
 
-    # Call the listener
-    return time_series_listener(process_queue, event_queue)
+    # Only compute the intervals missing from the cache
+    cached = list()
+    if use_cache:
+        key_base = interval_key_base(metric_obj, aggregator, cohort)
+        cached, intervals = lookup_intervals(get_interval_cache(), key_base,
+                                             intervals)
+        if log:
+            logging.info(__name__ + ' :: %s intervals cached, %s to compute.'
+                         % (len(cached), len(intervals)))
+    if not intervals:
+        return sorted(cached, key=operator.itemgetter(0))
 
+    kind = incremental_kind(metric_obj) if incremental else None
+    if kind:
+        if log:
+            logging.info(__name__ + ' :: Building incremental time '
+                                    'series\n\t%s - %s, interval = %s'
+                         % (str(start), str(end), interval))
+        data = build_time_series_incremental(intervals, metric_obj, kind,
+                                             aggregator, cohort,
+                                             progress=progress)
+    else:
+        # Split the intervals into consecutive sets, one per worker
+        size = -(-len(intervals) // k)
+        time_series = [intervals[i:i + size]
+                       for i in xrange(0, len(intervals), size)]
+
+        event_queue = Queue()
+        process_queue = list()
 
-def time_series_listener(process_queue, event_queue):
+        if log:
+            logging.info(__name__ + ' :: Spawning procs\n'
+                                    '\t%s - %s, interval = %s\n'
+                                    '\tthreads = %s ... ' % (
+                                        str(start), str(end), interval,
+                                        len(time_series)))
+        for i in xrange(len(time_series)):
+            p = Process(target=time_series_worker,
+                        args=(time_series[i], metric, aggregator,
+                              cohort, event_queue, kwargs))
+            p.start()
+            process_queue.append(p)
+
+        # Call the listener
+        data = time_series_listener(process_queue, event_queue,
+                                    progress=progress, total=len(intervals))
+
+    if use_cache:
+        store_intervals(get_interval_cache(), key_base, data)
+    return sorted(cached + data, key=operator.itemgetter(0))
+
+
+def time_series_listener(process_queue, event_queue, progress=None,
+                         total=None):
     """
-        Listener for ``time_series_worker``.  Blocks and logs until all
-        processes computing time series data are complete.  Returns time
-        dependent data from metrics.
+        Listener for ``time_series_worker``.  Collects interval rows as the
+        workers send them and returns once every worker has reported that
+        it is done.  Returns time dependent data from metrics.
 
         Parameters
         ~~~~~~~~~~
@@ -137,27 +222,40 @@ def time_series_listener(process_queue, event_queue):
 
             event_queue : multiprocessing.Queue
                 Asynchronous data coming in from worker processes.
-    """
-    data = list()
 
-    while 1:
-        # sleep before checking worker threads
-        time.sleep(PROCESS_SLEEP_TIME)
+            progress : callable
+                Optionally called as ``progress(row, completed, total)``
+                for each interval row received.
 
-        logging.info(__name__ + ' :: Time series process queue\n'
-                                '\t{0} threads. (PID = {1})'.
-            format(str(len(process_queue)), os.getpid()))
-
-        while not event_queue.empty():
-            data.extend(event_queue.get())
-        for p in process_queue:
-            if not p.is_alive():
-                p.terminate()
-                process_queue.remove(p)
+            total : int
+                Number of intervals expected.
+    """
+    data = list()
+    running = dict((p.pid, p) for p in process_queue)
 
-        # exit if all process have finished
-        if not len(process_queue):
-            break
+    while running:
+        try:
+            msg_type, value = event_queue.get(timeout=LISTENER_TIMEOUT)
+        except Empty:
+            # Workers that died never report - stop waiting on them
+            for pid, p in running.items():
+                if not p.is_alive():
+                    logging.error(__name__ + ' :: Time series worker {0} '
+                                             'exited with code {1}.'.
+                                  format(pid, p.exitcode))
+                    del running[pid]
+            continue
+
+        if msg_type == TS_ROW:
+            data.append(value)
+            if progress:
+                progress(value, len(data), total)
+        elif value in running:
+            running.pop(value).join()
+
+            logging.info(__name__ + ' :: Time series worker {0} done, '
+                                    '{1} running. (PID = {2})'.
+                         format(value, len(running), os.getpid()))
 
     # sort
     return sorted(data, key=operator.itemgetter(0), reverse=False)
@@ -175,8 +273,8 @@ def time_series_worker(time_series,
         Parameter
         ~~~~~~~~~
 
-            time_series : list(datetime)
-                Datetimes defining series.
+            time_series : list(tuple)
+                ``(start, end)`` datetimes of the intervals to compute.
 
             metric : string
                 Metric name.
@@ -189,26 +287,24 @@ def time_series_worker(time_series,
 
             event_queue : multiporcessing.Queue
                 Asynchronous data-structure to communicate with parent proc.
+                Each interval row is sent once computed, followed by the
+                worker's PID when it is done.
     """
     log = bool(kwargs['log']) if 'log' in kwargs else False
 
-    data = list()
-    ts_s = time_series.next()
-    new_kwargs = deepcopy(kwargs)
+    try:
+        _time_series_intervals(time_series, metric, aggregator, cohort,
+                               event_queue, kwargs, log)
+    finally:
+        event_queue.put((TS_DONE, os.getpid()))
 
-    # re-map some keyword args relating to thread counts
-    if 'metric_threads' in new_kwargs:
-        d = json.loads(new_kwargs['metric_threads'])
-        for key in d:
-            new_kwargs[key] = d[key]
-        del new_kwargs['metric_threads']
 
-    while 1:
-        try:
-            ts_e = time_series.next()
-        except StopIteration:
-            break
+def _time_series_intervals(time_series, metric, aggregator, cohort,
+                           event_queue, kwargs, log):
+    """ Computes the intervals of ``time_series_worker`` """
+    new_kwargs = _metric_kwargs(kwargs)
 
+    for ts_s, ts_e in time_series:
         if log:
             logging.info(__name__ + ' :: Processing thread:\n'
                                     '\t{0}, {1} - {2} ...'.format(os.getpid(),
@@ -225,10 +321,327 @@ def time_series_worker(time_series,
                                     '\t{0}, {1} - {2} ...'.format(os.getpid(),
                                                                   str(ts_s),
                                                                   str(ts_e)))
-        data.append([str(ts_s), str(ts_e)] + r.data)
-        ts_s = ts_e
+        event_queue.put((TS_ROW, [str(ts_s), str(ts_e)] + r.data))
+
+
+def _metric_kwargs(kwargs):
+    """ Copies ``kwargs`` re-mapping those relating to thread counts """
+    new_kwargs = deepcopy(kwargs)
+    if 'metric_threads' in new_kwargs:
+        d = json.loads(new_kwargs['metric_threads'])
+        for key in d:
+            new_kwargs[key] = d[key]
+        del new_kwargs['metric_threads']
+    return new_kwargs
+
+
+def _build_metric(metric, start, end, kwargs):
+    """ Builds a metric object over the range with its process params set """
+    new_kwargs = _metric_kwargs(kwargs)
+    metric_obj = metric(datetime_start=start, datetime_end=end, **new_kwargs)
+    metric_obj.assign_attributes(new_kwargs, 'process')
+    return metric_obj
+
+
+# INCREMENTAL TIME SERIES
+# #######################
+
+# Kinds of incremental tallies and the number of values tallied per user
+# and interval by each
+INCREMENTAL_FIELDS = {
+    'edit_count': 1,
+    'bytes_added': 5,
+    'namespace_edits': len(NamespaceEdits.VALID_NAMESPACES),
+    'threshold': 1,
+}
+
 
-    event_queue.put(data)
+def incremental_kind(metric_obj):
+    """
+        Returns the kind of tally that builds the time series of
+        ``metric_obj`` incrementally, or None if the metric is not additive
+        over its input period.
+    """
+    try:
+        if int(metric_obj.group) != USER_METRIC_PERIOD_TYPE.INPUT:
+            return None
+    except (TypeError, ValueError):
+        return None
+
+    if type(metric_obj) is EditCount:
+        return 'edit_count'
+    elif type(metric_obj) is BytesAdded:
+        return 'bytes_added'
+    elif type(metric_obj) is NamespaceEdits:
+        return 'namespace_edits'
+    elif type(metric_obj) is Threshold and not metric_obj.survival_:
+        return 'threshold'
+    return None
+
+
+def build_time_series_incremental(intervals, metric_obj, kind, aggregator,
+                                  cohort, progress=None):
+    """
+        Builds the time series of an additive metric from a single read of
+        the cohort's revisions over the range.  Rows have the same layout as
+        those of ``time_series_worker``.
+
+        Parameters:
+
+            intervals : list(tuple).
+                ``(start, end)`` datetimes of the intervals to compute.
+
+            metric_obj : UserMetric.
+                Metric object over the whole range, see ``incremental_kind``.
+
+            kind : str.
+                Kind of tally, a key of ``INCREMENTAL_FIELDS``.
+
+        The remaining parameters are those of ``build_time_series``.
+    """
+    if not intervals:
+        return []
+
+    # Gaps between the intervals are binned too and then skipped
+    series = sorted(set([ts for interval in intervals for ts in interval]))
+    intervals = set(intervals)
+    wanted = [idx for idx in xrange(len(series) - 1)
+              if (series[idx], series[idx + 1]) in intervals]
+    edges = [format_mediawiki_timestamp(ts) for ts in series]
+
+    # Where the aggregator is mergeable workers return the partial state of
+    # their users for each interval rather than the users' tallies
+    mergeable = get_mergeable(aggregator, metric_obj)
+
+    users = [str(user) for user in cohort]
+    args = [kind, edges, wanted, mergeable, metric_obj._pack_params()]
+    results = mpw.map_partitions(users, _incremental_help, metric_obj.k_,
+                                 args, mode=mpw.MODE_THREAD)
+
+    if mergeable:
+        states = dict((idx, list()) for idx in wanted)
+        for idx, state in results:
+            states[idx].append(state)
+
+    data = list()
+    for idx in wanted:
+        if mergeable:
+            agg_data = [getattr(aggregator, um.METRIC_AGG_METHOD_NAME,
+                                aggregator.__name__)] + \
+                mergeable.finalize(merge_states(mergeable, states[idx]))
+        else:
+            metric_obj._results = [
+                format_incremental_row(kind, user, tally[idx], metric_obj)
+                for user, tally in results]
+            agg_data = um.aggregator(aggregator, metric_obj,
+                                     metric_obj.header()).data
+        data.append([str(series[idx]), str(series[idx + 1])] + agg_data)
+        if progress:
+            progress(data[-1], len(data), len(wanted))
+    return data
+
+
+# Query arguments of the incremental workers
+IntervalQueryArgsClass = namedtuple('QueryArgs',
+                                    'date_start date_end namespace parent_len')
+
+
+def _incremental_help(args):
+    """
+        Worker for ``build_time_series_incremental``.  Reads the revisions
+        of a chunk of users over the range and returns ``(user, tally)``
+        pairs, or ``(interval index, state)`` pairs given a mergeable
+        aggregator.
+    """
+    users = args[0]
+    kind, edges, wanted, mergeable, state = args[1]
+
+    metric_params = um.UserMetric._unpack_params(state)
+
+    # Edit counts and namespace edits are taken over all namespaces
+    namespace = None if kind in ['edit_count', 'namespace_edits'] else \
+        metric_params.namespace
+
+    # Revisions are streamed in batches and tallied as they arrive, users
+    # whose revisions could not be read tally zero
+    tally = tally_intervals(kind, users, edges, [])
+    try:
+        for batch in query_mod.rev_interval_query(
+                users, metric_params.project,
+                IntervalQueryArgsClass(edges[0], edges[-1], namespace,
+                                       kind == 'bytes_added'),
+                batch_size=STREAM_BATCH_SIZE):
+            tally += tally_intervals(kind, users, edges, batch)
+    except query_mod.UMQueryCallError as e:
+        logging.error(__name__ + ' :: Could not read revisions: %s '
+                                 '(PID = %s)' % (e.message, os.getpid()))
+        tally = tally_intervals(kind, users, edges, [])
+    if not mergeable:
+        return [(user, tally[idx]) for idx, user in enumerate(users)]
+
+    return [(idx, mergeable.update(
+        mergeable.init(),
+        (format_incremental_row(kind, user, tally[u_idx][idx],
+                                metric_params)
+         for u_idx, user in enumerate(users))))
+        for idx in wanted]
+
+
+def tally_intervals(kind, users, edges, revs):
+    """
+        Tallies revision rows of ``rev_interval_query`` by user and by the
+        intervals delimited by the MediaWiki timestamps ``edges``.  Returns
+        an array of shape ``(users, intervals, INCREMENTAL_FIELDS[kind])``.
+
+        Intervals include their start and exclude their end, except for
+        thresholds which, as ``rev_count_batch_query``, exclude the start
+        and include the end.
+    """
+    user_index = dict((str(user), idx) for idx, user in enumerate(users))
+    tally = zeros((len(users), len(edges) - 1, INCREMENTAL_FIELDS[kind]),
+                  dtype=int)
+
+    revs = [row for row in revs if str(row[0]) in user_index]
+    if not revs:
+        return tally
+
+    user_idx = array([user_index[str(row[0])] for row in revs])
+    side = 'left' if kind == 'threshold' else 'right'
+    bucket = searchsorted(array(edges), array([str(row[1]) for row in revs]),
+                          side=side) - 1
+    keep = (bucket >= 0) & (bucket < len(edges) - 1)
+
+    if kind == 'namespace_edits':
+        field = array([NamespaceEdits.NAMESPACE_INDEX.get(row[2], -1)
+                       for row in revs])
+        keep &= field >= 0
+        add.at(tally, (user_idx[keep], bucket[keep], field[keep]), 1)
+
+    elif kind == 'bytes_added':
+        # A parent id of 0 denotes a new page, rows where either length is
+        # undetermined are dropped
+        parent_len = [0 if row[4] == 0 else row[5] for row in revs]
+        known = array([row[3] is not None and length is not None
+                       for row, length in zip(revs, parent_len)])
+        keep &= known
+        diffs = array([int(row[3]) - int(length) if ok else 0
+                       for row, length, ok in zip(revs, parent_len, known)])
+        values = array([diffs, absolute(diffs), where(diffs > 0, diffs, 0),
+                        where(diffs > 0, 0, diffs), [1] * len(diffs)]).T
+        add.at(tally, (user_idx[keep], bucket[keep]), values[keep])
+
+    else:
+        add.at(tally, (user_idx[keep], bucket[keep], 0), 1)
+
+    return tally
+
+
+def format_incremental_row(kind, user, counts, metric_obj):
+    """
+        Formats a user's tally for an interval as a row of the metric.
+        ``metric_obj`` may be the metric or its unpacked parameters.
+    """
+    if kind == 'edit_count':
+        return [long(user), int(counts[0])]
+    elif kind == 'bytes_added':
+        return [user] + [int(c) for c in counts]
+    elif kind == 'namespace_edits':
+        return user, counts.tolist()
+    else:
+        return long(user), 0 if counts[0] < metric_obj.n else 1
+
+
+# INTERVAL CACHE
+# ##############
+
+# Interval cache shared within this process
+_interval_cache = None
+
+
+def get_interval_cache():
+    """ Returns the interval cache configured in settings """
+    global _interval_cache
+    if _interval_cache is None:
+        _interval_cache = SQLiteStore(
+            INTERVAL_CACHE_FILE, max_entries=INTERVAL_CACHE_MAX_ENTRIES)
+    return _interval_cache
+
+
+def interval_key_base(metric_obj, aggregator, cohort):
+    """
+        Returns the part of interval cache keys common to all intervals of
+        a time series: metric, parameters, aggregator and a fingerprint of
+        the cohort.
+    """
+    params = list()
+    for name, value, _ in metric_obj._pack_params():
+        if name not in INTERVAL_KEY_EXCLUDE:
+            if hasattr(value, '__iter__'):
+                value = sorted(value)
+            params.append([name, str(value)])
+
+    cohort_fingerprint = sha1(','.join(sorted(
+        [str(user) for user in cohort]))).hexdigest()
+
+    return [metric_obj.__class__.__name__,
+            getattr(aggregator, um.METRIC_AGG_METHOD_NAME,
+                    aggregator.__name__),
+            sorted(params), cohort_fingerprint]
+
+
+def interval_key(key_base, ts_s, ts_e):
+    """ Returns the cache key of the interval ``[ts_s, ts_e]`` """
+    return sha1(json.dumps(key_base + [str(ts_s), str(ts_e)])).hexdigest()
+
+
+def _is_mutable(ts_e):
+    """ Could the interval ending at ``ts_e`` still change? """
+    return parse_timestamp(ts_e) > datetime.datetime.now() - \
+        datetime.timedelta(hours=INTERVAL_CACHE_MUTABLE_HOURS)
+
+
+def _encode_default(obj):
+    """ JSON encoding of NumPy scalars found in aggregates """
+    if hasattr(obj, 'item'):
+        return obj.item()
+    return str(obj)
+
+
+def lookup_intervals(cache, key_base, intervals):
+    """
+        Splits ``intervals`` into the rows found in ``cache`` and the
+        intervals left to compute.  Cached rows of mutable intervals are
+        dropped.
+    """
+    cached = list()
+    missing = list()
+    for ts_s, ts_e in intervals:
+        key = interval_key(key_base, ts_s, ts_e)
+        if _is_mutable(ts_e):
+            cache.delete(key)
+            missing.append((ts_s, ts_e))
+            continue
+
+        row = cache.get(key)
+        if row:
+            cached.append(json.loads(row, object_pairs_hook=OrderedDict))
+        else:
+            missing.append((ts_s, ts_e))
+    return cached, missing
+
+
+def store_intervals(cache, key_base, rows):
+    """ Caches the computed interval ``rows`` that may no longer change """
+    for row in rows:
+        if _is_mutable(row[1]):
+            continue
+        try:
+            cache.set(interval_key(key_base, row[0], row[1]),
+                      json.dumps(row, default=_encode_default),
+                      key_base + row[:2])
+        except SQLiteStoreError as e:
+            logging.error(__name__ + ' :: Could not cache interval: ' +
+                          e.message)
 
 
 class TimeSeriesException(Exception):
@@ -5,3 +5,9 @@ from user_metrics.utils import nested_import
 from user_metrics.config import settings
 
 query_mod = nested_import(settings.__query_module__)
+
+# Rows per batch of revision queries streamed to metrics
+STREAM_BATCH_SIZE = getattr(settings, '__query_stream_batch_size__', 10000)
+
+# Users per statement of queries built from one subquery per user
+MAX_USER_SUBQUERIES = getattr(settings, '__query_max_user_subqueries__', 1000)
@@ -5,15 +5,16 @@ __license__ = "GPL (version 2 or later)"
 
 from user_metrics.config import logging
 
-from numpy import median, min, max, mean, std
+from numpy import median, min, max, mean, std, array, unique, bincount, \
+    absolute, where
 from collections import namedtuple
 import user_metric as um
 import os
 from user_metrics.etl.aggregator import list_sum_by_group, \
-    build_numpy_op_agg, build_agg_meta
+    build_numpy_op_agg, build_agg_meta, quantile, QUANTILE_SKETCH_ERROR
 import user_metrics.utils.multiprocessing_wrapper as mpw
-from user_metrics.metrics import query_mod
-from user_metrics.metrics.users import UMP_MAP
+from user_metrics.metrics import query_mod, STREAM_BATCH_SIZE
+from user_metrics.metrics.users import UMP_MAP, get_periods
 
 
 class BytesAdded(um.UserMetric):
@@ -44,18 +45,21 @@ class BytesAdded(um.UserMetric):
                 ['user_id', 'bytes_added_net', 'bytes_added_absolute',
                     'bytes_added_pos', 'bytes_added_neg', 'edit_count']
 
-        This metric forks a separate query on the revision table for each user
-        specified in the call to process().  In order to optimize the
-        execution of this implementation the call allows the caller to specify
-        the number of threads as a keyword argument, `num_threads`, to the
-        process() method.
+        By default (``set_based_=True``) users are partitioned into chunks and
+        each chunk issues a single query that joins every revision to its
+        parent's length.  The per-user totals are then computed with NumPy
+        over the returned arrays.  Setting ``set_based_`` to False falls back
+        to querying the parent length of each revision separately.
     """
 
     # Structure that defines parameters for BytesAdded class
     _param_types = \
         {
             'init': {},
-            'process': {}
+            'process': {
+                'set_based_': [bool, 'Join parent revision lengths in SQL '
+                                     'rather than per revision.', True],
+            }
         }
 
     # Define the metrics data model meta
@@ -88,17 +92,24 @@ class BytesAdded(um.UserMetric):
     def process(self, users, **kwargs):
         """ Setup metrics gathering using multiprocessing """
 
-        # get revisions
         args = self._pack_params()
-        revs = mpw.build_thread_pool(users, _get_revisions, self.k_, args)
+        periods = get_periods(users, self)
 
-        # Start worker threads and aggregate results for bytes added
+        if self.set_based_:
+            self._results = mpw.map_partitions(periods, _process_set_based,
+                                               self.k_, args,
+                                               mode=mpw.MODE_THREAD)
+        else:
+            # get revisions
+            revs = mpw.map_partitions(periods, _get_revisions, self.k_, args,
+                                      mode=mpw.MODE_THREAD)
 
-        self._results = \
-            list_sum_by_group(mpw.build_thread_pool(revs,
-                                                    _process_help,
-                                                    self.k_,
-                                                    args), 0)
+            # Start worker threads and aggregate results for bytes added
+            self._results = \
+                list_sum_by_group(mpw.build_thread_pool(revs,
+                                                        _process_help,
+                                                        self.k_,
+                                                        args), 0)
 
         # Add any missing users - O(n)
         tallied_users = set([str(r[0]) for r in self._results])
@@ -109,6 +120,11 @@ class BytesAdded(um.UserMetric):
         return self
 
 
+# Query arguments of the pool workers
+QueryArgsClass = namedtuple('QueryArgs', 'date_start date_end namespace')
+PeriodQueryArgsClass = namedtuple('QueryArgs', 'periods namespace')
+
+
 def _get_revisions(args):
     """ Retrieve total set of revision records for users within timeframe """
     um.log_pool_worker_start(__name__, _get_revisions.__name__, args[0], args[1])
@@ -117,7 +133,6 @@ def _get_revisions(args):
     state = args[1]
 
     metric_params = um.UserMetric._unpack_params(state)
-    query_args_type = namedtuple('QueryArgs', 'date_start date_end namespace')
 
     revs = list()
     umpd_obj = UMP_MAP[metric_params.group](users, metric_params)
@@ -125,8 +140,8 @@ def _get_revisions(args):
         for t in umpd_obj:
             revs += \
                 list(query_mod.rev_query(t.user, metric_params.project,
-                                         query_args_type(t.start, t.end,
-                                                         metric_params.namespace)))
+                                         QueryArgsClass(t.start, t.end,
+                                                        metric_params.namespace)))
     except query_mod.UMQueryCallError as e:
         logging.error('{0}:: {1}. PID={2}'.format(__name__,
                                                   e.message, os.getpid()))
@@ -136,6 +151,82 @@ def _get_revisions(args):
     return revs
 
 
+def _process_set_based(args):
+    """
+        Set-based worker for BytesAdded::process().  Fetches the revisions of
+        a chunk of users along with their parent revision lengths in one
+        query and tallies the results per user with NumPy.
+    """
+    um.log_pool_worker_start(__name__, _process_set_based.__name__,
+                             args[0], args[1])
+
+    users = args[0]
+    state = args[1]
+
+    metric_params = um.UserMetric._unpack_params(state)
+
+    periods = [(str(t.user), t.start, t.end) for t in
+               UMP_MAP[metric_params.group](users, metric_params)]
+    if not periods:
+        return []
+
+    # Revisions are streamed in batches and tallied as they arrive
+    totals = dict()
+    rev_count = 0
+    try:
+        for batch in query_mod.rev_len_parent_query(
+                [p[0] for p in periods], metric_params.project,
+                PeriodQueryArgsClass(periods, metric_params.namespace),
+                batch_size=STREAM_BATCH_SIZE):
+            rev_count += len(batch)
+            for row in tally_bytes_added(batch):
+                if row[0] in totals:
+                    totals[row[0]] = [a + b for a, b in
+                                      zip(totals[row[0]], row[1:])]
+                else:
+                    totals[row[0]] = row[1:]
+    except query_mod.UMQueryCallError as e:
+        logging.error('{0}:: {1}. PID={2}'.format(__name__,
+                                                  e.message, os.getpid()))
+        return []
+
+    results = [[user] + tally for user, tally in totals.iteritems()]
+
+    extra = 'Processed {0} revisions.'.format(rev_count)
+    um.log_pool_worker_end(__name__, _process_set_based.__name__, extra=extra)
+    return results
+
+
+def tally_bytes_added(revs):
+    """
+        Computes per-user bytes added from rows of ``(user, rev_len,
+        rev_parent_id, parent_rev_len)``.  A parent id of 0 denotes a new
+        page with parent length 0.  Rows where either length is undetermined
+        are dropped.  Returns ``[user, net, abs, pos, neg, count]`` lists.
+    """
+    # Keep rows where both lengths are known
+    rows = [(str(row[0]), row[1], 0 if row[2] == 0 else row[3])
+            for row in revs]
+    rows = [row for row in rows if row[1] is not None and
+            row[2] is not None]
+    if not rows:
+        return []
+
+    user_ids, inverse = unique(array([row[0] for row in rows]),
+                               return_inverse=True)
+    diffs = array([int(row[1]) - int(row[2]) for row in rows])
+    n = len(user_ids)
+
+    net = bincount(inverse, weights=diffs, minlength=n)
+    abs_net = bincount(inverse, weights=absolute(diffs), minlength=n)
+    pos = bincount(inverse, weights=where(diffs > 0, diffs, 0), minlength=n)
+    neg = bincount(inverse, weights=where(diffs > 0, 0, diffs), minlength=n)
+    count = bincount(inverse, minlength=n)
+
+    return [[str(user_ids[i]), int(net[i]), int(abs_net[i]), int(pos[i]),
+             int(neg[i]), int(count[i])] for i in xrange(n)]
+
+
 def _process_help(args):
     """
         Determine the bytes added over a number of revisions for user(s).  The
@@ -272,6 +363,15 @@ ba_min_agg = build_numpy_op_agg(build_agg_meta([min], field_prefixes),
 # Build "max" decorator
 ba_max_agg = build_numpy_op_agg(build_agg_meta([max], field_prefixes),
                                 metric_header, 'ba_max_agg')
+# Build approximate "percentile" decorators
+ba_p50_agg = build_numpy_op_agg(build_agg_meta([quantile(50)],
+                                               field_prefixes),
+                                metric_header, 'ba_p50_agg',
+                                approx_error=QUANTILE_SKETCH_ERROR)
+ba_p95_agg = build_numpy_op_agg(build_agg_meta([quantile(95)],
+                                               field_prefixes),
+                                metric_header, 'ba_p95_agg',
+                                approx_error=QUANTILE_SKETCH_ERROR)
 
 
 # Used for testing
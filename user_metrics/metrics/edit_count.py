@@ -7,7 +7,7 @@ from os import getpid
 from collections import namedtuple
 import user_metric as um
 from user_metrics.metrics import query_mod
-from user_metrics.metrics.users import UMP_MAP
+from user_metrics.metrics.users import UMP_MAP, get_periods
 from user_metrics.utils import multiprocessing_wrapper as mpw
 from user_metrics.config import logging
 
@@ -78,10 +78,10 @@ class EditCount(um.UserMetric):
                     stores user names or user ids
         """
 
-        # Pack args, call thread pool
+        # Pack args, resolve user periods once, call thread pool
         args = self._pack_params()
-        results = mpw.build_thread_pool(users, _process_help,
-                                        self.k_, args)
+        results = mpw.build_thread_pool(get_periods(users, self),
+                                        _process_help, self.k_, args)
 
         # Get edit counts from query - all users not appearing have
         # an edit count of 0
@@ -97,6 +97,10 @@ class EditCount(um.UserMetric):
         return self
 
 
+# Query arguments of the pool workers
+QueryArgsClass = namedtuple('QueryArgs', 'date_start date_end')
+
+
 def _process_help(args):
     """
         Worker thread method for edit count.
@@ -107,7 +111,6 @@ def _process_help(args):
     state = args[1]
 
     metric_params = um.UserMetric._unpack_params(state)
-    query_args_type = namedtuple('QueryArgs', 'date_start date_end')
 
     logging.debug(__name__ + ':: Executing EditCount on '
                              '%s users (PID = %s)' % (len(users), getpid()))
@@ -116,7 +119,7 @@ def _process_help(args):
     umpd_obj = UMP_MAP[metric_params.group](users, metric_params)
     results = list()
     for t in umpd_obj:
-        args = query_args_type(t.start, t.end)
+        args = QueryArgsClass(t.start, t.end)
 
         # Build edit count results list
         results += query_mod.edit_count_user_query(t.user,
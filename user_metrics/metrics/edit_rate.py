@@ -4,14 +4,15 @@ __date__ = "July 27th, 2012"
 __license__ = "GPL (version 2 or later)"
 
 from copy import deepcopy
-from dateutil.parser import parse as date_parse
 import user_metric as um
 import edit_count as ec
 from user_metrics.etl.aggregator import weighted_rate, decorator_builder, \
-    build_numpy_op_agg, build_agg_meta
+    build_numpy_op_agg, build_agg_meta, quantile, \
+    QUANTILE_SKETCH_ERROR
 from numpy import median, min, max, mean, std
 from user_metrics.metrics.users import USER_METRIC_PERIOD_TYPE as umpt
-from user_metrics.utils import enum, format_mediawiki_timestamp
+from user_metrics.utils import enum
+from user_metrics.utils.timestamp import parse_timestamp
 from user_metrics.metrics.user_metric import METRIC_AGG_METHOD_KWARGS
 
 
@@ -113,10 +114,8 @@ class EditRate(um.UserMetric):
             time_diff_sec = self.t * 3600.0
         elif self.group == umpt.INPUT:
             try:
-                start_ts_obj = date_parse(
-                    format_mediawiki_timestamp(self.datetime_start))
-                end_ts_obj = date_parse(
-                    format_mediawiki_timestamp(self.datetime_end))
+                start_ts_obj = parse_timestamp(self.datetime_start)
+                end_ts_obj = parse_timestamp(self.datetime_end)
             except (AttributeError, ValueError):
                 raise um.UserMetricError()
 
@@ -175,3 +174,16 @@ er_stats_agg = build_numpy_op_agg(build_agg_meta(op_list, field_prefixes),
 
 agg_kwargs = getattr(er_stats_agg, METRIC_AGG_METHOD_KWARGS)
 setattr(er_stats_agg, METRIC_AGG_METHOD_KWARGS, agg_kwargs)
+
+# Build approximate "dist" and "percentile" decorators
+er_approx_stats_agg = build_numpy_op_agg(
+    build_agg_meta(op_list, field_prefixes), metric_header,
+    'er_approx_stats_agg', approx_error=QUANTILE_SKETCH_ERROR)
+er_p50_agg = build_numpy_op_agg(build_agg_meta([quantile(50)],
+                                               field_prefixes),
+                                metric_header, 'er_p50_agg',
+                                approx_error=QUANTILE_SKETCH_ERROR)
+er_p95_agg = build_numpy_op_agg(build_agg_meta([quantile(95)],
+                                               field_prefixes),
+                                metric_header, 'er_p95_agg',
+                                approx_error=QUANTILE_SKETCH_ERROR)
@@ -10,7 +10,7 @@ import user_metric as um
 import user_metrics.utils.multiprocessing_wrapper as mpw
 from collections import namedtuple
 from os import getpid
-from dateutil.parser import parse as date_parse
+from user_metrics.utils.timestamp import parse_timestamp
 from user_metrics.etl.aggregator import decorator_builder, boolean_rate
 from user_metrics.metrics import query_mod
 
@@ -98,6 +98,10 @@ class LiveAccount(um.UserMetric):
         return self
 
 
+# Query arguments of the pool workers
+QueryArgsClass = namedtuple('QueryArgs', 'namespace')
+
+
 def _process_help(args):
 
     # Unpack args
@@ -117,7 +121,7 @@ def _process_help(args):
     #
     # Query will return: (user id, time of registration, time of first
     # edit button click)
-    query_args = namedtuple('QueryArgs', 'namespace')(thread_args.namespace)
+    query_args = QueryArgsClass(thread_args.namespace)
     query_results = query_mod.live_account_query(users, thread_args.project,
                                                  query_args)
 
@@ -127,7 +131,8 @@ def _process_help(args):
     for row in query_results:
         try:
             # get the difference in minutes
-            diff = (date_parse(row[2]) - date_parse(row[1])).total_seconds()
+            diff = (parse_timestamp(row[2]) -
+                    parse_timestamp(row[1])).total_seconds()
             diff /= 60
         except Exception:
             continue
@@ -9,10 +9,11 @@ from user_metrics.config import logging
 import user_metric as um
 import user_metrics.utils.multiprocessing_wrapper as mpw
 from collections import namedtuple, OrderedDict
+from numpy import zeros
 from user_metrics.etl.aggregator import decorator_builder
 from os import getpid
 from user_metrics.metrics import query_mod
-from user_metrics.metrics.users import UMP_MAP
+from user_metrics.metrics.users import UMP_MAP, get_periods
 
 
 class NamespaceEdits(um.UserMetric):
@@ -28,7 +29,8 @@ class NamespaceEdits(um.UserMetric):
         element:
 
             * User ID
-            * Dictionary of namespace edit counts
+            * List of edit counts by namespace, ordered as
+                ``NamespaceEdits.VALID_NAMESPACES``
 
         For example to produce the above datapoint for a user id one could
         call: ::
@@ -51,11 +53,19 @@ class NamespaceEdits(um.UserMetric):
                 ('12', 0), ('13', 0), ('14', 5), ('15', 0), ('100', 1),
                 ('101', 2), ('108', 0), ('109', 0)])]
 
+        Users are processed in chunks.  When all users of a chunk share the
+        same period (e.g. ``UMPInput``) the chunk is counted with a single
+        grouped query, otherwise each user's window is matched in one
+        batched query.
     """
 
     # namespaces or which counts are gathered
     VALID_NAMESPACES = [-1, -2] + range(16) + [100, 101, 108, 109]
 
+    # column of each namespace in the edit count vectors
+    NAMESPACE_INDEX = dict((ns, idx) for idx, ns in
+                           enumerate(VALID_NAMESPACES))
+
     # Structure that defines parameters for RevertRate class
     _param_types = {
         'init': {},
@@ -93,11 +103,17 @@ class NamespaceEdits(um.UserMetric):
 
         # Multiprocessing vs. single processing execution
         args = self._pack_params()
-        self._results = mpw.build_thread_pool(user_handle, _process_help,
-                                              self.k_, args)
+        self._results = mpw.map_partitions(get_periods(user_handle, self),
+                                           _process_help, self.k_, args,
+                                           mode=mpw.MODE_THREAD)
         return self
 
 
+# Query arguments of the pool workers
+QueryArgsClass = namedtuple('QueryArgs', 'start end')
+PeriodQueryArgsClass = namedtuple('QueryArgs', 'periods')
+
+
 def _process_help(args):
     """
         Worker thread method for NamespaceOfEdits::process().
@@ -107,35 +123,51 @@ def _process_help(args):
     state = args[1]
 
     metric_params = um.UserMetric._unpack_params(state)
-    query_args_type = namedtuple('QueryArgs', 'start end')
 
     if metric_params.log_:
         logging.info(__name__ + '::Computing namespace edits. (PID = %s)' %
                                 getpid())
 
-    # Tally counts of namespace edits
-    results = dict()
-    ump_res = UMP_MAP[metric_params.group](users, metric_params)
-    for ump_rec in ump_res:
-
-        results[str(ump_rec.user)] = OrderedDict()
-
-        for ns in NamespaceEdits.VALID_NAMESPACES:
-            results[str(ump_rec.user)][str(ns)] = 0
-
-        query_results = query_mod.namespace_edits_rev_query([ump_rec.user],
-            metric_params.project,
-            query_args_type(ump_rec.start, ump_rec.end))
-
-        for row in query_results:
-            try:
-                if row[1] in NamespaceEdits.VALID_NAMESPACES:
-                    results[str(row[0])][str(row[1])] = int(row[2])
-            except (KeyError, IndexError):
-                logging.error(__name__ + "::Could not process row: %s" % str(row))
-                continue
+    periods = [(str(t.user), t.start, t.end) for t in
+               UMP_MAP[metric_params.group](users, metric_params)]
+    if not periods:
+        return []
+    user_handles = [p[0] for p in periods]
+
+    # Users sharing a single window are counted with the plain user list
+    windows = set([(p[1], p[2]) for p in periods])
+    try:
+        if len(windows) == 1:
+            start, end = windows.pop()
+            query_results = query_mod.namespace_edits_rev_query(
+                user_handles, metric_params.project,
+                QueryArgsClass(start, end))
+        else:
+            query_results = query_mod.namespace_edits_period_query(
+                user_handles, metric_params.project,
+                PeriodQueryArgsClass(periods))
+    except query_mod.UMQueryCallError as e:
+        logging.error(__name__ + '::Could not count namespace edits: %s '
+                                 '(PID = %s)' % (e.message, getpid()))
+        return []
+
+    # Tally counts of namespace edits - one row per user
+    user_index = dict((user, idx) for idx, user in enumerate(user_handles))
+    counts = zeros((len(user_handles),
+                    len(NamespaceEdits.VALID_NAMESPACES)), dtype=int)
+    for row in query_results:
+        try:
+            counts[user_index[str(row[0])],
+                   NamespaceEdits.NAMESPACE_INDEX[row[1]]] = int(row[2])
+        except KeyError:
+            # namespace not tracked
+            continue
+        except (IndexError, TypeError, ValueError):
+            logging.error(__name__ + "::Could not process row: %s" % str(row))
+            continue
 
-    return [(user, results[user]) for user in results]
+    return [(user, counts[idx].tolist()) for user, idx in
+            user_index.iteritems()]
 
 
 # ==========================
@@ -147,15 +179,16 @@ def _process_help(args):
 @decorator_builder(NamespaceEdits.header())
 def namespace_edits_sum(metric):
     """ Computes the fraction of editors reaching a threshold """
-    summed_results = ["namespace_edits_sum", OrderedDict()]
-    for ns in NamespaceEdits.VALID_NAMESPACES:
-        summed_results[1][str(ns)] = 0
+    totals = zeros(len(NamespaceEdits.VALID_NAMESPACES), dtype=int)
     for r in metric.__iter__():
         try:
-            for ns in NamespaceEdits.VALID_NAMESPACES:
-                summed_results[1][str(ns)] += r[1][str(ns)]
-        except (IndexError, TypeError):
+            totals += r[1]
+        except (IndexError, TypeError, ValueError):
             continue
+
+    summed_results = ["namespace_edits_sum", OrderedDict()]
+    for ns, total in zip(NamespaceEdits.VALID_NAMESPACES, totals.tolist()):
+        summed_results[1][str(ns)] = total
     return summed_results
 setattr(namespace_edits_sum, um.METRIC_AGG_METHOD_FLAG, True)
 setattr(namespace_edits_sum, um.METRIC_AGG_METHOD_NAME,
@@ -7,13 +7,14 @@ __license__ = "GPL (version 2 or later)"
 from user_metrics.config import logging
 
 from collections import namedtuple
+from itertools import izip
 import user_metric as um
 import collections
 import os
 import user_metrics.utils.multiprocessing_wrapper as mpw
 from user_metrics.etl.aggregator import decorator_builder, weighted_rate
 from user_metrics.metrics import query_mod
-from user_metrics.metrics.users import UMP_MAP
+from user_metrics.metrics.users import UMP_MAP, get_periods
 from user_metrics.utils import format_mediawiki_timestamp
 
 # Definition of persistent state for RevertRate objects
@@ -21,7 +22,10 @@ RevertRateArgsClass = collections.namedtuple('RevertRateArgs',
                                              'project log_progress '
                                              'look_ahead look_back t '
                                              'rev_threads namespace '
-                                             'group')
+                                             'group batch')
+
+# Revision query arguments of each user
+QueryArgsClass = namedtuple('QueryArgs', 'date_start date_end')
 
 
 class RevertRate(um.UserMetric):
@@ -56,6 +60,15 @@ class RevertRate(um.UserMetric):
         in the past and in the future for a given article we are willing to
         look for a revert.  The identification of reverts is done by matching
         sha1 checksum values over revision history.
+
+        By default (``batch_=True``) a user's revisions are grouped by page
+        and the revision window of each page is fetched once, the sha1 scan
+        is then carried out in memory over that window.  Revisions of a page
+        more than ``look_back + look_ahead`` rev_ids apart get windows of
+        their own so that a window never spans a long stretch of unrelated
+        page history.  Windows are spread over ``rev_threads``.  Setting
+        ``batch_`` to False reverts to issuing the look back and look ahead
+        queries for each revision.
     """
 
     REV_SHA1_IDX = 2
@@ -70,7 +83,10 @@ class RevertRate(um.UserMetric):
                                'back when computing revert.', 15],
             't': [int, 'Length of measurement period.', 168],
         },
-        'process' : {}
+        'process' : {
+            'batch_': [bool, 'Fetch page revision windows once per page '
+                             'rather than once per revision.', True],
+        }
     }
 
     # Define the metrics data model meta
@@ -103,9 +119,9 @@ class RevertRate(um.UserMetric):
 
         args = [self.project, self.log_, self.look_ahead,
                 self.look_back, self.t, self.datetime_end, self.kr_,
-                self.namespace, self.group]
-        self._results = mpw.build_thread_pool(user_handle, _process_help,
-                                              self.k_, args)
+                self.namespace, self.group, self.batch_]
+        self._results = mpw.build_thread_pool(get_periods(user_handle, self),
+                                              _process_help, self.k_, args)
 
         return self
 
@@ -153,6 +169,105 @@ def __future(rev_id, page_id, n, project, namespace):
     return future
 
 
+def __window(page_id, rev_min, rev_max, metric_args):
+    """ Produce the revision window of a page spanning ``rev_min`` to
+            ``rev_max`` padded by the look back and look ahead lengths """
+    try:
+        window = query_mod.page_rev_window_query(page_id, rev_min, rev_max,
+                                                 metric_args.look_back,
+                                                 metric_args.look_ahead,
+                                                 metric_args.project,
+                                                 metric_args.namespace)
+    except query_mod.UMQueryCallError as e:
+        logging.error(__name__ + ' :: Failed to '
+                                 'get revision window: {0}'.format(e.message))
+        window = list()
+    return window
+
+
+def _revert_in_window(window, index, sha1, user_text, look_back, look_ahead):
+    """
+        Returns the revision reverting ``window[index]`` if it exists.  This
+        applies the same sha1 identity-revert check as ``__revert`` to the
+        in-memory revision window of a page.
+
+        Parameters
+        ~~~~~~~~~~
+
+            window : list
+                Page revisions ``(rev_id, rev_user_text, rev_sha1)`` in
+                ascending ``rev_id`` order.
+
+            index : int
+                Position of the revision being inspected in ``window``.
+    """
+    history = set(rev[RevertRate.REV_SHA1_IDX] for rev in
+                  window[max(0, index - look_back):index])
+
+    for rev in window[index + 1:index + 1 + look_ahead]:
+        if rev[RevertRate.REV_SHA1_IDX] in history and \
+           rev[RevertRate.REV_SHA1_IDX] != sha1:
+            if user_text == rev[RevertRate.REV_USER_TEXT_IDX]:
+                return None
+            else:
+                return rev
+    return None
+
+
+def _page_segments(revisions, metric_args):
+    """
+        Groups ``revisions`` by page into ``(page_id, revisions)`` segments
+        whose window is fetched at once.  As rev_ids increase across the
+        wiki the difference of two rev_ids bounds the number of page
+        revisions between them, a page's revisions are split wherever that
+        difference exceeds ``look_back + look_ahead``.
+    """
+    pages = dict()
+    for rev in revisions:
+        pages.setdefault(rev[1], list()).append(rev)
+
+    max_gap = metric_args.look_back + metric_args.look_ahead
+    segments = list()
+    for page_id, page_revs in pages.iteritems():
+        page_revs.sort(key=lambda rev: long(rev[0]))
+        segment = [page_revs[0]]
+        for prev, rev in izip(page_revs, page_revs[1:]):
+            if long(rev[0]) - long(prev[0]) > max_gap:
+                segments.append((page_id, segment))
+                segment = list()
+            segment.append(rev)
+        segments.append((page_id, segment))
+    return segments
+
+
+def _revision_proc_batch(segments, metric_args):
+    """
+        Batched counterpart of ``_revision_proc``.  The window of each
+        segment from ``_page_segments`` is requested once.  Returns the
+        tuple ``(revision_count, revert_count)``.
+    """
+    revision_count = 0.0
+    revert_count = 0.0
+    for page_id, page_revs in segments:
+        rev_ids = [long(rev[0]) for rev in page_revs]
+        window = __window(page_id, min(rev_ids), max(rev_ids), metric_args)
+        positions = dict((long(rev[0]), i) for i, rev in enumerate(window))
+
+        for rev in page_revs:
+            revision_count += 1.0
+
+            # Revisions missing from the window (e.g. filtered by
+            # namespace) have no history and are not reverts
+            if long(rev[0]) not in positions:
+                continue
+            if _revert_in_window(window, positions[long(rev[0])], rev[2],
+                                 rev[3], metric_args.look_back,
+                                 metric_args.look_ahead):
+                revert_count += 1.0
+
+    return revision_count, revert_count
+
+
 def _process_help(args):
     """ Used by Threshold::process() for forking.
         Should not be called externally. """
@@ -160,7 +275,7 @@ def _process_help(args):
     state = args[1]
     thread_args = RevertRateArgsClass(state[0], state[1], state[2],
                                       state[3], state[4], state[6],
-                                      state[7], state[8])
+                                      state[7], state[8], state[9])
     users = args[0]
 
     if thread_args.log_progress:
@@ -181,9 +296,9 @@ def _process_help(args):
         # 1. Obtain user registration date
         # 2. Compute end date based on 't'
         # 3. Get user revisions in time period
-        query_args = namedtuple('QueryArgs', 'date_start date_end')\
-            (format_mediawiki_timestamp(user_data.start),
-             format_mediawiki_timestamp(user_data.end))
+        query_args = QueryArgsClass(
+            format_mediawiki_timestamp(user_data.start),
+            format_mediawiki_timestamp(user_data.end))
 
         try:
             revisions = query_mod.\
@@ -196,9 +311,14 @@ def _process_help(args):
             dropped_users += 1
             continue
 
-        results_thread = mpw.build_thread_pool(revisions, _revision_proc,
-                                               thread_args.rev_threads, state)
-
+        if thread_args.batch:
+            results_thread = mpw.map_partitions(
+                _page_segments(revisions, thread_args), _window_proc,
+                thread_args.rev_threads, state, mode=mpw.MODE_THREAD)
+        else:
+            results_thread = mpw.build_thread_pool(revisions, _revision_proc,
+                                                   thread_args.rev_threads,
+                                                   state)
         for r in results_thread:
             total_revisions += r[0]
             total_reverts += r[1]
@@ -221,7 +341,7 @@ def _revision_proc(args):
     state = args[1]
     thread_args = RevertRateArgsClass(state[0], state[1], state[2],
                                       state[3], state[4], state[6],
-                                      state[7], state[8])
+                                      state[7], state[8], state[9])
     rev_data = args[0]
 
     revision_count = 0.0
@@ -233,6 +353,16 @@ def _revision_proc(args):
     return [(revision_count, revert_count)]
 
 
+def _window_proc(args):
+    """ helper method for computing reverts over page segments """
+
+    state = args[1]
+    thread_args = RevertRateArgsClass(state[0], state[1], state[2],
+                                      state[3], state[4], state[6],
+                                      state[7], state[8], state[9])
+    return [_revision_proc_batch(args[0], thread_args)]
+
+
 # ==========================
 # DEFINE METRIC AGGREGATORS
 # ==========================
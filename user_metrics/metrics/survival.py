@@ -40,7 +40,10 @@ class Survival(um.UserMetric):
             't': [int, 'The time in minutes registration '
                        'after which survival is measured.', 24],
         },
-        'process': {}
+        'process': {
+            'batch_': [bool, 'Count revisions for each chunk of users in '
+                             'a single grouped query.', True],
+        }
     }
 
     # Define the metrics data model meta
@@ -80,6 +83,7 @@ class Survival(um.UserMetric):
         # revision
         kwargs['survival_'] = True
         kwargs['n'] = 1
+        kwargs['batch_'] = self.batch_
 
         self._results = th.Threshold(**kwargs).\
             process(user_handle, **kwargs)._results
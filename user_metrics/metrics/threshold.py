@@ -6,11 +6,12 @@ __license__ = "GPL (version 2 or later)"
 from user_metrics.config import logging
 
 import os
+from collections import namedtuple
 import user_metrics.utils.multiprocessing_wrapper as mpw
 import user_metric as um
 from user_metrics.etl.aggregator import decorator_builder, boolean_rate
 from user_metrics.metrics import query_mod
-from user_metrics.metrics.users import UMP_MAP
+from user_metrics.metrics.users import UMP_MAP, get_periods
 
 
 class Threshold(um.UserMetric):
@@ -34,6 +35,11 @@ class Threshold(um.UserMetric):
             >>> import user_metrics.etl.threshold as t
             >>> for r in t.Threshold().process([13234584]).__iter__(): print r
             (13234584L, 1)
+
+        By default (``batch_=True``) the user windows of each chunk are
+        loaded into a derived table and the revisions of all users in the
+        chunk are counted with one grouped query.  Setting ``batch_`` to
+        False issues a count query per user.
     """
 
     # Structure that defines parameters for Threshold class
@@ -47,6 +53,8 @@ class Threshold(um.UserMetric):
             'survival_': [bool, 'Indicates whether this is '
                                 'to be processed as the survival metric.',
                           False],
+            'batch_': [bool, 'Count revisions for each chunk of users in '
+                             'a single grouped query.', True],
         }
     }
 
@@ -92,8 +100,8 @@ class Threshold(um.UserMetric):
 
         # Process results
         args = self._pack_params()
-        self._results = mpw.build_thread_pool(users, _process_help,
-                                              self.k_, args)
+        self._results = mpw.build_thread_pool(get_periods(users, self),
+                                              _process_help, self.k_, args)
         return self
 
 
@@ -117,6 +125,9 @@ def _process_help(args):
     if not len(users):
         return []
 
+    if metric_params.batch_:
+        return _process_batch(users, metric_params)
+
     results = list()
     dropped_users = 0
     umpd_obj = UMP_MAP[metric_params.group](users, metric_params)
@@ -146,6 +157,48 @@ def _process_help(args):
     return results
 
 
+# Query arguments of the batched workers
+PeriodQueryArgsClass = namedtuple('QueryArgs', 'periods namespace survival_')
+
+
+def _process_batch(users, metric_params):
+    """
+        Computes the threshold flags for a chunk of users with a single
+        ``rev_count_batch_query`` call.  Users absent from the query results
+        made no revisions in their window.
+    """
+    periods = [(long(t.user), t.start, t.end) for t in
+               UMP_MAP[metric_params.group](users, metric_params)]
+    if not periods:
+        return []
+
+    try:
+        counts = dict((long(row[0]), int(row[1])) for row in
+                      query_mod.rev_count_batch_query(
+                          [p[0] for p in periods], metric_params.project,
+                          PeriodQueryArgsClass(periods,
+                                               metric_params.namespace,
+                                               metric_params.survival_)))
+    except query_mod.UMQueryCallError as e:
+        logging.error(__name__ + ' :: Dropped %s users. %s (PID = %s)' % (
+            len(periods), e.message, os.getpid()))
+        return []
+
+    results = list()
+    for uid, _, _ in periods:
+        if counts.get(uid, 0) < metric_params.n:
+            results.append((uid, 0))
+        else:
+            results.append((uid, 1))
+
+    if metric_params.log_:
+        logging.info(__name__ + '::Processed PID = %s.  '
+                                'Counted %s users in one query.' % (
+                                    os.getpid(), len(periods)))
+
+    return results
+
+
 # ==========================
 # DEFINE METRIC AGGREGATORS
 # ==========================
@@ -6,11 +6,15 @@ __license__ = "GPL (version 2 or later)"
 
 from user_metrics.config import logging
 
-from dateutil.parser import parse as date_parse
+import os
+from collections import namedtuple
 import user_metric as um
+import user_metrics.utils.multiprocessing_wrapper as mpw
+from user_metrics.utils.timestamp import parse_timestamp
 from user_metrics.etl.aggregator import weighted_rate, decorator_builder, \
-    build_numpy_op_agg, build_agg_meta
-from user_metrics.metrics import query_mod
+    build_numpy_op_agg, build_agg_meta, quantile, \
+    QUANTILE_SKETCH_ERROR
+from user_metrics.metrics import query_mod, MAX_USER_SUBQUERIES
 from numpy import median, min, max
 
 LAST_EDIT = -1
@@ -47,6 +51,13 @@ class TimeToThreshold(um.UserMetric):
 
         If the termination event never occurs the number of minutes returned
         is -1.
+
+        By default (``batch_=True``) users are split into chunks over the
+        metric workers.  Each chunk fetches only the first
+        ``max(first_edit, threshold_edit) + 1`` revision timestamps of each
+        user, and the latest timestamp with a separate ``MAX()`` query when
+        ``LAST_EDIT`` is requested.  Setting ``batch_`` to False reads the
+        full revision history of each user in turn.
     """
 
     # Structure that defines parameters for TimeToThreshold class
@@ -56,7 +67,10 @@ class TimeToThreshold(um.UserMetric):
             'threshold_type_class': [str, 'Type of threshold to use.',
                                      'edit_count_threshold'],
         },
-        'process': {},
+        'process': {
+            'batch_': [bool, 'Fetch bounded revision histories for chunks '
+                             'of users.', True],
+        },
     }
 
     # Define the metrics data model meta
@@ -154,6 +168,15 @@ class TimeToThreshold(um.UserMetric):
                             threshold
             """
 
+            # Indices before LAST_EDIT need the full history
+            if threshold_obj.batch_ and self._first_edit_ >= LAST_EDIT \
+                    and self._threshold_edit_ >= LAST_EDIT:
+                args = [threshold_obj._pack_params(), self._first_edit_,
+                        self._threshold_edit_]
+                return mpw.map_partitions(users, _process_help,
+                                          threshold_obj.k_, args,
+                                          mode=mpw.MODE_THREAD)
+
             minutes_to_threshold = list()
 
             # For each user gather their revisions
@@ -177,29 +200,102 @@ class TimeToThreshold(um.UserMetric):
                             timestamp for a given user.
             """
             if self._threshold_edit_ == REGISTRATION and len(results):
-                dat_obj_end = date_parse(results[0])
+                dat_obj_end = results[0]
             elif self._threshold_edit_ == LAST_EDIT and len(results):
-                dat_obj_end = date_parse(results[len(results) - 1])
+                dat_obj_end = results[len(results) - 1]
             elif self._threshold_edit_ < len(results):
-                dat_obj_end = date_parse(results[self._threshold_edit_])
+                dat_obj_end = results[self._threshold_edit_]
             else:
                 return -1
 
             if self._first_edit_ == REGISTRATION and len(results) > 0:
-                dat_obj_start = date_parse(results[0])
+                dat_obj_start = results[0]
             elif self._first_edit_ == LAST_EDIT and len(results):
-                dat_obj_start = date_parse(results[len(results) - 1])
+                dat_obj_start = results[len(results) - 1]
             elif self._first_edit_ < len(results):
-                dat_obj_start = date_parse(results[self._first_edit_])
+                dat_obj_start = results[self._first_edit_]
             else:
                 return -1
 
-            time_diff = dat_obj_end - dat_obj_start
-            return int(time_diff.seconds / 60) + abs(time_diff.days) * 24
+            return minute_diff(dat_obj_end, dat_obj_start)
 
     __threshold_types = {'edit_count_threshold': EditCountThreshold}
 
 
+def minute_diff(end, start):
+    """
+        Computes the threshold minutes between the MediaWiki timestamps
+        ``start`` and ``end``.  Returns -1 if either event did not occur.
+    """
+    if end is None or start is None:
+        return -1
+    time_diff = parse_timestamp(end) - parse_timestamp(start)
+    return int(time_diff.total_seconds() // 60)
+
+
+def _edit_timestamp(revs, last_rev, edit):
+    """
+        Returns the timestamp of edit number ``edit`` given the first
+        timestamps ``revs`` of a user and the latest one ``last_rev``.
+    """
+    if edit == LAST_EDIT:
+        return last_rev
+    elif edit < len(revs):
+        return revs[edit]
+    return None
+
+
+# Query arguments of the pool workers
+QueryArgsClass = namedtuple('QueryArgs', 'limit')
+
+
+def _process_help(args):
+    """ Used by EditCountThreshold::process() for the batched path.
+        Should not be called externally. """
+
+    # Unpack args
+    users = args[0]
+    state, first_edit, threshold_edit = args[1]
+
+    metric_params = um.UserMetric._unpack_params(state)
+
+    if metric_params.log_:
+        logging.info(__name__ + ' :: Processing revision data ' +
+                                '(%s users) by user... (PID = %s)' % (
+                                    len(users), os.getpid()))
+
+    edits = [edit for edit in [first_edit, threshold_edit]
+             if edit != LAST_EDIT]
+    head_revs = dict()
+    last_revs = dict()
+    try:
+        # The head query holds a subquery per user, bound its statements
+        for i in xrange(0, len(users) if edits else 0, MAX_USER_SUBQUERIES):
+            for row in query_mod.time_to_threshold_head_query(
+                    users[i:i + MAX_USER_SUBQUERIES], metric_params.project,
+                    QueryArgsClass(max(edits) + 1)):
+                head_revs.setdefault(str(row[0]), list()).append(row[1])
+
+        if LAST_EDIT in [first_edit, threshold_edit]:
+            for row in query_mod.time_to_threshold_last_query(
+                    users, metric_params.project, None):
+                last_revs[str(row[0])] = row[1]
+    except query_mod.UMQueryCallError as e:
+        logging.error(__name__ + ' :: Dropped %s users. %s (PID = %s)' % (
+            len(users), e.message, os.getpid()))
+        return []
+
+    results = list()
+    for user in users:
+        revs = sorted(head_revs.get(str(user), []))
+        last_rev = last_revs.get(str(user))
+        results.append([user,
+                        minute_diff(
+                            _edit_timestamp(revs, last_rev, threshold_edit),
+                            _edit_timestamp(revs, last_rev, first_edit))])
+    return results
+
+
 # ==========================
 # DEFINE METRIC AGGREGATORS
 # ==========================
@@ -228,6 +324,19 @@ ttt_stats_agg = build_numpy_op_agg(build_agg_meta(op_list, field_prefixes),
                                    metric_header,
                                    'ttt_stats_agg')
 
+# Build approximate "dist" and "percentile" decorators
+ttt_approx_stats_agg = build_numpy_op_agg(
+    build_agg_meta(op_list, field_prefixes), metric_header,
+    'ttt_approx_stats_agg', approx_error=QUANTILE_SKETCH_ERROR)
+ttt_p50_agg = build_numpy_op_agg(build_agg_meta([quantile(50)],
+                                                field_prefixes),
+                                 metric_header, 'ttt_p50_agg',
+                                 approx_error=QUANTILE_SKETCH_ERROR)
+ttt_p95_agg = build_numpy_op_agg(build_agg_meta([quantile(95)],
+                                                field_prefixes),
+                                 metric_header, 'ttt_p95_agg',
+                                 approx_error=QUANTILE_SKETCH_ERROR)
+
 
 if __name__ == "__main__":
     for i in TimeToThreshold(threshold_type_class='edit_count_threshold',
@@ -42,6 +42,15 @@
     at the Wikimedia Foundation.  The guidelines for this development may
     be found at https://meta.wikimedia.org/wiki/Research:Metrics.
 
+    Results assigned to ``_results`` are held column wise in a
+    ``ResultColumns`` object, each column typed after the metric's
+    ``_data_model_meta``.  Iterating a metric still yields its results row
+    by row while aggregators may read the column arrays directly::
+
+        >>> metric = BytesAdded().process(users)
+        >>> metric._results.column(1)
+        array([120, -4, 0, ...])
+
 """
 
 __author__ = "Ryan Faulkner"
@@ -52,6 +61,8 @@ from user_metrics.config import logging
 
 import user_metrics.etl.data_loader as dl
 from collections import namedtuple
+from itertools import izip
+from numpy import array, empty, concatenate, int8, int64, float64
 from user_metrics.metrics.users import USER_METRIC_PERIOD_TYPE
 from user_metrics.utils import build_namedtuple
 from os import getpid
@@ -140,8 +151,190 @@ class UserMetricError(Exception):
         Exception.__init__(self, message)
 
 
+# Column types by ``_data_model_meta`` field group, along with the kinds of
+# inferred arrays that may be cast to them.  Boolean fields hold flags such
+# as 0, 1 or -1 for unknown and are kept as small integers.
+RESULT_COLUMN_TYPES = {
+    'integer_fields': (int64, 'iub'),
+    'float_fields': (float64, 'iubf'),
+    'boolean_fields': (int8, 'iub'),
+}
+
+
+class ResultColumns(object):
+    """
+        Metric results held as one array per field.
+
+        Fields listed among the integer, float or boolean fields of the data
+        model are stored as arrays of that type.  Id and date fields, fields
+        missing from the data model and fields whose values do not fit their
+        declared type (e.g. containing None) are stored as object arrays.
+
+        Rows appended are buffered and moved to the columns when these are
+        next read.  The object behaves as the list of rows it replaces:
+        iteration, ``len``, indexing, slicing and ``append`` operate on rows,
+        which are returned as lists of Python values.
+    """
+
+    def __init__(self, data_model_meta=None, width=None):
+        self.width = width
+        self._types = dict()
+        for group, (dtype, kinds) in RESULT_COLUMN_TYPES.iteritems():
+            for idx in (data_model_meta or dict()).get(group, []):
+                self._types[idx] = (dtype, kinds)
+        self._columns = None
+        self._pending = list()
+
+    @classmethod
+    def from_rows(cls, rows, data_model_meta=None):
+        """
+            Builds columns from the sequence of ``rows``.  Returns None if
+            the rows differ in length.
+        """
+        rows = list(rows)
+        widths = set(len(row) for row in rows)
+        if len(widths) > 1:
+            return None
+        results = cls(data_model_meta, widths.pop() if widths else None)
+        results._pending = rows
+        return results
+
+    def _build_column(self, idx, values):
+        if idx in self._types:
+            dtype, kinds = self._types[idx]
+            column = array(values)
+            if column.ndim == 1 and column.dtype.kind in kinds:
+                return column.astype(dtype, copy=False)
+        column = empty(len(values), dtype=object)
+        for row_idx, value in enumerate(values):
+            column[row_idx] = value
+        return column
+
+    def _flush(self):
+        if not self._pending:
+            return
+        new_columns = [self._build_column(idx, values) for idx, values in
+                       enumerate(izip(*self._pending))]
+        if self._columns is None:
+            self._columns = new_columns
+        else:
+            self._columns = [
+                concatenate([old, new]) if old.dtype == new.dtype else
+                concatenate([old.astype(object), new.astype(object)])
+                for old, new in izip(self._columns, new_columns)]
+        self._pending = list()
+
+    @property
+    def columns(self):
+        """ List of the column arrays """
+        self._flush()
+        return self._columns or list()
+
+    def column(self, idx):
+        """ Returns the array of field ``idx`` """
+        return self.columns[idx]
+
+    def append(self, row):
+        """ Adds ``row`` to the results """
+        if self.width is None:
+            self.width = len(row)
+        elif len(row) != self.width:
+            raise UserMetricError('Result row has {0} fields, {1} '
+                                  'expected.'.format(len(row), self.width))
+        self._pending.append(row)
+
+    def extend(self, rows):
+        """ Adds ``rows`` to the results """
+        for row in rows:
+            self.append(row)
+
+    def __len__(self):
+        return (len(self._columns[0]) if self._columns else 0) + \
+            len(self._pending)
+
+    def __iter__(self):
+        for row in izip(*[column.tolist() for column in self.columns]):
+            yield list(row)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [list(row) for row in izip(*[column[idx].tolist()
+                                                for column in self.columns])]
+        return [column[idx].item() if hasattr(column[idx], 'item')
+                else column[idx] for column in self.columns]
+
+
+class MetricParams(object):
+    """
+        Snapshot of the parameters of a metric, handed to pool workers by
+        ``UserMetric._pack_params``.  Each metric class has a subclass with a
+        slot per parameter, built along with the metric class by
+        ``UserMetricType``.  Snapshots pickle as their metric class and
+        parameter values.
+    """
+
+    __slots__ = ()
+
+    _metric_class = None
+    _types = ()
+
+    def __init__(self, *values):
+        for name, value in izip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __iter__(self):
+        """ Yields ``(<param name>, <value>, <type cast method>)`` """
+        for name, param_type in izip(self.__slots__, self._types):
+            yield name, getattr(self, name), param_type
+
+    def __repr__(self):
+        return '{0}({1})'.format(self.__class__.__name__, ', '.join(
+            ['{0}={1!r}'.format(name, getattr(self, name))
+             for name in self.__slots__]))
+
+    def __reduce__(self):
+        return _restore_params, (self._metric_class,
+                                 tuple(getattr(self, name)
+                                       for name in self.__slots__))
+
+
+def _restore_params(metric_class, values):
+    return metric_class._param_snapshot(*values)
+
+
+def param_snapshot_type(metric_class):
+    """
+        Builds the ``MetricParams`` subclass of ``metric_class`` from the
+        ``_param_types`` of the class and its bases.  As in
+        ``UserMetric.append_params`` base class definitions take precedence.
+    """
+    params = dict()
+    for klass in metric_class.__mro__:
+        param_types = klass.__dict__.get('_param_types', {})
+        for arg_type in ['init', 'process']:
+            params.update(param_types.get(arg_type, {}))
+
+    names = sorted(params)
+    return type(metric_class.__name__ + 'Params', (MetricParams,), {
+        '__slots__': tuple(names),
+        '__module__': metric_class.__module__,
+        '_metric_class': metric_class,
+        '_types': tuple(params[name][0] for name in names),
+    })
+
+
+class UserMetricType(type):
+    """ Metaclass of metrics, builds their parameter snapshot type """
+
+    def __init__(cls, name, bases, attrs):
+        super(UserMetricType, cls).__init__(name, bases, attrs)
+        cls._param_snapshot = param_snapshot_type(cls)
+
+
 class UserMetric(object):
 
+    __metaclass__ = UserMetricType
+
     ALL_NAMESPACES = 'all'
     DATETIME_STR_FORMAT = "%Y%m%d%H%M%S"
 
@@ -189,27 +382,30 @@ class UserMetric(object):
 
     def _pack_params(self):
         """
-            This method packs the metric parameters into a list of tuples.  The
-            tuple contains ``(<param name>, <value>, <type cast method>)``.
-            This is mainly useful for passing args to thread pools.
+            This method packs the metric parameters into a ``MetricParams``
+            snapshot.  Iterating the snapshot yields tuples of ``(<param
+            name>, <value>, <type cast method>)``.  This is mainly useful for
+            passing args to thread pools.
         """
-        return [(i, getattr(self, i), self._param_types['init'][i][0])
-                for i in self._param_types['init']] +\
-            [(i, getattr(self, i), self._param_types['process'][i][0])
-                for i in self._param_types['process']]
+        snapshot = self._param_snapshot
+        return snapshot(*[getattr(self, name) for name in snapshot.__slots__])
 
     @staticmethod
     def _unpack_params(args):
         """
             Expects the output from ``_pack_params``.  This is meant to be used
             in conjunction with _pack_params from within thread pool targets.
+            Snapshots are returned as they are, lists of tuples are built
+            into a namedtuple.
 
                 Parameters
                 ~~~~~~~~~~
 
-                args : list
-                    List of parameter data returned by ``_pack_params``.
+                args : MetricParams|list
+                    Parameter data returned by ``_pack_params``.
         """
+        if isinstance(args, MetricParams):
+            return args
 
         names = list()
         types = list()
@@ -225,14 +421,15 @@ class UserMetric(object):
         """ Apply parameter defaults where necessary """
         params = self._param_types[arg_type]
         for att in params:
-            if att in kwargs and kwargs[att]:
+            # An explicit False is a valid setting for boolean flags
+            if att in kwargs and (kwargs[att] or kwargs[att] is False):
                 setattr(self, att, kwargs[att])
             else:
                 setattr(self, att, params[att][2])
 
     def __init__(self, **kwargs):
 
-        # Stores results of a process request
+        # Stores results of a process request, see ``ResultColumns``
         self._results = list()
 
         self.assign_attributes(kwargs, 'init')
@@ -253,6 +450,30 @@ class UserMetric(object):
     def __iter__(self):
         return (r for r in self._results)
 
+    def _get_results(self):
+        if not hasattr(self, '_result_columns'):
+            self._results = list()
+        return self._result_columns
+
+    def _set_results(self, rows):
+        """
+            Stores ``rows`` as ``ResultColumns``.  Rows of differing lengths
+            are kept as a list.
+        """
+        if not isinstance(rows, ResultColumns):
+            # Read once, ``rows`` may be a generator
+            rows = list(rows)
+            columns = ResultColumns.from_rows(rows, self._data_model_meta)
+            if columns is None:
+                logging.debug(__name__ + ' :: Result rows of {0} differ in '
+                                         'length, kept as a list.'.format(
+                                             self.__class__.__name__))
+            else:
+                rows = columns
+        self._result_columns = rows
+
+    _results = property(_get_results, _set_results)
+
     @classmethod
     def _construct_data_point(cls):
         return namedtuple(cls.__name__, cls.header())
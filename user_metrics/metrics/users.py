@@ -23,6 +23,20 @@
     each users range.  Finally, the ``UserMetricPeriod`` themselves define a
     ``get`` method which returns ``USER_METRIC_PERIOD_DATA`` objects containing
     the ranges for each user.
+
+    Period Engine
+    ~~~~~~~~~~~~~
+
+    ``get_periods`` resolves the ranges of a whole cohort at once and returns
+    them in a ``UserMetricPeriods`` object holding NumPy ``datetime64``
+    arrays.  Registration dates are looked up in chunks of
+    ``REGISTRATION_CHUNK_SIZE`` users.  The object slices like a list of
+    users so metrics partition it among their workers in place of the user
+    list, and the ``get`` methods iterate a resolved object directly rather
+    than querying again. ::
+
+        >>> periods = get_periods(['13234584', '13234503'], metric)
+        >>> mpw.map_partitions(periods, _process_help, 10, args)
 """
 
 __author__ = "ryan faulkner"
@@ -36,8 +50,10 @@ from datetime import datetime, timedelta
 from user_metrics.metrics import query_mod
 from user_metrics.metrics.user_metric import UserMetricError
 from collections import namedtuple
+from numpy import array, asarray, timedelta64
+import user_metrics.utils.multiprocessing_wrapper as mpw
 from user_metrics.utils import enum, format_mediawiki_timestamp
-from dateutil.parser import parse as date_parse
+from user_metrics.utils.timestamp import to_datetime64, from_datetime64
 from user_metrics.query.query_calls_sql import sub_tokens, escape_var
 
 # Module level query definitions
@@ -322,14 +338,8 @@ class UMPRegistration(UserMetricPeriod):
     """
     @staticmethod
     def get(users, metric):
-        # For each registration date build time interval
-        reg = get_registration_dates(users, metric.project)
-        for row in reg:
-            reg = date_parse(row[1])
-            end = reg + timedelta(hours=int(metric.t))
-            yield USER_METRIC_PERIOD_DATA(row[0],
-                                          format_mediawiki_timestamp(reg),
-                                          format_mediawiki_timestamp(end))
+        return iter(resolve_periods(users, metric,
+                                    USER_METRIC_PERIOD_TYPE.REGISTRATION))
 
 
 class UMPInput(UserMetricPeriod):
@@ -339,12 +349,8 @@ class UMPInput(UserMetricPeriod):
     """
     @staticmethod
     def get(users, metric):
-        for user in users:
-            yield USER_METRIC_PERIOD_DATA(user,
-                                          format_mediawiki_timestamp
-                                          (metric.datetime_start),
-                                          format_mediawiki_timestamp
-                                          (metric.datetime_end))
+        return iter(resolve_periods(users, metric,
+                                    USER_METRIC_PERIOD_TYPE.INPUT))
 
 
 class UMPRegInput(UserMetricPeriod):
@@ -356,24 +362,124 @@ class UMPRegInput(UserMetricPeriod):
 
     @staticmethod
     def get(users, metric):
-        reg = get_registration_dates(users, metric.project)
-        for row in reg:
-
-            user = row[0]
-            reg = date_parse(row[1])
-
-            start = format_mediawiki_timestamp(metric.datetime_start)
-            end = format_mediawiki_timestamp(metric.datetime_end)
-
-            if date_parse(start) <= reg <= date_parse(end):
-                reg_plus_t = reg + timedelta(hours=int(metric.t))
-                yield USER_METRIC_PERIOD_DATA(user,
-                                              format_mediawiki_timestamp
-                                              (reg),
-                                              format_mediawiki_timestamp
-                                              (reg_plus_t))
-            else:
-                continue
+        return iter(resolve_periods(users, metric,
+                                    USER_METRIC_PERIOD_TYPE.REGINPUT))
+
+
+# Period Engine
+# =============
+
+# Number of users per registration date lookup
+REGISTRATION_CHUNK_SIZE = 5000
+
+
+class UserMetricPeriods(object):
+    """
+        Compact container of the ranges of a set of users.  ``users`` is an
+        array of user handles while ``start`` and ``end`` are arrays of
+        ``datetime64[s]``.  Indexing returns ``USER_METRIC_PERIOD_DATA``
+        objects with MediaWiki timestamps, slicing returns a new container.
+    """
+
+    def __init__(self, users, start, end):
+        self.users = asarray(users)
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return len(self.users)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return UserMetricPeriods(self.users[key], self.start[key],
+                                     self.end[key])
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError('UserMetricPeriods index out of range')
+        return USER_METRIC_PERIOD_DATA(self.users[key].tolist(),
+                                       from_datetime64(self.start[key:
+                                                                  key + 1])[0],
+                                       from_datetime64(self.end[key:
+                                                                key + 1])[0])
+
+    def __iter__(self):
+        for user, start, end in zip(self.users.tolist(),
+                                    from_datetime64(self.start),
+                                    from_datetime64(self.end)):
+            yield USER_METRIC_PERIOD_DATA(user, start, end)
+
+
+def _registration_help(args):
+    """
+        Worker method for ``get_registration_arrays``.  Returns the earliest
+        registration timestamp found for each user.
+    """
+    users = args[0]
+    project = args[1]
+
+    reg = dict()
+    for row in get_registration_dates(users, project):
+        if row[1] and (row[0] not in reg or row[1] < reg[row[0]]):
+            reg[row[0]] = row[1]
+    return reg.items()
+
+
+def get_registration_arrays(users, project):
+    """
+        Resolves the registration dates of ``users`` in chunks.  Returns an
+        array of users and an array of their ``datetime64`` registrations.
+        Users without a registration date are omitted.
+    """
+    k = max(1, (len(users) - 1) / REGISTRATION_CHUNK_SIZE + 1)
+    reg = mpw.map_partitions(list(users), _registration_help, k, project,
+                             mode=mpw.MODE_THREAD)
+    return array([row[0] for row in reg]), to_datetime64([row[1] for row in
+                                                          reg])
+
+
+def get_periods(users, metric, group=None):
+    """
+        Resolves the ranges of all ``users`` for ``metric`` and returns a
+        ``UserMetricPeriods`` object.  The period type is taken from
+        ``metric.group`` unless ``group`` is given.
+    """
+    if group is None:
+        group = metric.group
+
+    if group == USER_METRIC_PERIOD_TYPE.INPUT:
+        user_arr = array(list(users))
+        start = to_datetime64([format_mediawiki_timestamp(
+            metric.datetime_start)]).repeat(len(user_arr))
+        end = to_datetime64([format_mediawiki_timestamp(
+            metric.datetime_end)]).repeat(len(user_arr))
+        return UserMetricPeriods(user_arr, start, end)
+
+    if not len(users):
+        return UserMetricPeriods(array([]), to_datetime64([]),
+                                 to_datetime64([]))
+
+    user_arr, reg = get_registration_arrays(users, metric.project)
+
+    if group == USER_METRIC_PERIOD_TYPE.REGINPUT:
+        bounds = to_datetime64([
+            format_mediawiki_timestamp(metric.datetime_start),
+            format_mediawiki_timestamp(metric.datetime_end)])
+        mask = (reg >= bounds[0]) & (reg <= bounds[1])
+        user_arr, reg = user_arr[mask], reg[mask]
+
+    return UserMetricPeriods(user_arr, reg,
+                             reg + timedelta64(int(metric.t), 'h'))
+
+
+def resolve_periods(users, metric, group):
+    """
+        Returns ``users`` if it already holds resolved ranges, otherwise
+        the result of ``get_periods``.
+    """
+    if isinstance(users, UserMetricPeriods):
+        return users
+    return get_periods(users, metric, group=group)
 
 
 # Define a mapping from UMP types to get methods
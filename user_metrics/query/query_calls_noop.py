@@ -21,6 +21,11 @@ def rev_count_query(uid, is_survival, namespace, project,
     return 0L
 rev_count_query.__query_name__ = 'rev_count_query'
 
+def rev_count_batch_query(users, project, args):
+    """ Get revision counts for users within their periods """
+    return []
+rev_count_batch_query.__query_name__ = 'rev_count_batch_query'
+
 def live_account_query(users, project, args):
     """ Format query for live_account metric """
     return []
@@ -31,6 +36,11 @@ def rev_query(users, project, args):
     return []
 rev_query.__query_name__ = 'rev_query'
 
+def rev_len_parent_query(users, project, args, stream=False, batch_size=0):
+    """ Get revision length, parent id and parent length for users """
+    return []
+rev_len_parent_query.__query_name__ = 'rev_len_parent_query'
+
 def rev_len_query(rev_id, project):
     """ Get parent revision length - returns long """
     return 0L
@@ -49,6 +59,12 @@ def revert_rate_future_revs_query(rev_id, page_id, n, project):
     """ Compute revision future pegged to a given rev """
     return []
 
+def page_rev_window_query(page_id, rev_min, rev_max, look_back, look_ahead,
+                          project, namespace):
+    """ Produce the revision window of a page spanning a set of revisions """
+    return []
+page_rev_window_query.__query_name__ = 'page_rev_window_query'
+
 def revert_rate_user_revs_query(user, project, args):
     """ Get revision history for a user """
     return []
@@ -59,6 +75,18 @@ def time_to_threshold_revs_query(user_id, project, args):
     return []
 time_to_threshold_revs_query.__query_name__ = 'time_to_threshold_revs_query'
 
+def time_to_threshold_head_query(users, project, args):
+    """ Obtain the first revision timestamps of each user """
+    return []
+time_to_threshold_head_query.__query_name__ = \
+    'time_to_threshold_head_query'
+
+def time_to_threshold_last_query(users, project, args):
+    """ Obtain the latest revision timestamp of each user """
+    return []
+time_to_threshold_last_query.__query_name__ = \
+    'time_to_threshold_last_query'
+
 def blocks_user_map_query(users):
     """ Obtain map to generate uname to uid"""
     return {}
@@ -78,6 +106,17 @@ def namespace_edits_rev_query(users, project, args):
     return []
 namespace_edits_rev_query.__query_name__ = 'namespace_edits_rev_query'
 
+def namespace_edits_period_query(users, project, args):
+    """ Obtain revisions by namespace for users within their periods """
+    return []
+namespace_edits_period_query.__query_name__ = \
+    'namespace_edits_period_query'
+
+def rev_interval_query(users, project, args, stream=False, batch_size=0):
+    """ Obtain the revisions of users over a time series range """
+    return []
+rev_interval_query.__query_name__ = 'rev_interval_query'
+
 def user_registration_date(users, project, args):
     return []
 user_registration_date.__query_name__ = 'user_registration_date'
@@ -87,15 +126,22 @@ query_store = {
     live_account_query.__query_name__: None,
     rev_query.__query_name__: None,
     rev_len_query.__query_name__: None,
+    rev_len_parent_query.__query_name__: None,
+    rev_count_batch_query.__query_name__: None,
     rev_user_query.__query_name__: None,
     revert_rate_past_revs_query.__name__: None,
     revert_rate_future_revs_query.__name__: None,
+    page_rev_window_query.__query_name__: None,
     revert_rate_user_revs_query.__query_name__: None,
     time_to_threshold_revs_query.__query_name__: None,
+    time_to_threshold_head_query.__query_name__: None,
+    time_to_threshold_last_query.__query_name__: None,
     blocks_user_map_query.__name__: None,
     blocks_user_query.__query_name__: None,
     edit_count_user_query.__query_name__: None,
     namespace_edits_rev_query.__query_name__: None,
+    namespace_edits_period_query.__query_name__: None,
+    rev_interval_query.__query_name__: None,
     user_registration_date.__query_name__: None,
     }
 
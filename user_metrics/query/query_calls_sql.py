@@ -11,8 +11,11 @@ __license__ = "GPL (version 2 or later)"
 import user_metrics.config.settings as conf
 
 from user_metrics.utils import format_mediawiki_timestamp
-from user_metrics.etl.data_loader import DataLoader, Connector, ConnectorError
+from user_metrics.etl.data_loader import DataLoader, ConnectorError, \
+    DataLoaderError, BulkLoader, get_connection
 from MySQLdb import escape_string, ProgrammingError, OperationalError
+from MySQLdb.cursors import SSCursor
+from numpy import rec
 from copy import deepcopy
 from datetime import datetime
 from re import sub
@@ -26,6 +29,9 @@ WHERE_TOKEN = '<where>'
 COMP1_TOKEN = '<comparator_1>'
 USERS_TOKEN = '<users>'
 
+# Rows read per round trip from server side cursors
+STREAM_FETCH_SIZE = getattr(conf, '__query_stream_batch_size__', 10000)
+
 
 class UMQueryCallError(Exception):
     """ Basic exception class for UserMetric types """
@@ -99,8 +105,14 @@ def format_namespace(namespace):
 
 def query_method_deco(f):
     """ Decorator that handles setup and tear down of user
-        query dependent on user cohort & project """
-    def wrapper(users, project, args):
+        query dependent on user cohort & project.
+
+        Results are returned as a list.  Large results may instead be
+        streamed from a server side cursor by passing ``stream=True``, the
+        call then returns an iterator of rows, or ``batch_size=n``, the
+        call then returns an iterator of NumPy record arrays of up to n
+        rows.  See ``ResultStream``. """
+    def wrapper(users, project, args, stream=False, batch_size=0):
         # ensure the handles are iterable
         if not hasattr(users, '__iter__'):
             users = [users]
@@ -126,7 +138,7 @@ def query_method_deco(f):
         query, params = f(users, project, args)
         query = sub_tokens(query, db=project, users=user_str)
         try:
-            conn = Connector(instance=conf.PROJECT_DB_MAP[project])
+            conn = get_connection(conf.PROJECT_DB_MAP[project])
         except KeyError:
             logging.error(__name__ + ' :: Project does not exist.')
             return []
@@ -135,26 +147,111 @@ def query_method_deco(f):
             raise UMQueryCallError(__name__ + ' :: Could not '
                                               'establish a connection.')
 
+        streamed = stream or batch_size
         try:
+            cursor = conn._db_.cursor(SSCursor) if streamed else conn._cur_
             if params:
-                conn._cur_.execute(query, params)
+                cursor.execute(query, params)
+            else:
+                cursor.execute(query)
+
+            if streamed:
+                # the stream releases the connection from here on
+                results = ResultStream(conn, cursor, batch_size)
+                conn = None
             else:
-                conn._cur_.execute(query)
+                results = [row for row in cursor]
         except (OperationalError, ProgrammingError) as e:
             logging.error(__name__ +
                           ' :: Query failed: {0}'.format(query))
             raise UMQueryCallError(__name__ + ' :: ' + str(e))
-        results = [row for row in conn._cur_]
-        del conn
+        finally:
+            if conn is not None:
+                if streamed:
+                    conn.discard()
+                else:
+                    conn.release()
         return results
     return wrapper
 
 
+def _fetch_results(cursor, batch_size):
+    """ Generator over the rows, or record arrays of ``batch_size`` rows,
+        read from ``cursor`` """
+    names = [column[0] for column in cursor.description or []]
+    if len(set(names)) != len(names):
+        names = None
+    fetch_size = batch_size or STREAM_FETCH_SIZE
+
+    while 1:
+        try:
+            rows = cursor.fetchmany(fetch_size)
+        except (OperationalError, ProgrammingError) as e:
+            raise UMQueryCallError(__name__ + ' :: ' + str(e))
+        if not rows:
+            break
+        if batch_size:
+            yield rec.fromrecords(list(rows), names=names or None)
+        else:
+            for row in rows:
+                yield row
+
+
+class ResultStream(object):
+    """
+        Iterates over the rows of a query executed on the server side
+        cursor ``cursor`` of the pooled connection ``conn``.  Given a
+        ``batch_size`` NumPy record arrays of up to that many rows are
+        returned instead, their fields named after the result columns.
+
+        The connection is returned to its pool once every row is read.  A
+        stream closed or dropped before then, whether or not it was
+        iterated, discards its connection rather than read the remaining
+        rows.
+    """
+
+    def __init__(self, conn, cursor, batch_size=0):
+        self._conn = conn
+        self._cursor = cursor
+        self._results = _fetch_results(cursor, batch_size)
+
+    def __iter__(self):
+        return self
+
+    def __del__(self):
+        self.close()
+
+    def next(self):
+        if self._conn is None:
+            raise StopIteration
+        try:
+            return self._results.next()
+        except StopIteration:
+            self._finish(True)
+            raise
+        except Exception:
+            self._finish(False)
+            raise
+
+    def close(self):
+        """ Stop reading and discard the connection if rows remain """
+        self._finish(False)
+
+    def _finish(self, complete):
+        conn = self._conn
+        if conn is None:
+            return
+        self._conn = None
+        if complete:
+            self._cursor.close()
+            conn.release()
+        else:
+            conn.discard()
+
+
 def rev_count_query(uid, is_survival, namespace, project,
                     start_ts, threshold_ts):
     """ Get count of revisions associated with a UID for Threshold metrics """
-    conn = Connector(instance=conf.PROJECT_DB_MAP[project])
-
     # The key difference between survival and threshold is that threshold
     # measures a level of activity before a point whereas survival
     # (generally) measures any activity after a point
@@ -170,16 +267,72 @@ def rev_count_query(uid, is_survival, namespace, project,
 
     query = query_store[rev_count_query.__name__] + timestamp_cond
     query = sub_tokens(query, db=escape_var(project), where=ns_cond)
-    conn._cur_.execute(query, {'uid': int(uid), 'ts': str(threshold_ts)})
+    conn = get_connection(conf.PROJECT_DB_MAP[project])
     try:
-        count = int(conn._cur_.fetchone()[0])
-    except (IndexError, ValueError):
-        raise UMQueryCallError()
-    del conn
+        conn._cur_.execute(query, {'uid': int(uid), 'ts': str(threshold_ts)})
+        try:
+            count = int(conn._cur_.fetchone()[0])
+        except (IndexError, ValueError):
+            raise UMQueryCallError()
+    finally:
+        conn.release()
     return count
 rev_count_query.__query_name__ = 'rev_count_query'
 
 
+def format_period_table(periods):
+    """
+        Formats a derived table of user windows from ``(user, start, end)``
+        tuples, e.g. ``USER_METRIC_PERIOD_DATA`` objects.  The table exposes
+        the columns ``w_user``, ``w_start`` and ``w_end``.  User handles must
+        be integer ids.
+
+        ** THIS METHOD ONLY EMITS SQL SAFE STRINGS **
+    """
+    rows = list()
+    for user, start, end in periods:
+        rows.append('SELECT %(user)s AS w_user, "%(start)s" AS w_start, '
+                    '"%(end)s" AS w_end' % {
+                        'user': int(user),
+                        'start': escape_var(start),
+                        'end': escape_var(end)
+                    })
+    if not rows:
+        raise ValueError('No user periods to format.')
+    return '(' + ' UNION ALL '.join(rows) + ')'
+
+
+@query_method_deco
+def rev_count_batch_query(users, project, args):
+    """
+        Get revision counts for users within their own periods in one
+        query.  ``args.periods`` holds the ``(user, start, end)`` windows
+        and ``args.survival_`` selects the survival condition (revisions
+        after the window end) over the threshold condition (revisions
+        within the window).  Users without revisions are not returned.
+    """
+    try:
+        ns_cond = format_namespace(args.namespace)
+        window_table = format_period_table(args.periods)
+    except (AttributeError, TypeError, ValueError) as e:
+        raise UMQueryCallError(__name__ + ' :: ' + str(e))
+
+    # Mirrors the timestamp conditions of rev_count_query
+    if args.survival_:
+        where_clause = 'r.rev_timestamp > w.w_end'
+    else:
+        where_clause = 'r.rev_timestamp > w.w_start AND ' \
+                       'r.rev_timestamp <= w.w_end'
+    if ns_cond:
+        where_clause = ns_cond + ' AND ' + where_clause
+
+    query = query_store[rev_count_batch_query.__query_name__]
+    query = sub_tokens(query, db=escape_var(project), from_repl=window_table,
+                       where=where_clause)
+    return query, None
+rev_count_batch_query.__query_name__ = 'rev_count_batch_query'
+
+
 @query_method_deco
 def live_account_query(users, project, args):
     """ Format query for live_account metric """
@@ -246,33 +399,93 @@ def rev_query(users, project, args):
 rev_query.__query_name__ = 'rev_query'
 
 
+def format_period_condition(periods, user_field='rev_user',
+                            ts_field='rev_timestamp'):
+    """
+        Formats a condition matching each user's revisions within their own
+        period.  Users sharing the same period are collapsed into a single
+        ``IN`` list.  Returns the condition string.
+
+        - Parameters:
+            - **periods**: List of ``(user, start, end)`` tuples, e.g.
+                ``USER_METRIC_PERIOD_DATA`` objects.
+
+        ** THIS METHOD ONLY EMITS SQL SAFE STRINGS **
+    """
+    users_by_period = dict()
+    for user, start, end in periods:
+        users_by_period.setdefault((escape_var(start), escape_var(end)),
+                                   list()).append(escape_var(user))
+
+    conds = list()
+    for (start, end), users in users_by_period.iteritems():
+        conds.append('(%(user_field)s IN (%(users)s) AND '
+                     '%(ts_field)s >= "%(start)s" AND '
+                     '%(ts_field)s < "%(end)s")' % {
+                         'user_field': user_field,
+                         'ts_field': ts_field,
+                         'users': DataLoader().format_comma_separated_list(
+                             users, include_quotes=False),
+                         'start': start,
+                         'end': end
+                     })
+    return '(' + ' OR '.join(conds) + ')'
+
+
+@query_method_deco
+def rev_len_parent_query(users, project, args):
+    """
+        Get revision length, parent id and parent length for users within
+        their periods.  ``args.periods`` holds the ``(user, start, end)``
+        windows.  Parent length is NULL where the parent is not found.
+    """
+    try:
+        ns_cond = format_namespace(args.namespace)
+        where_clause = format_period_condition(args.periods,
+                                               user_field='r.rev_user',
+                                               ts_field='r.rev_timestamp')
+    except (AttributeError, ValueError) as e:
+        raise UMQueryCallError(__name__ + ' :: ' + str(e))
+
+    if ns_cond:
+        where_clause = ns_cond + ' AND ' + where_clause
+    query = query_store[rev_len_parent_query.__query_name__]
+    query = sub_tokens(query, db=escape_var(project), where=where_clause)
+    return query, None
+rev_len_parent_query.__query_name__ = 'rev_len_parent_query'
+
+
 def rev_len_query(rev_id, project):
     """ Get parent revision length - returns long """
-    conn = Connector(instance=conf.PROJECT_DB_MAP[project])
     query = query_store[rev_len_query.__name__]
     query = sub_tokens(query, db=escape_var(project))
-    conn._cur_.execute(query, {'parent_rev_id': int(rev_id)})
+    conn = get_connection(conf.PROJECT_DB_MAP[project])
     try:
-        rev_len = conn._cur_.fetchone()[0]
-    except (IndexError, KeyError, ProgrammingError) as e:
-        raise UMQueryCallError(__name__ + ' :: ' + str(e))
-    del conn
+        conn._cur_.execute(query, {'parent_rev_id': int(rev_id)})
+        try:
+            rev_len = conn._cur_.fetchone()[0]
+        except (IndexError, KeyError, ProgrammingError) as e:
+            raise UMQueryCallError(__name__ + ' :: ' + str(e))
+    finally:
+        conn.release()
     return rev_len
 rev_len_query.__query_name__ = 'rev_len_query'
 
 
 def rev_user_query(project, start, end):
     """ Produce all users that made a revision within period """
-    conn = Connector(instance=conf.PROJECT_DB_MAP[project])
     query = query_store[rev_user_query.__name__]
     query = sub_tokens(query, db=escape_var(project))
     params = {
         'start': str(start),
         'end': str(end)
     }
-    conn._cur_.execute(query, params)
-    users = [str(row[0]) for row in conn._cur_]
-    del conn
+    conn = get_connection(conf.PROJECT_DB_MAP[project])
+    try:
+        conn._cur_.execute(query, params)
+        users = [str(row[0]) for row in conn._cur_]
+    finally:
+        conn.release()
     return users
 rev_user_query.__query_name__ = 'rev_user_query'
 
@@ -280,14 +493,14 @@ rev_user_query.__query_name__ = 'rev_user_query'
 def page_rev_hist_query(rev_id, page_id, n, project, namespace,
                         look_ahead=False):
     """ Compute revision history pegged to a given rev """
-    conn = Connector(instance=conf.PROJECT_DB_MAP[project])
-
     # Format namespace expression and comparator
     ns_cond = format_namespace(namespace)
     comparator = '>' if look_ahead else '<'
+    order = 'ASC' if look_ahead else 'DESC'
     query = query_store[page_rev_hist_query.__name__]
     query = sub_tokens(query, db=escape_var(project),
                        comp_1=comparator, where=ns_cond)
+    query = sub('<order>', order, query)
     try:
         params = {
             'rev_id':  long(rev_id),
@@ -297,13 +510,53 @@ def page_rev_hist_query(rev_id, page_id, n, project, namespace,
     except ValueError as e:
         raise UMQueryCallError(__name__ + ' :: ' + str(e))
 
-    conn._cur_.execute(query, params)
-    for row in conn._cur_:
-        yield row
-    del conn
+    conn = get_connection(conf.PROJECT_DB_MAP[project])
+    try:
+        conn._cur_.execute(query, params)
+        for row in conn._cur_:
+            yield row
+    finally:
+        conn.release()
 page_rev_hist_query.__query_name__ = 'page_rev_hist_query'
 
 
+def page_rev_window_query(page_id, rev_min, rev_max, look_back, look_ahead,
+                          project, namespace):
+    """
+        Produce the revision window of a page spanning a set of revisions.
+        The window consists of the ``look_back`` revisions before
+        ``rev_min``, all revisions from ``rev_min`` to ``rev_max`` and the
+        ``look_ahead`` revisions after ``rev_max``.  Rows are returned in
+        ascending ``rev_id`` order.
+    """
+    ns_cond = format_namespace(namespace)
+    if ns_cond:
+        ns_cond = ' AND ' + ns_cond
+    query = query_store[page_rev_window_query.__query_name__]
+    query = sub_tokens(query, db=escape_var(project), where=ns_cond)
+    try:
+        params = {
+            'page_id': long(page_id),
+            'rev_min': long(rev_min),
+            'rev_max': long(rev_max),
+            'look_back': int(look_back),
+            'look_ahead': int(look_ahead),
+        }
+    except ValueError as e:
+        raise UMQueryCallError(__name__ + ' :: ' + str(e))
+
+    conn = get_connection(conf.PROJECT_DB_MAP[project])
+    try:
+        conn._cur_.execute(query, params)
+        window = sorted([row for row in conn._cur_], key=lambda row: row[0])
+    except (OperationalError, ProgrammingError) as e:
+        raise UMQueryCallError(__name__ + ' :: ' + str(e))
+    finally:
+        conn.release()
+    return window
+page_rev_window_query.__query_name__ = 'page_rev_window_query'
+
+
 @query_method_deco
 def revert_rate_user_revs_query(user, project, args):
     """ Get revision history for a user """
@@ -329,22 +582,49 @@ def time_to_threshold_revs_query(user_id, project, args):
 time_to_threshold_revs_query.__query_name__ = 'time_to_threshold_revs_query'
 
 
+@query_method_deco
+def time_to_threshold_head_query(users, project, args):
+    """
+        Obtain the first ``args.limit`` revision timestamps of each user in
+        ascending order.  Each user is read with its own bounded subquery so
+        the cost does not grow with the length of a user's history.
+    """
+    try:
+        params = {'limit': int(args.limit)}
+        template = query_store[time_to_threshold_head_query.__query_name__]
+        query = ' UNION ALL '.join([sub_tokens(template, users=str(int(user)))
+                                    for user in users])
+    except (AttributeError, ValueError) as e:
+        raise UMQueryCallError(__name__ + ' :: ' + str(e))
+    return query, params
+time_to_threshold_head_query.__query_name__ = 'time_to_threshold_head_query'
+
+
+@query_method_deco
+def time_to_threshold_last_query(users, project, args):
+    """ Obtain the latest revision timestamp of each user """
+    return query_store[time_to_threshold_last_query.__query_name__], None
+time_to_threshold_last_query.__query_name__ = 'time_to_threshold_last_query'
+
+
 def blocks_user_map_query(users, project):
     """ Obtain map to generate uname to uid"""
     # Get usernames for user ids to detect in block events
-    conn = Connector(instance=conf.PROJECT_DB_MAP[project])
     user_str = DataLoader().format_comma_separated_list(
         escape_var(users))
 
     query = query_store[blocks_user_map_query.__name__]
     query = sub_tokens(query, db=escape_var(project), users=user_str)
-    conn._cur_.execute(query)
 
     # keys username on userid
     user_map = dict()
-    for r in conn._cur_:
-        user_map[r[1]] = r[0]
-    del conn
+    conn = get_connection(conf.PROJECT_DB_MAP[project])
+    try:
+        conn._cur_.execute(query)
+        for r in conn._cur_:
+            user_map[r[1]] = r[0]
+    finally:
+        conn.release()
     return user_map
 
 
@@ -384,6 +664,49 @@ def namespace_edits_rev_query(users, project, args):
 namespace_edits_rev_query.__query_name__ = 'namespace_edits_rev_query'
 
 
+@query_method_deco
+def namespace_edits_period_query(users, project, args):
+    """
+        Obtain revisions by namespace for users within their own periods.
+        ``args.periods`` holds the ``(user, start, end)`` windows.
+    """
+    try:
+        where_clause = format_period_condition(args.periods,
+                                               user_field='r.rev_user',
+                                               ts_field='r.rev_timestamp')
+    except (AttributeError, ValueError) as e:
+        raise UMQueryCallError(__name__ + ' :: ' + str(e))
+
+    query = query_store[namespace_edits_period_query.__query_name__]
+    query = sub_tokens(query, where=where_clause)
+    return query, None
+namespace_edits_period_query.__query_name__ = 'namespace_edits_period_query'
+
+
+@query_method_deco
+def rev_interval_query(users, project, args):
+    """
+        Get the timestamp and namespace of revisions by users from
+        ``args.date_start`` up to and including ``args.date_end``.  When
+        ``args.parent_len`` is set the revision length, parent id and parent
+        length are also returned, parent length being NULL where the parent
+        is not found.
+    """
+    query_name = rev_interval_query.__query_name__
+    try:
+        params = {'start': str(args.date_start), 'end': str(args.date_end)}
+        ns_cond = format_namespace(args.namespace)
+        if args.parent_len:
+            query_name += '_len'
+    except AttributeError as e:
+        raise UMQueryCallError(__name__ + ' :: ' + str(e))
+
+    query = query_store[query_name]
+    query = sub_tokens(query, where=ns_cond if ns_cond else '1')
+    return query, params
+rev_interval_query.__query_name__ = 'rev_interval_query'
+
+
 @query_method_deco
 def user_registration_date_logging(users, project, args):
     """ Returns user registration date from logging table """
@@ -404,18 +727,19 @@ def delete_usertags(ut_tag):
         Delete records from usertags for a give tag ID.  This effectively
         empties a cohort.
     """
-    conn = Connector(instance=conf.PROJECT_DB_MAP[
-        conf.__cohort_data_instance__])
     del_query = query_store[delete_usertags.__query_name__]
     del_query = sub_tokens(del_query,
                            db=conf.__cohort_meta_instance__,
                            table=conf.__cohort_db__)
+    conn = get_connection(conf.PROJECT_DB_MAP[
+        conf.__cohort_data_instance__])
     try:
         conn._cur_.execute(del_query, {'ut_tag': int(ut_tag)})
+        conn._db_.commit()
     except (ValueError, ProgrammingError, OperationalError) as e:
         raise UMQueryCallError(__name__ + ' :: ' + str(e))
-    conn._db_.commit()
-    del conn
+    finally:
+        conn.release()
 delete_usertags.__query_name__ = 'delete_usertags'
 
 
@@ -424,18 +748,19 @@ def delete_usertags_meta(ut_tag):
         Delete record from usertags_meta for a give tag ID.  This effectively
         deletes a cohort.
     """
-    conn = Connector(instance=conf.PROJECT_DB_MAP[
-        conf.__cohort_data_instance__])
     del_query = query_store[delete_usertags_meta.__query_name__]
     del_query = sub_tokens(del_query,
                            db=conf.__cohort_meta_instance__,
                            table=conf.__cohort_meta_db__)
+    conn = get_connection(conf.PROJECT_DB_MAP[
+        conf.__cohort_data_instance__])
     try:
         conn._cur_.execute(del_query, {'ut_tag': int(ut_tag)})
+        conn._db_.commit()
     except (ValueError, ProgrammingError, OperationalError) as e:
         raise UMQueryCallError(__name__ + ' :: ' + str(e))
-    conn._db_.commit()
-    del conn
+    finally:
+        conn.release()
 delete_usertags_meta.__query_name__ = 'delete_usertags_meta'
 
 
@@ -452,8 +777,6 @@ def get_api_user(user, by_id=True):
             by_id : Bool(=True)
                 Flag to determine whether filtering by id or name.
     """
-    conn = Connector(instance=conf.__cohort_data_instance__)
-
     if by_id:
         query = get_api_user.__query_name__ + '_by_id'
         try:
@@ -466,13 +789,14 @@ def get_api_user(user, by_id=True):
     query = query_store[query]
     query = sub_tokens(query, db=conf.__cohort_meta_instance__)
 
+    conn = get_connection(conf.__cohort_data_instance__)
     try:
         conn._cur_.execute(query, params)
+        api_user_tuple = conn._cur_.fetchone()
     except (ValueError, ProgrammingError, OperationalError) as e:
         raise UMQueryCallError(__name__ + ' :: ' + str(e))
-
-    api_user_tuple = conn._cur_.fetchone()
-    del conn
+    finally:
+        conn.release()
     return api_user_tuple
 get_api_user.__query_name__ = 'get_api_user'
 
@@ -490,7 +814,6 @@ def insert_api_user(user, password):
             password : string
                 Password, this should be a salted hash string.
     """
-    conn = Connector(instance=conf.__cohort_data_instance__)
     query = insert_api_user.__query_name__
     query = query_store[query]
     params = {
@@ -499,13 +822,14 @@ def insert_api_user(user, password):
     }
     query = sub_tokens(query, db=conf.__cohort_meta_instance__)
 
+    conn = get_connection(conf.__cohort_data_instance__)
     try:
         conn._cur_.execute(query, params)
+        conn._db_.commit()
     except (ProgrammingError, OperationalError) as e:
         raise UMQueryCallError(__name__ + ' :: ' + str(e))
-
-    conn._db_.commit()
-    del conn
+    finally:
+        conn.release()
 insert_api_user.__query_name__ = 'insert_api_user'
 
 
@@ -527,7 +851,6 @@ def add_cohort_data(cohort, users, project,
             project : string
                 Project of cohort.
     """
-    conn = Connector(instance=conf.__cohort_data_instance__)
     now = format_mediawiki_timestamp(datetime.now())
 
     # TODO: ALLOW THE COHORT DEF TO BE REFRESHED IF IT ALREADY EXISTS
@@ -556,12 +879,15 @@ def add_cohort_data(cohort, users, project,
 
         utm_query = sub_tokens(utm_query, db=conf.__cohort_meta_instance__,
                                table=conf.__cohort_meta_db__)
+        conn = get_connection(conf.__cohort_data_instance__)
         try:
             conn._cur_.execute(utm_query, params)
             conn._db_.commit()
         except (ProgrammingError, OperationalError) as e:
             conn._db_.rollback()
             raise UMQueryCallError(__name__ + ' :: ' + str(e))
+        finally:
+            conn.release()
 
     # add data to ``user_tags``
     if users:
@@ -579,17 +905,17 @@ def add_cohort_data(cohort, users, project,
         except ValueError as e:
             raise UMQueryCallError(__name__ + ' :: ' + str(e))
 
-        ut_query = query_store[add_cohort_data.__query_name__] + '(' + \
-                   ' %s,' * len(value_list_ut)[:-1] + ')'
-        ut_query = sub_tokens(ut_query, db=conf.__cohort_meta_instance__,
+        ut_table = sub_tokens(query_store[add_cohort_data.__query_name__],
+                              db=conf.__cohort_meta_instance__,
                               table=conf.__cohort_db__)
+        conn = get_connection(conf.__cohort_data_instance__)
         try:
-            conn._cur_.execute(ut_query, value_list_ut)
-            conn._db_.commit()
-        except (ProgrammingError, OperationalError) as e:
-            conn._db_.rollback()
+            BulkLoader(conn, ut_table,
+                       method=BulkLoader.INSERT).load(value_list_ut)
+        except DataLoaderError as e:
             raise UMQueryCallError(__name__ + ' :: ' + str(e))
-    del conn
+        finally:
+            conn.release()
 add_cohort_data.__query_name__ = 'add_cohort'
 
 
@@ -603,17 +929,18 @@ def get_cohort_data(cohort_name):
             cohort_name : string
                 Name of cohort.
     """
-    conn = Connector(instance=conf.__cohort_data_instance__)
     ut_query = query_store[get_cohort_data.__query_name__]
     ut_query = sub_tokens(ut_query, db=conf.__cohort_meta_instance__,
                            table=conf.__cohort_meta_db__)
 
+    conn = get_connection(conf.__cohort_data_instance__)
     try:
         conn._cur_.execute(ut_query, {'utm_name': str(cohort_name)})
+        data = conn._cur_.fetchone()
     except (ValueError, ProgrammingError, OperationalError) as e:
         raise UMQueryCallError(__name__ + ' :: ' + str(e))
-    data = conn._cur_.fetchone()
-    del conn
+    finally:
+        conn.release()
     return data
 get_cohort_data.__query_name__ = 'get_cohort_data'
 
@@ -632,6 +959,32 @@ def get_cohort_project_by_meta(cohort_name):
         return None
 
 
+def get_cohort_touched(tag_id):
+    """
+        Returns the datetime at which the cohort was last modified or None
+        if it is not recorded.
+
+        Parameters
+        ~~~~~~~~~~
+
+            tag_id : int
+                Tag ID of the cohort.
+    """
+    utm_query = query_store[get_cohort_touched.__query_name__]
+    utm_query = sub_tokens(utm_query, db=conf.__cohort_meta_instance__,
+                           table=conf.__cohort_meta_db__)
+    conn = get_connection(conf.__cohort_data_instance__)
+    try:
+        conn._cur_.execute(utm_query, {'tag_id': int(tag_id)})
+        row = conn._cur_.fetchone()
+    except (ValueError, ProgrammingError, OperationalError) as e:
+        raise UMQueryCallError(__name__ + ' :: ' + str(e))
+    finally:
+        conn.release()
+    return row[0] if row else None
+get_cohort_touched.__query_name__ = 'get_cohort_touched'
+
+
 def get_cohort_users(tag_id):
     """
         Returns user id list for cohort.
@@ -642,18 +995,21 @@ def get_cohort_users(tag_id):
             cohort_name : string
                 Name of cohort.
     """
-    conn = Connector(instance=conf.__cohort_data_instance__)
     ut_query = query_store[get_cohort_users.__query_name__]
     ut_query = sub_tokens(ut_query, db=conf.__cohort_meta_instance__,
                           table=conf.__cohort_db__)
+    conn = get_connection(conf.__cohort_data_instance__)
     try:
-        conn._cur_.execute(ut_query, {'tag_id': int(tag_id)})
-    except (ValueError, ProgrammingError, OperationalError):
-        raise UMQueryCallError(__name__ + ' :: Failed to retrieve users.')
-
-    for row in conn._cur_:
-        yield unicode(row[0])
-    del conn
+        try:
+            conn._cur_.execute(ut_query, {'tag_id': int(tag_id)})
+        except (ValueError, ProgrammingError, OperationalError):
+            raise UMQueryCallError(__name__ + ' :: Failed to retrieve '
+                                              'users.')
+
+        for row in conn._cur_:
+            yield unicode(row[0])
+    finally:
+        conn.release()
 get_cohort_users.__query_name__ = 'get_cohort_users'
 
 
@@ -670,18 +1026,18 @@ def get_mw_user_id(username, project):
         project : string
             MediaWiki project.
     """
-    conn = Connector(instance=conf.PROJECT_DB_MAP[project])
     query = query_store[get_mw_user_id.__query_name__]
     query = sub_tokens(query, db=escape_var(project))
 
+    conn = get_connection(conf.PROJECT_DB_MAP[project])
     try:
         conn._cur_.execute(query, {'username': str(username)})
         uid = conn._cur_.fetchone()[0]
     except (IndexError, ValueError, ProgrammingError,
             OperationalError, TypeError) as e:
         raise UMQueryCallError(__name__ + ' :: ' + str(e))
-
-    del conn
+    finally:
+        conn.release()
     return uid
 get_mw_user_id.__query_name__ = 'get_mw_user_id'
 
@@ -699,6 +1055,19 @@ query_store = {
                 ON r.rev_page = p.page_id
         WHERE <where> AND rev_user = %(uid)s
     """,
+    rev_count_batch_query.__query_name__:
+    """
+        SELECT
+            r.rev_user,
+            count(*) as revs
+        FROM <from> AS w
+            JOIN <database>.revision AS r
+                ON r.rev_user = w.w_user
+            JOIN <database>.page AS p
+                ON r.rev_page = p.page_id
+        WHERE <where>
+        GROUP BY 1
+    """,
     live_account_query.__query_name__:
     """
         SELECT
@@ -720,6 +1089,20 @@ query_store = {
             on page.page_id = revision.rev_page
         where <where>
     """,
+    rev_len_parent_query.__query_name__:
+    """
+        SELECT
+            r.rev_user,
+            r.rev_len,
+            r.rev_parent_id,
+            p.rev_len
+        FROM <database>.revision AS r
+            JOIN <database>.page
+                ON page.page_id = r.rev_page
+            LEFT JOIN <database>.revision AS p
+                ON p.rev_id = r.rev_parent_id
+        WHERE <where>
+    """,
     rev_len_query.__query_name__:
     """
         SELECT rev_len
@@ -741,13 +1124,38 @@ query_store = {
         WHERE rev_page = %(page_id)s
             AND rev_id <comparator_1> %(rev_id)s
             AND <where>
-        ORDER BY rev_id ASC
+        ORDER BY rev_id <order>
         LIMIT %(n)s
     """,
+    page_rev_window_query.__query_name__:
+    """
+        (SELECT rev_id, rev_user_text, rev_sha1
+        FROM <database>.revision JOIN <database>.page
+            ON rev_page = page_id
+        WHERE rev_page = %(page_id)s
+            AND rev_id < %(rev_min)s<where>
+        ORDER BY rev_id DESC
+        LIMIT %(look_back)s)
+        UNION ALL
+        (SELECT rev_id, rev_user_text, rev_sha1
+        FROM <database>.revision JOIN <database>.page
+            ON rev_page = page_id
+        WHERE rev_page = %(page_id)s
+            AND rev_id >= %(rev_min)s
+            AND rev_id <= %(rev_max)s<where>)
+        UNION ALL
+        (SELECT rev_id, rev_user_text, rev_sha1
+        FROM <database>.revision JOIN <database>.page
+            ON rev_page = page_id
+        WHERE rev_page = %(page_id)s
+            AND rev_id > %(rev_max)s<where>
+        ORDER BY rev_id ASC
+        LIMIT %(look_ahead)s)
+    """,
     revert_rate_user_revs_query.__query_name__:
     """
        SELECT
-           rev_user,
+           rev_id,
            rev_page,
            rev_sha1,
            rev_user_text
@@ -763,6 +1171,21 @@ query_store = {
         WHERE rev_user = %(user_handle)s
         ORDER BY 1 ASC
     """,
+    time_to_threshold_head_query.__query_name__:
+    """
+        (SELECT rev_user, rev_timestamp
+        FROM <database>.revision
+        WHERE rev_user = <users>
+        ORDER BY rev_timestamp ASC
+        LIMIT %(limit)s)
+    """,
+    time_to_threshold_last_query.__query_name__:
+    """
+        SELECT rev_user, MAX(rev_timestamp)
+        FROM <database>.revision
+        WHERE rev_user IN (<users>)
+        GROUP BY 1
+    """,
     blocks_user_map_query.__name__:
     """
         SELECT
@@ -812,6 +1235,51 @@ query_store = {
             AND rev_timestamp < %(end)s
         GROUP BY 1,2
     """,
+    namespace_edits_period_query.__query_name__:
+    """
+        SELECT
+            r.rev_user,
+            p.page_namespace,
+            count(*) AS revs
+        FROM <database>.revision AS r
+            JOIN <database>.page AS p
+            ON r.rev_page = p.page_id
+        WHERE <where>
+        GROUP BY 1,2
+    """,
+    rev_interval_query.__query_name__:
+    """
+        SELECT
+            r.rev_user,
+            r.rev_timestamp,
+            p.page_namespace
+        FROM <database>.revision AS r
+            JOIN <database>.page AS p
+                ON p.page_id = r.rev_page
+        WHERE <where>
+            AND r.rev_user IN (<users>)
+            AND r.rev_timestamp >= %(start)s
+            AND r.rev_timestamp <= %(end)s
+    """,
+    rev_interval_query.__query_name__ + '_len':
+    """
+        SELECT
+            r.rev_user,
+            r.rev_timestamp,
+            p.page_namespace,
+            r.rev_len,
+            r.rev_parent_id,
+            pr.rev_len
+        FROM <database>.revision AS r
+            JOIN <database>.page AS p
+                ON p.page_id = r.rev_page
+            LEFT JOIN <database>.revision AS pr
+                ON pr.rev_id = r.rev_parent_id
+        WHERE <where>
+            AND r.rev_user IN (<users>)
+            AND r.rev_timestamp >= %(start)s
+            AND r.rev_timestamp <= %(end)s
+    """,
     user_registration_date_logging.__query_name__:
     """
         SELECT
@@ -860,11 +1328,7 @@ query_store = {
             (user_name, user_pass)
         VALUES (%(user)s, %(pass)s)
     """,
-    add_cohort_data.__query_name__:
-    """
-        INSERT INTO <database>.<table>
-            VALUES
-    """,
+    add_cohort_data.__query_name__: '<database>.<table>',
     add_cohort_data.__query_name__ + '_meta':
     """
         INSERT INTO <database>.<table>
@@ -892,4 +1356,10 @@ query_store = {
         FROM <database>.<table>
         WHERE ut_tag = %(tag_id)s
     """,
+    get_cohort_touched.__query_name__:
+    """
+        SELECT utm_touched
+        FROM <database>.<table>
+        WHERE utm_id = %(tag_id)s
+    """,
 }
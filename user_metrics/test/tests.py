@@ -15,8 +15,10 @@ from datetime import datetime, timedelta
 from dateutil.parser import parse as date_parse
 from collections import namedtuple
 
-from user_metrics.metrics import edit_count
-from user_metrics.metrics.users import UMP_MAP, USER_METRIC_PERIOD_TYPE
+from user_metrics.metrics import edit_count, revert_rate, threshold, \
+    time_to_threshold
+from user_metrics.metrics.users import UMP_MAP, USER_METRIC_PERIOD_TYPE, \
+    UserMetricPeriods, to_datetime64
 from user_metrics.config import settings
 from user_metrics.etl.data_loader import Connector, ConnectorError
 
@@ -36,6 +38,29 @@ def test_time_to_threshold():
     assert False  # TODO: implement your test here
 
 
+def test_time_to_threshold_bounded():
+    """
+        Test the threshold timestamps resolved from bounded histories.
+
+        1) Edits are located in the head of the history
+        2) LAST_EDIT is taken from the latest revision
+        3) Events that did not occur yield -1
+        4) Differences span days and may be negative
+    """
+    ttt = time_to_threshold
+    revs = ['20130101000000', '20130101010000', '20130101013000']
+    last_rev = '20130102000000'
+
+    assert ttt.minute_diff(ttt._edit_timestamp(revs, last_rev, 2),
+                           ttt._edit_timestamp(revs, last_rev, 0)) == 90
+    assert ttt.minute_diff(ttt._edit_timestamp(revs, last_rev,
+                                               ttt.LAST_EDIT),
+                           revs[0]) == 1440
+    assert ttt.minute_diff(revs[0], revs[2]) == -90
+    assert ttt.minute_diff(ttt._edit_timestamp(revs, last_rev, 3),
+                           revs[0]) == -1
+
+
 def test_edit_rate():
     assert False  # TODO: implement your test here
 
@@ -66,6 +91,17 @@ def test_threshold():
     assert False  # TODO: implement your test here
 
 
+def test_threshold_batch():
+    """ Test that batched Threshold agrees with per-user counts """
+    users = ['13234584', '13234503', '13234565', '13234585', '13234556']
+    for survival in [False, True]:
+        batched = threshold.Threshold(t=10000).process(
+            users, survival_=survival, batch_=True)
+        per_user = threshold.Threshold(t=10000).process(
+            users, survival_=survival, batch_=False)
+        assert sorted(batched.__iter__()) == sorted(per_user.__iter__())
+
+
 def test_survival():
     assert False  # TODO: implement your test here
 
@@ -78,6 +114,31 @@ def test_revert_rate():
     assert False  # TODO: implement your test here
 
 
+def test_revert_rate_window_scan():
+    """
+        Test the in-memory sha1 revert scan used by batched RevertRate.
+
+        1) A revision restored to a prior sha1 by another user is a revert
+        2) A self-revert is not counted
+        3) Reverts beyond ``look_ahead`` are not detected
+        4) Page revisions far apart are given windows of their own
+    """
+    window = [(1, 'a', 'x'), (2, 'b', 'y'), (3, 'c', 'x'), (4, 'b', 'y')]
+
+    assert revert_rate._revert_in_window(window, 1, 'y', 'b', 15, 15) == \
+        (3, 'c', 'x')
+    assert revert_rate._revert_in_window(window, 1, 'y', 'c', 15, 15) is None
+    assert revert_rate._revert_in_window(window, 3, 'y', 'b', 15, 15) is None
+    assert revert_rate._revert_in_window(window, 1, 'y', 'b', 15, 0) is None
+
+    args = namedtuple('Args', 'look_back look_ahead')(2, 2)
+    revs = [(30, 7, 'x', 'b'), (10, 7, 'y', 'b'), (12, 7, 'z', 'b'),
+            (11, 8, 'w', 'b')]
+    assert sorted(revert_rate._page_segments(revs, args)) == \
+        [(7, [(10, 7, 'y', 'b'), (12, 7, 'z', 'b')]), (7, [(30, 7, 'x', 'b')]),
+         (8, [(11, 8, 'w', 'b')])]
+
+
 def test_user():
     assert False  # TODO: implement your test here
 
@@ -152,6 +213,87 @@ def test_user_UMPRegInput():
         # @TODO check whether user's reg date is within input dates
 
 
+def test_user_metric_periods():
+    """
+        Test the ``UserMetricPeriods`` container.
+
+        1) Iteration yields MediaWiki timestamps for each user
+        2) Slices are containers that resolve to the same ranges
+        3) Negative indices count from the end
+    """
+    start = ['20130101000000', '20130102123000', '20130103235959']
+    end = ['20130102000000', '20130103123000', '20130104235959']
+    periods = UserMetricPeriods(['1', '2', '3'], to_datetime64(start),
+                                to_datetime64(end))
+
+    assert [tuple(rec) for rec in periods] == zip(['1', '2', '3'], start, end)
+    assert len(periods[1:]) == 2
+    assert list(periods[1:])[0] == periods[1] == ('2', start[1], end[1])
+    assert periods[-1] == ('3', start[2], end[2])
+    try:
+        periods[-4]
+        assert False
+    except IndexError:
+        pass
+
+
+def test_result_columns():
+    """
+        Test the ``ResultColumns`` container of metric results.
+
+        1) Columns are typed after the data model, rows are unchanged
+        2) Values that do not fit their type are kept in object columns
+        3) Appended rows are added to the columns
+        4) Ragged rows, even from a generator, are kept as a list
+    """
+    from user_metrics.metrics.user_metric import ResultColumns
+    from user_metrics.metrics.edit_count import EditCount
+
+    meta = {'id_fields': [0], 'integer_fields': [1], 'float_fields': [2]}
+    rows = [['1', 4, 0.5], ['2', 0, 1.5]]
+    results = ResultColumns.from_rows(rows, meta)
+
+    assert [c.dtype.kind for c in results.columns] == ['O', 'i', 'f']
+    assert list(results) == rows and results[1] == rows[1]
+    assert results[:1] == rows[:1] and results[::-1] == rows[::-1]
+
+    results = ResultColumns.from_rows([['1', None, 0.5]], meta)
+    assert results.column(1).dtype.kind == 'O'
+
+    results.append(['3', 2, 1])
+    assert len(results) == 2 and list(results)[1] == ['3', 2, 1.0]
+    assert ResultColumns.from_rows([['1', 4], ['2']], meta) is None
+
+    metric = EditCount()
+    metric._results = (row for row in [['1', 4], ['2']])
+    assert metric._results == [['1', 4], ['2']]
+
+
+def test_metric_params():
+    """
+        Test the parameter snapshots handed to pool workers.
+
+        1) Snapshots hold the init and process parameters of the metric
+        2) Snapshots survive pickling and are used by workers as they are
+    """
+    from cPickle import dumps, loads
+    from user_metrics.metrics.user_metric import UserMetric
+    from user_metrics.metrics.revert_rate import RevertRate
+
+    metric = RevertRate(look_ahead=5, project='dewiki')
+    metric.assign_attributes({'k_': 2}, 'process')
+    params = metric._pack_params()
+
+    assert type(params) is RevertRate._param_snapshot
+    assert not hasattr(params, '__dict__')
+    assert (params.look_ahead, params.project, params.k_) == (5, 'dewiki', 2)
+    assert ('batch_', True, bool) in list(params)
+
+    params = loads(dumps(params, 2))
+    assert UserMetric._unpack_params(params) is params
+    assert params.look_ahead == 5 and params.namespace == [0]
+
+
 # Query call tests
 # ================
 
@@ -199,6 +341,58 @@ def test_rev_len_query():
     assert 17039 == qSQL.rev_len_query(412553375, 'enwiki')
 
 
+def test_stream_results():
+    """
+        Test streaming of query results.
+
+        1) Rows or record batches are read in full and the connection kept
+        2) An abandoned stream discards its connection
+        3) A stream dropped before it is iterated discards its connection
+    """
+    rows = [(UID_1, 10, None), (UID_1, 4, 2), (UID_2, 7, 3)]
+
+    class Cursor(object):
+        description = [('rev_user',), ('rev_len',), ('parent_len',)]
+
+        def __init__(self):
+            self.rows = list(rows)
+
+        def fetchmany(self, size):
+            batch, self.rows = self.rows[:size], self.rows[size:]
+            return tuple(batch)
+
+        def close(self):
+            pass
+
+    class Connection(object):
+        state = None
+
+        def release(self):
+            self.state = 'released'
+
+        def discard(self):
+            self.state = 'discarded'
+
+    conn = Connection()
+    assert list(qSQL.ResultStream(conn, Cursor())) == rows
+    assert conn.state == 'released'
+
+    batches = list(qSQL.ResultStream(conn, Cursor(), batch_size=2))
+    assert [len(batch) for batch in batches] == [2, 1]
+    assert batches[0].rev_len.tolist() == [10, 4]
+    assert batches[1][0][0] == UID_2
+
+    stream = qSQL.ResultStream(conn, Cursor())
+    stream.next()
+    stream.close()
+    assert conn.state == 'discarded'
+
+    conn = Connection()
+    stream = qSQL.ResultStream(conn, Cursor())
+    del stream
+    assert conn.state == 'discarded'
+
+
 # ETL tests
 # =========
 
@@ -214,6 +408,223 @@ def test_connect_to_dbs():
         assert True
 
 
+def test_connection_pool_fork():
+    """
+        Test connection pools across a fork.
+
+        1) The child resets the pools it inherits
+        2) Neither idle nor checked out connections of the parent are closed
+    """
+    import gc
+    import multiprocessing as mp
+    from os import getpid
+    from time import time
+    from user_metrics.etl import data_loader
+
+    closes = mp.Value('i', 0)
+
+    class DB(object):
+        def close(self):
+            closes.value += 1
+
+    def connector():
+        conn = object.__new__(Connector)
+        conn._db_, conn._cur_, conn.pid = DB(), DB(), getpid()
+        return conn
+
+    instance = settings.connections.keys()[0]
+    saved = data_loader._pools.pop(instance, None)
+    pool = data_loader.get_pool(instance)
+    pool._idle.append([connector(), time()])
+    pool._size = 2
+    borrowed = data_loader.PooledConnection(pool, connector())
+
+    def child():
+        assert data_loader.get_pool(instance) is pool
+        assert pool.stats()['size'] == 0
+        borrowed.release()
+        gc.collect()
+
+    proc = mp.Process(target=child)
+    proc.start()
+    proc.join()
+    assert proc.exitcode == 0
+    assert closes.value == 0
+    assert pool.stats()['size'] == 2
+
+    borrowed.discard()
+    data_loader._pools.pop(instance)
+    if saved:
+        data_loader._pools[instance] = saved
+
+
+def test_bulk_loader():
+    """
+        Test bulk loading.
+
+        1) Rows are drawn from a generator in batches of one transaction
+        2) A refused LOAD DATA falls back to INSERTs of the file's rows
+        3) Fields are escaped for LOAD DATA files
+    """
+    import MySQLdb
+    from user_metrics.etl.data_loader import BulkLoader, tsv_field, \
+        tsv_values, ER_NOT_ALLOWED_COMMAND
+
+    class Cursor(object):
+        def __init__(self):
+            self.statements = []
+            self.last_rows = []
+
+        def execute(self, sql, params=None):
+            if sql.startswith('LOAD DATA'):
+                raise MySQLdb.OperationalError(ER_NOT_ALLOWED_COMMAND,
+                                               'Not allowed')
+
+        def executemany(self, sql, params):
+            self.statements.append((sql, len(params)))
+            self.last_rows.append(params[-1])
+
+    class Connection(object):
+        def __init__(self):
+            self.commits = 0
+            self._db_ = self
+            self._cur_ = Cursor()
+
+        def commit(self):
+            self.commits += 1
+
+    conn = Connection()
+    rows = ((uid, 'enwiki') for uid in xrange(2500))
+    loader = BulkLoader(conn, 'staging.t', columns=['uid', 'project'],
+                        method=BulkLoader.INSERT, batch_size=1000)
+    assert loader.load(rows) == 2500
+    assert [n for sql, n in conn._cur_.statements] == [1000, 1000, 500]
+    assert conn._cur_.statements[0][0] == \
+        'INSERT INTO staging.t (uid, project) VALUES (%s, %s)'
+    assert conn._db_.commits == 1
+
+    loader = BulkLoader(conn, 'staging.t', method=BulkLoader.INFILE,
+                        batch_size=1000, file_rows=1500)
+    assert loader.load([(uid,) for uid in xrange(2000)]) == 2000
+    assert loader.method == BulkLoader.INSERT
+    assert [n for sql, n in conn._cur_.statements[3:]] == [1000, 500, 500]
+    assert conn._cur_.last_rows[3:] == [('999',), ('1499',), (1999,)]
+
+    assert tsv_field(None) == '\\N' and tsv_field(True) == '1'
+    assert tsv_field(u'a\tb\\\n') == 'a\\tb\\\\\\n'
+    assert tsv_values('\\N\t' + tsv_field(u'a\tb\\\n') + '\n') == \
+        [None, 'a\tb\\\n']
+
+
+def test_tally_intervals():
+    """
+        Test binning of revisions into time series intervals.
+
+        1) Revisions are counted in the interval containing their timestamp
+        2) Threshold intervals exclude their start and include their end
+    """
+    from user_metrics.etl.time_series_process_methods import tally_intervals
+
+    edges = ['20130101000000', '20130102000000', '20130103000000']
+    revs = [(1, '20130101000000', 0), (1, '20130102120000', 0),
+            (2, '20130102000000', 0), (3, '20130101120000', 0)]
+
+    counts = tally_intervals('edit_count', ['1', '2'], edges, revs)
+    assert counts[:, :, 0].tolist() == [[1, 1], [0, 1]]
+
+    counts = tally_intervals('threshold', ['1', '2'], edges, revs)
+    assert counts[:, :, 0].tolist() == [[0, 1], [1, 0]]
+
+
+def test_interval_cache():
+    """
+        Test reuse of cached time series intervals.
+
+        1) Stored intervals are found, others are left to compute
+        2) Recent intervals are not cached
+    """
+    from os import close, remove
+    from datetime import datetime, timedelta
+    from tempfile import mkstemp
+    from user_metrics.utils.sqlite_store import SQLiteStore
+    from user_metrics.etl.time_series_process_methods import \
+        lookup_intervals, store_intervals
+
+    fd, path = mkstemp(suffix='.db')
+    close(fd)
+    cache = SQLiteStore(path, max_entries=10)
+    key_base = ['EditCount', 'list_sum_indices', [], 'cohort']
+
+    old = [datetime(2013, 1, 1), datetime(2013, 1, 2), datetime(2013, 1, 3)]
+    recent = [datetime.now() - timedelta(hours=1), datetime.now()]
+    rows = [[str(old[0]), str(old[1]), 'list_sum_indices', 5],
+            [str(recent[0]), str(recent[1]), 'list_sum_indices', 2]]
+    store_intervals(cache, key_base, rows)
+
+    cached, missing = lookup_intervals(
+        cache, key_base, [(old[0], old[1]), (old[1], old[2]),
+                          (recent[0], recent[1])])
+    assert cached == rows[:1]
+    assert missing == [(old[1], old[2]), (recent[0], recent[1])]
+    remove(path)
+
+
+def test_mergeable_aggregators():
+    """
+        Test merging partial aggregator states.
+
+        1) Merged states of partitions match the aggregate of all rows
+        2) Median falls back on the values of the partitions
+    """
+    from numpy import mean, median, std
+    from user_metrics.etl.aggregator import AggregatorMeta, BooleanRate, \
+        NumpyOp, ListSumByGroup, merge_states
+
+    rows = [[1, 0, 4], [2, 3, 8], [3, 1, 1], [4, 7, 2], [5, 0, 9]]
+
+    for agg in [BooleanRate(val_idx=1), ListSumByGroup(1),
+                NumpyOp(agg_meta=[AggregatorMeta('mean', 2, mean),
+                                  AggregatorMeta('std', 2, std),
+                                  AggregatorMeta('median', 1, median)])]:
+        states = [agg.update(agg.init(), rows[:2]),
+                  agg.update(agg.init(), rows[2:])]
+        merged = agg.finalize(merge_states(agg, states))
+        expected = agg.aggregate(rows)
+        if isinstance(agg, NumpyOp):
+            assert all(abs(x - y) < 1e-9 for x, y in zip(merged, expected))
+            assert abs(expected[0] - mean([4, 8, 1, 2, 9])) < 1e-9
+            assert expected[2] == 1.0
+        else:
+            assert sorted(merged) == sorted(expected)
+
+
+def test_quantile_sketch():
+    """
+        Test approximate quantiles.
+
+        1) Estimates of merged sketches are within the error bound
+        2) Minimum and maximum are exact
+    """
+    from random import Random
+    from user_metrics.etl.aggregator import QuantileSketch
+
+    rand = Random(1)
+    values = [rand.random() for _ in xrange(20000)]
+    sketch = QuantileSketch(error=0.02)
+    states = [sketch.init(), sketch.init()]
+    for idx, x in enumerate(values):
+        sketch.update(states[idx % 2], x)
+    state = sketch.merge(*states)
+
+    assert sum(len(level) for level in state[3]) < len(values) / 10
+    ranked = sorted(values)
+    for q in [0.05, 0.5, 0.95]:
+        rank = ranked.index(sketch.quantile(state, q))
+        assert abs(rank - q * len(values)) <= 0.02 * len(values)
+    assert sketch.quantile(state, 0) == ranked[0]
+    assert sketch.quantile(state, 1) == ranked[-1]
+
+
 # API tests
 # =========
 
@@ -222,9 +633,216 @@ def test_cohort_parse():
     assert False  # TODO: implement your test here
 
 
+def test_cohort_cache():
+    """
+        Test materialised cohorts.
+
+        1) A stored cohort is read back within the check interval
+        2) Cohorts are combined with AND, OR and NOT
+    """
+    from datetime import datetime
+    from shutil import rmtree
+    from tempfile import mkdtemp
+    from numpy import array, uint32
+    import user_metrics.api.engine as engine
+    from user_metrics.api.engine.cohort_cache import CohortCache
+
+    path = mkdtemp()
+    cache = CohortCache(path, check_interval=60)
+    touched = datetime(2013, 1, 1)
+    for tag_id, users in [(1, [1, 2, 3, 5]), (2, [2, 3, 4]), (3, [3, 9])]:
+        cache._store(cache._file(tag_id, touched), array(users, dtype=uint32))
+    assert cache.get(2).tolist() == [2, 3, 4]
+
+    get_cohort_cache = engine.get_cohort_cache
+    engine.get_cohort_cache = lambda: cache
+    try:
+        assert engine.parse_cohorts('1&2') == ['2', '3']
+        assert engine.parse_cohorts('1&^2~3') == ['1', '3', '5', '9']
+    finally:
+        engine.get_cohort_cache = get_cohort_cache
+        rmtree(path)
+
+
+def test_response_cache():
+    """
+        Test the API response cache.
+
+        1) Stored responses are returned by key
+        2) The least recently read entries are evicted beyond ``max_entries``
+        3) Reads within the touch interval do not write
+    """
+    from tempfile import mkdtemp
+    from user_metrics.api.engine.response_cache import ResponseCache
+
+    cache = ResponseCache(path=mkdtemp() + '/cache.db', max_entries=2,
+                          touch_interval=0)
+    cache.set('a', 'data_a', ['metric--a'])
+    cache.set('b', 'data_b', ['metric--b'])
+    assert cache.get('a') == 'data_a'
+
+    cache.set('c', 'data_c', ['metric--c'])
+    assert cache.get('b') is None
+    assert sorted(dict(cache.key_signatures()).keys()) == ['a', 'c']
+
+    cache.touch_interval = 300
+    changes = cache._conn().total_changes
+    assert cache.get('a') == 'data_a'
+    assert cache._conn().total_changes == changes
+
+
+def test_result_transport():
+    """
+        Test spooling request results.
+
+        1) Results are read back through the handle in order
+        2) The spool file is removed once read
+    """
+    from os.path import exists
+    from collections import OrderedDict
+    from user_metrics.api.engine.result_transport import write_result, \
+        read_result, decode_result
+
+    results = OrderedDict([('header', ['user_id', 'edit_count']),
+                           ('data', OrderedDict([('13234584', [18])]))])
+    handle = write_result(results)
+
+    assert decode_result(read_result(handle)) == results
+    assert not exists(handle.path)
+
+
+def test_job_registry():
+    """
+        Test the job registry.
+
+        1) A queued job is running until finished
+        2) Failures are kept when finished
+        3) Finished jobs beyond the limit are dropped
+        4) Adding a running job leaves it running
+        5) Unfinished jobs are failed when the controller starts
+    """
+    from os import close, remove
+    from tempfile import mkstemp
+    from user_metrics.api.engine.job_registry import JobRegistry
+
+    fd, path = mkstemp(suffix='.db')
+    close(fd)
+    registry = JobRegistry(path, retention=0, max_finished=1)
+
+    registry.add('a', 'cohort/metric')
+    registry.start('a')
+    registry.add('a', 'cohort/metric')
+    assert registry.get('a')['status'] == 'running'
+    assert registry.is_running('a')
+    registry.finish('a')
+    assert not registry.is_running('a')
+    assert registry.get('a')['status'] == 'success'
+
+    registry.add('b', 'cohort/metric?aggregator=sum')
+    registry.fail('b', 'Request failed.')
+    registry.finish('b')
+    assert [job['status'] for job in registry.list_jobs()] == ['failure']
+
+    registry.add('b', 'cohort/metric?aggregator=sum')
+    assert registry.get('b')['status'] == 'pending'
+    registry.fail_unfinished('Request lost.')
+    assert not registry.is_running('b')
+    assert registry.get('b')['message'] == 'Request lost.'
+    remove(path)
+
+
+def test_job_scheduler():
+    """
+        Test scheduling of pending requests.
+
+        1) Aggregate requests run before raw requests
+        2) An owner with a running job yields to other owners
+    """
+    from collections import namedtuple
+    from user_metrics.api.engine.job_scheduler import JobScheduler
+
+    req_type = namedtuple('Request', 'cohort_expr metric is_user '
+                                     'aggregator time_series')
+
+    scheduler = JobScheduler(slots=2)
+    scheduler.submit(req_type('ptwikimedia', 'edit_count', False, None,
+                              False), 'a')
+    first = scheduler.submit(req_type('ptwikimedia', 'bytes_added', False,
+                                      'mean', False), 'a')
+    other = scheduler.submit(req_type('eswikimedia', 'edit_count', False,
+                                      None, False), 'b')
+
+    assert scheduler.next_job() is first
+    scheduler.start(first, None)
+    assert scheduler.next_job() is other
+    scheduler.start(other, None)
+    assert scheduler.next_job() is None
+
+    scheduler.finish(first.id)
+    assert len(scheduler.pending) == 1
+
+
+def test_job_scheduler_coalescing():
+    """
+        Test coalescing of in-flight requests.
+
+        1) An identical request attaches to the running job
+        2) An aggregate request is held on its raw counterpart
+        3) A finished job is attached to until its response is stored
+    """
+    from user_metrics.api.engine.job_scheduler import JobScheduler
+    from user_metrics.api.engine.request_meta import RequestMetaFactory
+
+    def build_request(aggregator=None):
+        rm = RequestMetaFactory('ptwikimedia', '', 'edit_count')
+        rm.aggregator = aggregator
+        return rm
+
+    scheduler = JobScheduler(slots=2)
+    raw = scheduler.submit(build_request(), 'a')
+    scheduler.start(raw, None)
+
+    assert scheduler.submit(build_request(), 'b') is raw
+    agg = scheduler.submit(build_request('mean'), 'b')
+    assert raw.dependents == [agg]
+    assert scheduler.next_job() is None
+
+    scheduler.finish(raw.id)
+    scheduler.release(agg)
+    assert scheduler.next_job() is agg
+
+    assert scheduler.submit(build_request(), 'c') is raw
+    scheduler.forget(raw.key)
+    assert scheduler.submit(build_request(), 'c') is not raw
+
+
 # Utilities tests
 # ===============
 
 
 def test_recordtype():
     assert False  # TODO: implement your test here
+
+
+def test_timestamp_codec():
+    """
+        Test timestamp conversion.
+
+        1) MediaWiki timestamps and SQL datetimes agree with ``dateutil``
+        2) Columns convert to ``datetime64`` and epoch seconds
+    """
+    from dateutil.parser import parse as date_parse
+    from user_metrics.utils.timestamp import parse_timestamp, \
+        mediawiki_timestamp, to_datetime64, from_datetime64, to_epoch
+
+    for value in ['20130115152529', '2013-01-15 15:25:29',
+                  '2013-01-15T15:25:29', 'Jan 15 2013 15:25:29']:
+        assert parse_timestamp(value) == date_parse(value)
+        assert mediawiki_timestamp(value) == '20130115152529'
+    assert parse_timestamp(datetime(2013, 1, 15)) == datetime(2013, 1, 15)
+
+    values = ['20120229235959', '19700101000100', '20130101000000']
+    assert from_datetime64(to_datetime64(values)) == values
+    assert from_datetime64(to_datetime64(['2012-02-29 23:59:59'])) == \
+        values[:1]
+    assert to_epoch(values).tolist()[1] == 60
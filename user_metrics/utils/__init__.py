@@ -2,10 +2,14 @@
     Any general purpose utilities useful in the project are defined here.
 """
 
-MW_TIMESTAMP_FORMAT = "%Y%m%d%H%M%S"
-from dateutil.parser import parse as date_parse
 from collections import namedtuple, OrderedDict
 from hashlib import sha1
+from user_metrics.utils import timestamp
+from user_metrics.utils.timestamp import mediawiki_timestamp
+
+
+# Formerly defined here, kept for existing callers
+MW_TIMESTAMP_FORMAT = timestamp.MW_TIMESTAMP_FORMAT
 
 
 def format_mediawiki_timestamp(timestamp_repr):
@@ -17,13 +21,10 @@ def format_mediawiki_timestamp(timestamp_repr):
         ~~~~~~~~~~
 
         timestamp_repr : str|datetime
-           Datetime representation to convert.
+           Datetime representation to convert, see
+           ``user_metrics.utils.timestamp``.
     """
-    if hasattr(timestamp_repr, 'strftime'):
-        return timestamp_repr.strftime(MW_TIMESTAMP_FORMAT)
-    else:
-        return date_parse(timestamp_repr).strftime(
-            MW_TIMESTAMP_FORMAT)
+    return mediawiki_timestamp(timestamp_repr)
 
 
 def enum(*sequential, **named):
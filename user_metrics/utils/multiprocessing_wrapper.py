@@ -1,4 +1,3 @@
-
 """
     This module provides a set of methods for handling multi-threading
     patterns more easily. ::
@@ -6,49 +5,215 @@
         >>> import user_metrics.utils.multiprocessing_wrapper as mpw
         >>> mpw.build_thread_pool(['one','two'],len,2,[])
         [2,2]
+
+    Worker Executors
+    ~~~~~~~~~~~~~~~~
+
+    Work is submitted to long-lived executors rather than to a new pool per
+    call.  There is at most one executor per mode in a given process:
+
+        * ``MODE_PROCESS`` - a process backed pool for CPU-bound work
+        * ``MODE_THREAD`` - a thread backed pool for DB-bound work
+
+    Both draw on a single concurrency budget ``WORKER_BUDGET``
+    (``settings.__worker_budget__``, defaulting to the number of CPUs): a
+    task holds a slot of the budget while it runs.  The budget is created
+    when this module is imported and is inherited by every process forked
+    afterwards (the job controller, job processes, time series workers and
+    the executor workers themselves), so at most ``WORKER_BUDGET`` tasks run
+    at once across all of them.  Executors are recreated per process.  The
+    ``k`` argument of ``map_partitions`` and ``build_thread_pool`` now only
+    determines how the data is partitioned.  Submissions made from inside an
+    executor worker run inline in that worker so nested metric calls (e.g.
+    ``RevertRate`` computing revisions per user) reuse the slot they already
+    hold rather than forking another pool. ::
+
+        >>> mpw.map_partitions(users, _process_help, 10, args,
+                               mode=mpw.MODE_THREAD)
 """
 
+import atexit
 import multiprocessing as mp
 import multiprocessing.pool as mp_pool
 import math
+import threading
+from os import getpid
+
+from user_metrics.config import settings
 
 __author__ = "ryan faulkner"
 __date__ = "12/12/2012"
 __license__ = "GPL (version 2 or later)"
 
 
-def build_thread_pool(data, callback, k, args):
+MODE_PROCESS = 'process'
+MODE_THREAD = 'thread'
+
+# Global concurrency budget - maximum number of tasks running at once
+# across all executors of this process and the processes forked from it
+WORKER_BUDGET = getattr(settings, '__worker_budget__', mp.cpu_count())
+
+# Executors owned by this process keyed by mode
+_executors = dict()
+
+# Semaphore holding the slots of the budget.  Created once on import so that
+# forked children share it rather than each getting a budget of their own.
+_budget = mp.BoundedSemaphore(max(1, int(WORKER_BUDGET)))
+
+# Flags whether the current context is an executor worker.  Process workers
+# set the module level flag via the pool initializer, thread workers set the
+# thread local flag when executing a task.
+_in_process_worker = False
+_worker_local = threading.local()
+
+
+def _init_process_worker():
+    """ Initializer for process executor workers """
+    global _in_process_worker
+    _in_process_worker = True
+
+
+def in_worker():
+    """ Returns True if called from within an executor worker """
+    return _in_process_worker or getattr(_worker_local, 'active', False)
+
+
+class _Task(object):
     """
-        Handles initializing, executing, and cleanup for thread pools. Given
-        the iterable ``data`` and a thread count ``k`` partition the data and
-        execute ``k`` independent jobs on ``callback`` with ``args`` passed.
-        Finally combine the results of each job.
+        Wraps a callback to hold a slot of the budget while it executes.
+        Thread workers are also flagged for the duration of the call.
+    """
+
+    def __init__(self, callback, mode):
+        self._callback = callback
+        self._mode = mode
+
+    def __call__(self, arg):
+        _budget.acquire()
+        if self._mode == MODE_THREAD:
+            _worker_local.active = True
+        try:
+            return self._callback(arg)
+        finally:
+            if self._mode == MODE_THREAD:
+                _worker_local.active = False
+            _budget.release()
+
+
+class WorkerExecutor(object):
+    """
+        Long-lived pool of ``size`` workers.  ``mode`` is one of
+        ``MODE_PROCESS`` or ``MODE_THREAD``.  Tasks run within the budget
+        shared by all executors of the process and its forked children.
     """
 
-    # partition data
+    def __init__(self, mode=MODE_PROCESS, size=WORKER_BUDGET):
+        self.mode = mode
+        self.size = max(1, int(size))
+        self.pid = getpid()
+
+        if mode == MODE_THREAD:
+            self._pool = mp_pool.ThreadPool(processes=self.size)
+        elif mode == MODE_PROCESS:
+            self._pool = mp_pool.Pool(processes=self.size,
+                                      initializer=_init_process_worker)
+        else:
+            raise ValueError('Unknown executor mode: {0}'.format(mode))
+
+    def map(self, callback, arg_list):
+        """ Apply ``callback`` to each element of ``arg_list`` """
+        return self._pool.map(_Task(callback, self.mode), arg_list)
+
+    def submit(self, callback, arg):
+        """
+            Apply ``callback`` to ``arg`` asynchronously, returns the
+            ``AsyncResult`` of the task
+        """
+        return self._pool.apply_async(_Task(callback, self.mode), (arg,))
+
+    def shutdown(self):
+        """ Stop accepting work and wait on the workers """
+        self._pool.close()
+        self._pool.join()
+
+
+def get_executor(mode=MODE_PROCESS):
+    """
+        Returns the executor for ``mode`` owned by this process, creating it
+        if necessary.  Executors inherited through a fork are not reused.
+    """
+    executor = _executors.get(mode)
+    if executor is None or executor.pid != getpid():
+        executor = WorkerExecutor(mode=mode, size=WORKER_BUDGET)
+        _executors[mode] = executor
+    return executor
+
+
+def shutdown_executors():
+    """ Shut down all executors owned by this process """
+    for mode in _executors.keys():
+        executor = _executors.pop(mode)
+        if executor.pid == getpid():
+            executor.shutdown()
+
+
+atexit.register(shutdown_executors)
+
+
+def partition(data, k, args):
+    """
+        Split ``data`` into at most ``k`` contiguous chunks each paired with
+        ``args``.  Empty chunks are dropped.
+    """
+    k = max(1, int(k))
     n = int(math.ceil(float(len(data)) / k))
     arg_list = list()
 
     for i in xrange(k):
-        arg_list.append([data[i * n : (i + 1) * n], args])
+        arg_list.append([data[i * n: (i + 1) * n], args])
 
     # remove any args with empty revision lists
-    arg_list = filter(lambda x: len(x[0]), arg_list)
-    if not arg_list: return []
+    return filter(lambda x: len(x[0]), arg_list)
+
+
+def map_partitions(data, callback, k, args, mode=MODE_PROCESS):
+    """
+        Partition ``data`` into ``k`` chunks and execute ``callback`` on
+        each of them with ``args`` passed.  The results of each job are
+        combined.  Work is carried out by the executor for ``mode`` or
+        inline when already running within an executor worker.
+    """
+    arg_list = partition(data, k, args)
+    if not arg_list:
+        return []
+
+    if in_worker():
+        job_results = map(callback, arg_list)
+    else:
+        job_results = get_executor(mode).map(callback, arg_list)
 
-    pool = NonDaemonicPool(processes=len(arg_list))
     results = list()
-    # Call worker threads and aggregate results
-    if arg_list:
-        for elem in pool.map(callback, arg_list):
-            if hasattr(elem, '__iter__'):
-                results.extend(elem)
-            else:
-                results.extend([elem])
-    pool.terminate()
+    for elem in job_results:
+        if hasattr(elem, '__iter__'):
+            results.extend(elem)
+        else:
+            results.extend([elem])
     return results
 
 
+def build_thread_pool(data, callback, k, args):
+    """
+        Handles initializing, executing, and cleanup for thread pools. Given
+        the iterable ``data`` and a thread count ``k`` partition the data and
+        execute ``k`` independent jobs on ``callback`` with ``args`` passed.
+        Finally combine the results of each job.
+
+        Retained for compatibility, this delegates to ``map_partitions`` on
+        the process executor.
+    """
+    return map_partitions(data, callback, k, args, mode=MODE_PROCESS)
+
+
 class NoDaemonicProcess(mp.Process):
     """
         Sub-classes multiporcessing.Process always making the 'daemon'
@@ -72,4 +237,4 @@ class NonDaemonicPool(mp_pool.Pool):
         Sub-class multiprocessing.pool.Pool instead of multiprocessing.Pool
         because the latter is only a wrapper function, not a proper class.
     """
-    Process = NoDaemonicProcess
\ No newline at end of file
+    Process = NoDaemonicProcess
@@ -0,0 +1,179 @@
+"""
+    Persistent key/value store in an SQLite database file.
+
+    Entries are kept one row per key.  Lookups go through the primary key
+    index and each write is a single transaction, so the store never has to
+    be loaded or rewritten as a whole.  The database runs in WAL mode which
+    lets any number of processes read while one of them writes.  Each entry
+    may carry JSON encodable metadata alongside its data. ::
+
+        >>> from user_metrics.utils.sqlite_store import SQLiteStore
+        >>> store = SQLiteStore('/tmp/store.db', max_entries=1000)
+        >>> store.set(key, data, meta)
+        >>> store.get(key)
+
+    Entries older than ``ttl`` seconds are ignored when read and pruned on
+    write.  Once the number of entries exceeds ``max_entries`` the least
+    recently read entries are evicted.  Setting either to 0 disables the
+    corresponding check.
+
+    Reads only take the write lock to record the time an entry was read,
+    which is done at most every ``touch_interval`` seconds per entry.
+    Recency is therefore approximate to that interval.
+
+    The API response cache and the time series interval cache are built on
+    this store.
+"""
+
+__author__ = {
+    "ryan faulkner": "rfaulkner@wikimedia.org"
+}
+__date__ = "2013-04-02"
+__license__ = "GPL (version 2 or later)"
+
+import json
+import sqlite3
+import threading
+from os import getpid
+from time import time
+
+from user_metrics.config import logging
+
+
+# Seconds between updates of the time an entry was last read
+TOUCH_INTERVAL = 300
+
+# Seconds to wait on a locked database before failing
+LOCK_TIMEOUT = 30.0
+
+
+class SQLiteStoreError(Exception):
+    """ Basic exception class for the SQLite store """
+    def __init__(self, message="SQLite store operation failed."):
+        Exception.__init__(self, message)
+
+
+class SQLiteStore(object):
+    """
+        Key/value store backed by the SQLite database at ``path``.
+        Connections are opened per thread as SQLite connections may not be
+        shared between threads or forked processes.
+    """
+
+    CREATE_TABLE = """
+        CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            meta TEXT,
+            created REAL NOT NULL,
+            accessed REAL NOT NULL
+        )
+    """
+    CREATE_INDEX = """
+        CREATE INDEX IF NOT EXISTS entries_accessed
+        ON entries (accessed)
+    """
+
+    def __init__(self, path, ttl=0, max_entries=0,
+                 touch_interval=TOUCH_INTERVAL):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.touch_interval = touch_interval
+        self._local = threading.local()
+
+    def _conn(self):
+        """ Returns the connection of the calling thread """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != getpid():
+            try:
+                conn = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT,
+                                       isolation_level=None)
+                conn.text_factory = str
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute(self.CREATE_TABLE)
+                conn.execute(self.CREATE_INDEX)
+            except sqlite3.Error as e:
+                raise SQLiteStoreError(__name__ + ' :: Could not open '
+                                                  '{0}: {1}'.format(
+                                                      self.path, str(e)))
+            self._local.conn = conn
+            self._local.pid = getpid()
+        return conn
+
+    def _expired(self, created, now):
+        return self.ttl and created + self.ttl < now
+
+    def get(self, key):
+        """ Returns the data stored for ``key`` or None """
+        conn = self._conn()
+        now = time()
+        try:
+            row = conn.execute('SELECT data, created, accessed FROM '
+                               'entries WHERE key = ?', (key,)).fetchone()
+        except sqlite3.Error as e:
+            logging.error(__name__ + ' :: Could not read {0}: {1}'.format(
+                key, str(e)))
+            return None
+        if not row or self._expired(row[1], now):
+            return None
+
+        if row[2] + self.touch_interval <= now:
+            try:
+                conn.execute('UPDATE entries SET accessed = ? WHERE key = ?',
+                             (now, key))
+            except sqlite3.Error as e:
+                # The entry is still served, only its recency is stale
+                logging.error(__name__ + ' :: Could not touch {0}: '
+                                         '{1}'.format(key, str(e)))
+        return row[0]
+
+    def set(self, key, data, meta=None):
+        """
+            Stores ``data`` under ``key`` together with ``meta``.  Replaces
+            any existing entry.
+        """
+        conn = self._conn()
+        now = time()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('INSERT OR REPLACE INTO entries '
+                             '(key, data, meta, created, accessed) '
+                             'VALUES (?, ?, ?, ?, ?)',
+                             (key, data, json.dumps(meta), now, now))
+                self._evict(conn, now)
+                conn.execute('COMMIT')
+            except sqlite3.Error:
+                conn.execute('ROLLBACK')
+                raise
+        except sqlite3.Error as e:
+            raise SQLiteStoreError(__name__ + ' :: Could not write '
+                                              '{0}: {1}'.format(key, str(e)))
+
+    def delete(self, key):
+        """ Removes the entry for ``key`` """
+        self._conn().execute('DELETE FROM entries WHERE key = ?', (key,))
+
+    def _evict(self, conn, now):
+        """ Drops expired entries then the least recently read ones """
+        if self.ttl:
+            conn.execute('DELETE FROM entries WHERE created < ?',
+                         (now - self.ttl,))
+        if self.max_entries:
+            conn.execute('DELETE FROM entries WHERE key IN ('
+                         'SELECT key FROM entries '
+                         'ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+                         (self.max_entries,))
+
+    def meta_items(self):
+        """ Generates the ``(key, meta)`` pairs of live entries """
+        now = time()
+        for key, meta, created in self._conn().execute(
+                'SELECT key, meta, created FROM entries'):
+            if not self._expired(created, now):
+                yield key, json.loads(meta)
+
+    def __len__(self):
+        return self._conn().execute(
+            'SELECT COUNT(*) FROM entries').fetchone()[0]
@@ -0,0 +1,139 @@
+"""
+    Conversion of timestamps between MediaWiki, SQL datetime and NumPy
+    representations.
+
+    Timestamps read from the databases come in two fixed formats, MediaWiki
+    timestamps, e.g. '20130115152529', and SQL datetimes, e.g.
+    '2013-01-15 15:25:29'.  These are converted by slicing rather than by
+    ``dateutil`` which is only called on other inputs.  Whole columns are
+    converted at once with NumPy: ::
+
+        >>> from user_metrics.utils.timestamp import parse_timestamp, \\
+        ...     to_datetime64, to_epoch
+        >>> parse_timestamp('20130115152529')
+        datetime.datetime(2013, 1, 15, 15, 25, 29)
+        >>> to_datetime64(['20130115152529', '2013-01-16 00:00:00'])
+        array(['2013-01-15T15:25:29', '2013-01-16T00:00:00'],
+            dtype='datetime64[s]')
+        >>> to_epoch(['19700101000100'])
+        array([60])
+"""
+
+__author__ = "ryan faulkner"
+__email__ = "rfaulkner@wikimedia.org"
+__date__ = "04/15/2013"
+__license__ = "GPL (version 2 or later)"
+
+from datetime import datetime
+from dateutil.parser import parse as date_parse
+from numpy import array, ascontiguousarray, datetime_as_string, int64, \
+    uint8
+
+
+MW_TIMESTAMP_FORMAT = "%Y%m%d%H%M%S"
+
+# Length of MediaWiki timestamps and SQL datetimes
+MW_TIMESTAMP_LEN = 14
+SQL_DATETIME_LEN = 19
+
+
+def _is_mediawiki(value):
+    return len(value) == MW_TIMESTAMP_LEN and value.isdigit()
+
+
+def _is_sql_datetime(value):
+    return len(value) == SQL_DATETIME_LEN and value[4] == '-' and \
+        value[7] == '-' and value[10] in ' T' and value[13] == ':' and \
+        value[16] == ':'
+
+
+def parse_timestamp(value):
+    """
+        Returns a datetime for ``value``, a datetime, MediaWiki timestamp,
+        SQL datetime or any other representation understood by ``dateutil``.
+    """
+    if isinstance(value, datetime):
+        return value
+    elif hasattr(value, 'strftime'):
+        # date
+        return datetime(value.year, value.month, value.day)
+
+    value = str(value)
+    if _is_mediawiki(value):
+        return datetime(int(value[0:4]), int(value[4:6]), int(value[6:8]),
+                        int(value[8:10]), int(value[10:12]),
+                        int(value[12:14]))
+    elif _is_sql_datetime(value) and value[:4].isdigit():
+        try:
+            return datetime(int(value[0:4]), int(value[5:7]),
+                            int(value[8:10]), int(value[11:13]),
+                            int(value[14:16]), int(value[17:19]))
+        except ValueError:
+            pass
+    return date_parse(value)
+
+
+def mediawiki_timestamp(value):
+    """ Returns the MediaWiki timestamp of ``value``, see parse_timestamp """
+    if hasattr(value, 'strftime'):
+        return value.strftime(MW_TIMESTAMP_FORMAT)
+
+    value = str(value)
+    if _is_mediawiki(value):
+        return value
+    elif _is_sql_datetime(value):
+        mw_value = value[0:4] + value[5:7] + value[8:10] + value[11:13] + \
+            value[14:16] + value[17:19]
+        if mw_value.isdigit():
+            return mw_value
+    return date_parse(value).strftime(MW_TIMESTAMP_FORMAT)
+
+
+def to_datetime64(values):
+    """
+        Converts a sequence of timestamps to an array of ``datetime64[s]``.
+        Columns of MediaWiki timestamps are converted without a Python
+        call per element.
+    """
+    values = ascontiguousarray(values)
+    if not len(values):
+        return array([], dtype='datetime64[s]')
+
+    if values.dtype.kind != 'S' or values.dtype.itemsize != MW_TIMESTAMP_LEN:
+        values = array([mediawiki_timestamp(value) for value in values],
+                       dtype='S%d' % MW_TIMESTAMP_LEN)
+
+    digits = values.view(uint8).reshape(-1, MW_TIMESTAMP_LEN).astype(int64) \
+        - ord('0')
+    if ((digits < 0) | (digits > 9)).any():
+        # Strings of the right length that are not MediaWiki timestamps
+        values = array([mediawiki_timestamp(value) for value in values],
+                       dtype='S%d' % MW_TIMESTAMP_LEN)
+        digits = values.view(uint8).reshape(-1, MW_TIMESTAMP_LEN).\
+            astype(int64) - ord('0')
+
+    def field(start, end):
+        result = digits[:, start]
+        for idx in xrange(start + 1, end):
+            result = result * 10 + digits[:, idx]
+        return result
+
+    months = (field(0, 4) - 1970) * 12 + field(4, 6) - 1
+    days = months.astype('datetime64[M]').astype('datetime64[D]') + \
+        (field(6, 8) - 1)
+    return days.astype('datetime64[s]') + \
+        (field(8, 10) * 3600 + field(10, 12) * 60 + field(12, 14))
+
+
+def from_datetime64(timestamps):
+    """
+        Converts an array of ``datetime64`` to a list of MediaWiki
+        timestamps.
+    """
+    return [ts[0:4] + ts[5:7] + ts[8:10] + ts[11:13] + ts[14:16] + ts[17:19]
+            for ts in datetime_as_string(timestamps, unit='s')]
+
+
+def to_epoch(values):
+    """ Converts a sequence of timestamps to an array of epoch seconds """
+    return to_datetime64(values).astype(int64)